@@ -1,6 +1,9 @@
 """An assembler for the tiny virtual machine.
 (Initial, stripped down version.)
 
+Object code is written as JSON and, beside it, in the binary
+form of qbc.py, which the VM loads without parsing.
+
 This is a single-pass assembler with back-patching resolution.
 There are two approaches to "resolving" labels:
 (a) Two pass resolution: Run through the source code once to determine
@@ -14,10 +17,13 @@ There are two approaches to "resolving" labels:
 import re
 import sys
 import json
+import threading
 from pathlib import Path
 import argparse
 import configparser
-from typing import Dict, List,  Optional, Tuple
+import qbc
+import verify
+from typing import Dict, Iterable, List,  Optional, Set, Tuple
 
 import logging
 logging.basicConfig()
@@ -26,27 +32,30 @@ log.setLevel(logging.DEBUG)
 
 
 class Configuration:
-    def __init__(self):
+    def __init__(self, path: str = "asm.conf"):
         config = configparser.ConfigParser()
         try:
-            config.read("asm.conf")
+            config.read(path)
             self.tvmlib = Path(config["DEFAULT"]["TVMLIB"])
-        except FileExistsError:
+        except KeyError:
             # If no configuration file is present, we will look in ./OBJ
             self.tvmlib = Path("./OBJ")
 
 
-CONFIG = Configuration()  # Visible from any code
-
-
 def cli() -> object:
     parser = argparse.ArgumentParser(
-        description="Assemble tiny virtual machine module"
+        description="Assemble tiny virtual machine modules"
                     "into JSON-formatted object code"
     )
-    parser.add_argument("source", type=argparse.FileType("r"))
-    parser.add_argument("target", type=argparse.FileType("w"),
-                        nargs="?", default=sys.stdout)
+    parser.add_argument("sources", nargs="+",
+                        help="assembly files, optionally followed by "
+                             "the object file for a single source")
+    parser.add_argument("-o", "--output", metavar="DIR",
+                        help="write OBJ-style Class.json files to DIR "
+                             "for every source, in one process")
+    parser.add_argument("--no-super", action="store_true",
+                        help="do not use the superinstructions "
+                             "of opdefs.txt")
     return parser.parse_args()
 
 
@@ -58,38 +67,64 @@ def cli() -> object:
 #
 class ImportedModule:
     """Imported module uses information from
-    json file
+    json file (or from a module assembled in this process)
     """
-    def __init__(self, path: Path):
+    def __init__(self, methods: List[str], fields: List[str],
+                 arities: List[Optional[int]]):
+        self.methods: List[str] = methods
+        self.fields:  List[str] = fields
+        # Number of arguments of each method, if known
+        self.arities: List[Optional[int]] = arities
+        # Name -> position, so each operand is resolved in
+        # constant time however large the class is
+        self.method_slots = {name: i for i, name in enumerate(methods)}
+        self.field_slots = {name: i for i, name in enumerate(fields)}
+
+    @classmethod
+    def load(cls, path: Path) -> "ImportedModule":
         with open(path, "r") as source:
-            self.json = json.load(source)
-        # Dict from name to position would be faster, but
-        # number of lookups is very small
-        self.methods: List[str] = self.json["methods"]
-        self.fields:  List[str] = self.json["fields"]
+            struct = json.load(source)
+        # (Object files from before the verifier have no arities)
+        return cls(struct["methods"], struct["fields"],
+                   struct.get("arities", [None] * len(struct["methods"])))
 
     def method_slot(self, name: str) -> int:
-        if name in self.methods:
-            return self.methods.index(name)
+        if name in self.method_slots:
+            return self.method_slots[name]
         log.error(f"Method {name} not defined")
         return 0
 
     def n_methods(self) -> int:
         return len(self.methods)
 
-    def field_slot(self, name: str) -> int:
-        return self.fields.index(name)
+    def arity(self, slot: int) -> Optional[int]:
+        if 0 <= slot < len(self.arities):
+            return self.arities[slot]
+        return None
 
+    def field_slot(self, name: str) -> int:
+        return self.field_slots[name]
 
-IMPORTS: Dict[str, Optional[ImportedModule]] = { "$": None }
-# $ will be replaced by current class name in output .json file
 
+class Table:
+    """A table of operands too large for one word (call
+    targets, typeswitch classes, ...).  An instruction's
+    operand is the index of its entry, and equal entries
+    share an index.
+    """
+    def __init__(self):
+        self.entries: List[object] = []
+        self.index: Dict[tuple, int] = {}
 
-def import_module(module: str) -> ImportedModule:
-    if module not in IMPORTS:
-        path = CONFIG.tvmlib.joinpath(module).with_suffix(".json")
-        IMPORTS[module] = ImportedModule(path)
-    return IMPORTS[module]
+    def add(self, entry: object) -> int:
+        if isinstance(entry, dict):
+            key = tuple(sorted(entry.items()))
+        else:
+            key = tuple(entry)
+        if key not in self.index:
+            self.index[key] = len(self.entries)
+            self.entries.append(entry)
+        return self.index[key]
 
 
 # The named literals MUST match the definitions
@@ -151,9 +186,15 @@ class InstructionSet:
                 line = line.split("#")[0].strip()
                 if not line:
                     continue
+                # Superinstructions are not written in assembly
+                # code; select_superinstructions puts them in
+                if "=" in line:
+                    opcode += 1
+                    continue
                 # What remains should be an instruction definition
                 parts = line.split(",")
-                name, code, ops = parts
+                # (The stack effect and flow are for verify.py)
+                name, code, ops = parts[:3]
                 instr = InstructionDef(name, opcode, ops)
                 self.ops[name] = instr
                 opcode += 1
@@ -174,8 +215,8 @@ class InstructionSet:
 # after all).  Create stub symbol files for built-ins.
 # So assembler does a lot of the symbolic -> numeric resolution. 
 
-# Instruction set is a global
-INSTRS = InstructionSet("opdefs.txt")
+# The instruction set is read once by each Assembler, which
+# hands it to the object code of every module it translates.
 
 
 class Instruction:
@@ -212,14 +253,43 @@ UNRESOLVED_ADDRESS = -42  # Just an easily recognized value
 
 
 class ObjectCode:
-    def __init__(self):
+    def __init__(self, instrs: "InstructionSet", modules: "Assembler"):
+        self.instrs = instrs
+        # Source of imported modules (an Assembler, or a batch
+        # that assembles modules of its own first)
+        self.modules = modules
+        # Classes this module refers to, in the order the loader
+        # numbers them; $ will be replaced by the current class
+        # name in the output .json file
+        self.imports: Dict[str, int] = {"$": 0}
         # The following are initialized in declare_class
         self.class_name: str = ""
         self.super_name: str = ""
         self.method_list: List[str] = []
         self.field_list: List[str] = []
-        # Constant pool
-        self.constants: List[Tuple[str, int]] = []
+        # Number of arguments of each method in method_list
+        self.method_arities: List[Optional[int]] = []
+        # Name -> slot, for the lists above
+        self.method_slots: Dict[str, int] = {}
+        self.field_slots: Dict[str, int] = {}
+        # Constant pool, one entry per distinct (kind, value)
+        self.constants = Table()
+        # Operand text -> constant pool index
+        self.constant_operands: Dict[str, int] = {}
+        # Targets of direct calls, as (class index, method slot);
+        # the loader turns each into a code address
+        self.direct_calls = Table()
+        # Tail calls, as method slot (and class index, if direct)
+        # plus the shape of the calling method's frame, which the
+        # tail call replaces
+        self.tail_calls = Table()
+        # Typeswitches, each a list of the class indexes it tests
+        self.typeswitches = Table()
+        # Jump tables, each a list of the Int values it tests
+        self.jump_tables = Table()
+        # Counted loops, as the frame slots of the counter and of
+        # the end of the range (or the end itself) and the step
+        self.for_loops = Table()
         # Method code (instructions)
         self.code = []  # Will expand to code per method
         # For each method defined here, we want its
@@ -228,6 +298,14 @@ class ObjectCode:
         self.method_code: List[dict] = []
         self.method_locals: List[str] = []
         self.method_args: List[str] = []
+        # Name -> offset from the frame pointer, for both
+        self.frame_slots: Dict[str, int] = {}
+        # Calls of methods of this class, as (calls of the method,
+        # offset, slot), whose arity is looked up at the end since
+        # the method may be declared forward
+        self.calls_to_self: List[tuple] = []
+        # Whether verify.py passed the code
+        self.verified = False
         # Things to be resolved
         # Labels resolve to addresses within the code
         # of a method.
@@ -236,23 +314,33 @@ class ObjectCode:
         # address -> unresolved label
         self.label_patch: Dict[int, str] = {}
 
+    def import_module(self, module: str) -> ImportedModule:
+        if module not in self.imports:
+            self.imports[module] = len(self.imports)
+        return self.modules.import_module(module)
+
     def declare_class(self, name: str, super_name: str):
         self.class_name = name
         self.super_name = super_name
-        super_module = import_module(super_name)
+        super_module = self.import_module(super_name)
         # Methods and field list are initially those
         # we inherit, but may be extended elsewhere
-        # in the assembly code
-        self.method_list = super_module.methods
+        # in the assembly code.  They are copies, since
+        # the imported module is shared with other modules.
+        self.method_list = list(super_module.methods)
+        self.method_slots = dict(super_module.method_slots)
+        self.method_arities = list(super_module.arities)
         self.n_inherited = len(super_module.methods)
-        self.field_list = super_module.fields
+        self.field_list = list(super_module.fields)
+        self.field_slots = dict(super_module.field_slots)
         # AND we need to be able to refer to this class in NEW
 
     def declare_field(self, name: str):
         """Add a field to objects of this class;
         do this before methods.
         """
-        assert name not in self.field_list, "Field already exists"
+        assert name not in self.field_slots, "Field already exists"
+        self.field_slots[name] = len(self.field_list)
         self.field_list.append(name)
 
     def declare_method(self, method_name: str):
@@ -262,8 +350,7 @@ class ObjectCode:
         we define before (or without) calling from within
         the same class.
         """
-        if method_name not in self.method_list:
-            self.method_list.append(method_name)
+        self.add_method(method_name)
         # That's all!  We're just reserving a spot
         # in the vtable.  Bad things will happen if
         # it's not filled in later in the code.
@@ -276,22 +363,48 @@ class ObjectCode:
         # address -> unresolved label
         self.label_patch: Dict[int, str] = {}
         ###
-        if method_name not in self.method_list:
-            self.method_list.append(method_name)
-        method_slot = self.method_list.index(method_name)
+        method_slot = self.add_method(method_name)
+        # Until .args says otherwise
+        self.method_arities[method_slot] = 0
         # Initialize code block
         self.method_locals = []
+        self.method_args = []
+        self.frame_slots = {}
         self.code = []  # We will append instructions to this list
+        # offset -> source position, for the VM's profiler
+        self.sites: Dict[int, str] = {}
+        # offset -> number of arguments, of each call, for the verifier
+        self.calls: Dict[int, Optional[int]] = {}
+        # [offset, line] where the line of source changes, so the VM
+        # can tell where an error or a count comes from
+        self.lines: List[List[int]] = []
         self.method_code.append({"name": method_name, "slot": method_slot,
-                                 "code": self.code})
+                                 "args": 0, "locals": 0,
+                                 "code": self.code, "sites": self.sites,
+                                 "calls": self.calls, "lines": self.lines})
+
+    def add_method(self, method_name: str) -> int:
+        """Slot of a method, reserving one if it is new"""
+        if method_name not in self.method_slots:
+            self.method_slots[method_name] = len(self.method_list)
+            self.method_list.append(method_name)
+            self.method_arities.append(None)
+        return self.method_slots[method_name]
 
     def declare_locals(self, method_locals: List[str]):
         """Map local variable names to position in activation record"""
         self.method_locals = method_locals
+        self.method_code[-1]["locals"] = len(method_locals)
+        for local_num, var in enumerate(method_locals):
+            self.frame_slots[var] = 3 + local_num
 
     def declare_args(self, args: List[str]):
         """Map argument names to offsets *before* the frame pointer"""
         self.method_args = args
+        self.method_code[-1]["args"] = len(args)
+        self.method_arities[self.method_code[-1]["slot"]] = len(args)
+        for arg_num, var in enumerate(args):
+            self.frame_slots[var] = arg_num - len(args)
 
     def resolve_local(self, var: str) -> int:
         """Map local variable to position in activation record.
@@ -304,12 +417,8 @@ class ObjectCode:
         if var == "$":
             # Special case for the "this" variable
             return 0
-        if var in self.method_args:
-            arg_num = self.method_args.index(var)
-            return arg_num - len(self.method_args)
-        if var in self.method_locals:
-            local_num = self.method_locals.index(var)
-            return 3 + local_num
+        if var in self.frame_slots:
+            return self.frame_slots[var]
         log.error(f"Local variable {var} not declared in this method")
         return 88   # Just a placeholder; this code should not be used!
 
@@ -319,26 +428,45 @@ class ObjectCode:
         try:
             if class_name == "$":
                 # This class
-                method_slot = self.method_list.index(method_name)
+                method_slot = self.method_slots[method_name]
             else:
                 # Imported class
-                module_record = import_module(class_name)
+                module_record = self.import_module(class_name)
                 method_slot = module_record.method_slot(method_name)
         except LookupError:
             log.error(f"No such method '{full_name}'")
             method_slot = 0xBAD  # 2989 decimal
         return method_slot
 
+    def note_call(self, full_name: str, slot: int):
+        """Record how many arguments the call just added to the
+        code takes, for the verifier
+        """
+        class_name = full_name.split(":")[0]
+        offset = len(self.code) - 1
+        if class_name == "$":
+            self.calls_to_self.append((self.calls, offset, slot))
+        else:
+            self.calls[offset] = self.import_module(class_name).arity(slot)
+
+    def resolve_calls(self):
+        """Arities of calls of methods of this class, which
+        are all declared by now
+        """
+        for calls, offset, slot in self.calls_to_self:
+            calls[offset] = self.method_arities[slot]
+        self.calls_to_self = []
+
     def resolve_field(self, full_name: str) -> int:
         """Resolve Class:field to slot number"""
         class_name, field_name = full_name.split(":")
         try:
             if class_name == "$":
                 # This class
-                field_slot = self.field_list.index(field_name)
+                field_slot = self.field_slots[field_name]
             else:
                 # Imported class (is that legal in Quack?)
-                module_record = import_module(class_name)
+                module_record = self.import_module(class_name)
                 field_slot = module_record.field_slot(field_name)
         except LookupError:
             log.error(f"No such field '{full_name}'")
@@ -346,9 +474,9 @@ class ObjectCode:
         return field_slot
 
     def resolve_class(self, class_name: str) -> int:
-        import_module(class_name)  # In case we need to
-        index = list(IMPORTS).index(class_name)
-        return index
+        if class_name != "$":
+            self.import_module(class_name)  # In case we need to
+        return self.imports[class_name]
 
     def resolve_jumps(self):
         """Patch up references to code labels"""
@@ -374,6 +502,24 @@ class ObjectCode:
         self.str_constants.append(literal)
         return literal_index
 
+    def add_site(self, site: str):
+        """Source position of the next instruction, which the
+        VM keys its count of the instruction's events by
+        when it writes a profile.
+        """
+        self.sites[len(self.code)] = site
+
+    def add_line(self, line: int):
+        """Line of source of the next instruction and those after
+        it, until another line is given.  The table only grows
+        where the line changes.
+        """
+        offset = len(self.code)
+        if self.lines and self.lines[-1][0] == offset:
+            self.lines.pop()
+        if not self.lines or self.lines[-1][1] != line:
+            self.lines.append([offset, line])
+
     def add_label(self, label: str):
         """On a line by itself"""
         self.labels[label] = len(self.code)
@@ -401,22 +547,74 @@ class ObjectCode:
             # keep them together in one list to give them
             # consistent internal numbers that can be remapped
             # in the loader.
+            # A literal used many times is one entry of the pool.
             if operand in NAMED_LITERALS:
                 return NAMED_LITERALS[operand]
-            if re.match("[0-9]+", operand):
+            if operand in self.constant_operands:
+                return self.constant_operands[operand]
+            text = operand
+            if operand[0] in "0123456789":
                 kind = "i"
-            elif re.match('["][^"]*["]', operand):
+            elif operand[0] == '"':
                 kind = "s"
                 operand = operand.strip("\"").\
                     encode("utf-8").decode("unicode_escape")
             else:
                 log.error(f"Could not type operand '{operand}'")
                 kind = "BOGUS CONSTANT"
-            self.constants.append({"kind": kind, "value": operand})
-            return len(self.constants) - 1
+            index = self.constants.add({"kind": kind, "value": operand})
+            self.constant_operands[text] = index
+            return index
         if op == "call":
             slot = self.resolve_call(operand)
+            self.note_call(operand, slot)
             return slot
+        if op == "call_direct":
+            # The static receiver class has no subclass that overrides
+            # the method, so the vtable slot of that class (or of the
+            # class it inherits the method from) is the method called.
+            class_name = operand.split(":")[0]
+            target = {"class": self.resolve_class(class_name),
+                      "slot": self.resolve_call(operand)}
+            self.note_call(operand, target["slot"])
+            return self.direct_calls.add(target)
+        if op in ["tailcall", "tailcall_direct"]:
+            # The VM needs the target and also how many arguments
+            # and locals the current frame holds, which is more
+            # than one operand can say; so the operand is an index
+            # into a table of tail call descriptions.
+            target = {"slot": self.resolve_call(operand),
+                      "args": len(self.method_args),
+                      "locals": len(self.method_locals)}
+            if op == "tailcall_direct":
+                class_name = operand.split(":")[0]
+                target["class"] = self.resolve_class(class_name)
+            self.note_call(operand, target["slot"])
+            return self.tail_calls.add(target)
+        if op == "typeswitch":
+            # Operand is a comma-separated list of classes, which
+            # is kept in a table since it is more than one word
+            classes = [self.resolve_class(class_name)
+                       for class_name in operand.split(",")]
+            return self.typeswitches.add(classes)
+        if op == "jump_table":
+            # Operand is a comma-separated list of Int values,
+            # kept in a table like the classes of a typeswitch
+            values = [int(value) for value in operand.split(",")]
+            return self.jump_tables.add(values)
+        if op == "for_next":
+            # Operand is counter,end,step; the end is a local
+            # variable or an Int literal
+            counter, end, step = operand.split(",")
+            loop = {"counter": self.resolve_local(counter),
+                    "step": int(step)}
+            if end.isdigit():
+                loop["end"] = int(end)
+                loop["const"] = True
+            else:
+                loop["end"] = self.resolve_local(end)
+                loop["const"] = False
+            return self.for_loops.add(loop)
         if op in ["load_field", "store_field"]:
             # These operations use indexes into the fields of an object
             slot = self.resolve_field(operand)
@@ -425,13 +623,15 @@ class ObjectCode:
             # We use an index into the list of modules
             slot = self.resolve_class(operand)
             return slot
-        if op in ["load", "store"]:
+        if op in ["load", "store", "load_int", "store_int"]:
             return self.resolve_local(operand)
-        if op in ["return",  "alloc", "roll"]:
+        if op in ["return",  "alloc", "roll", "push_int"]:
             # These operations have integer operands that should be
             # resolved by the compiler
             return int(operand)
-        if op in ["jump", "jump_if", "jump_ifnot"]:
+        if op in ["jump", "jump_if", "jump_ifnot",
+                  "jump_ilt", "jump_ile", "jump_igt", "jump_ige",
+                  "jump_ieq", "jump_ine"]:
             # Operand is a label, which we may not have seen yet.
             # Leave it to be patched in the final label resolution step
             self.label_patch[len(self.code)] = operand
@@ -439,12 +639,13 @@ class ObjectCode:
         # Match should be exhaustive
         log.error(f"Unhandled operand type for {instr}")
 
-    def json(self) -> str:
-        struct = {
+    def struct(self) -> dict:
+        return {
             "class_name": self.class_name,
             "super": self.super_name,
-            "imports": [self.class_name] + list(IMPORTS)[1:],
+            "imports": [self.class_name] + list(self.imports)[1:],
             "methods": self.method_list,
+            "arities": self.method_arities,
             "fields": self.field_list,
             # It's just simpler to count fields and methods
             # in the assembler than in the loader, so we'll add
@@ -452,33 +653,128 @@ class ObjectCode:
             "n_fields": len(self.field_list),
             "n_methods": len(self.method_list),
             "n_inherited": self.n_inherited,
-            "constants": self.constants,
+            "constants": self.constants.entries,
+            "direct_calls": self.direct_calls.entries,
+            "tail_calls": self.tail_calls.entries,
+            "typeswitches": self.typeswitches.entries,
+            "jump_tables": self.jump_tables.entries,
+            "for_loops": self.for_loops.entries,
+            "verified": self.verified,
             "code": self.method_code
         }
-        return json.dumps(struct, indent=4)
+
+    def select_superinstructions(self, operations: List["verify.Operation"]):
+        """Use superinstructions in the code of each method"""
+        self.resolve_calls()
+        for method in self.method_code:
+            select_superinstructions(method, operations)
+
+    def verify(self, operations: List["verify.Operation"]):
+        """Check the code (see verify.py), recording whether it
+        passed and the stack each method needs
+        """
+        self.resolve_calls()
+        errors = verify.verify(self.struct(), operations)
+        for error in errors:
+            log.warning(f"Not verified: {error}")
+        self.verified = not errors
+
+    def json(self) -> str:
+        return json.dumps(self.struct(), indent=4)
+
+    def qbc(self) -> bytes:
+        """The binary object file, which the VM loads
+        without parsing
+        """
+        return qbc.encode(self.struct())
 
     def __str__(self) -> str:
         return self.json()
 
 
+# ----------------
+#  Superinstructions.  Once a method is assembled, each sequence
+#  of operations that a superinstruction of opdefs.txt does is
+#  replaced by it, trying the longest first, from the start of
+#  the method on.  A sequence that a jump enters in the middle
+#  stays as it is.  The code gets shorter, so jumps are adjusted,
+#  and the site, call and line of an operation move to where the
+#  VM sees that operation in its superinstruction (the word before
+#  its operand; see verify.Operation.steps).
+#
+
+def select_superinstructions(method: dict,
+                             operations: List["verify.Operation"]):
+    code = method["code"]
+    opcodes = {op.name: opcode for opcode, op in enumerate(operations)}
+    # Superinstructions by their first operation, longest first
+    supers: Dict[str, List["verify.Operation"]] = {}
+    for op in sorted((op for op in operations if op.parts),
+                     key=lambda op: -len(op.parts)):
+        supers.setdefault(op.parts[0].name, []).append(op)
+    instrs: List[Tuple[int, "verify.Operation"]] = []
+    pc = 0
+    while pc < len(code):
+        instrs.append((pc, operations[code[pc]]))
+        pc += operations[code[pc]].size()
+    targets = {pc + op.size() + code[pc + 1] for pc, op in instrs
+               if op.flow in ("jump", "branch")}
+
+    def matches(i: int, op: "verify.Operation") -> bool:
+        sequence = instrs[i:i + len(op.parts)]
+        return ([part.name for part in op.parts]
+                == [instr.name for _, instr in sequence]
+                and not any(pc in targets for pc, _ in sequence[1:]))
+
+    selected: List[int] = []
+    # Old offset of each operation -> new one
+    moved: Dict[int, int] = {}
+    # Operand offset of each jump -> old offset of its target
+    jumps: Dict[int, int] = {}
+    i = 0
+    while i < len(instrs):
+        super_op = next((op for op in supers.get(instrs[i][1].name, [])
+                         if matches(i, op)), None)
+        n = len(super_op.parts) if super_op else 1
+        selected.append(opcodes[super_op.name] if super_op
+                        else code[instrs[i][0]])
+        for pc, op in instrs[i:i + n]:
+            moved[pc] = len(selected) - 1
+            if op.n_operands:
+                if op.flow in ("jump", "branch"):
+                    jumps[len(selected)] = pc + op.size() + code[pc + 1]
+                selected.append(code[pc + 1])
+        i += n
+    moved[len(code)] = len(selected)
+    for offset, target in jumps.items():
+        selected[offset] = moved[target] - (offset + 1)
+    code[:] = selected
+    for table in ["sites", "calls"]:
+        entries = {moved[offset]: value
+                   for offset, value in method[table].items()}
+        method[table].clear()
+        method[table].update(entries)
+    lines = dict((moved[offset], line) for offset, line in method["lines"])
+    method["lines"][:] = [[offset, line] for offset, line in lines.items()]
+
+
 # ----------------
 #  Assembly code is line-oriented and can be parsed
 #  with regular expressions.  We strip away comments
 #  and then scan for label, operation, and operand fields.
+#  The first token decides which pattern a line can match:
+#  a directive starts with ".", and anything else is an
+#  instruction, a label, or both.
 #
 
 def strip_comments(line: str) -> str:
-    return line.split("#")[0].strip()
+    return line.partition("#")[0].strip()
     # Note comment lines will now be empty,
     # as will blank lines.
 
 
-# Instruction pattern (single operation of vm)
-INSTR_PAT = re.compile(r"""
-    ((?P<label> \w+) [:] )?   # Optional label
-    \s*
-    (?P<opname> [a-zA-Z_]+)      # Operation name is required
-    (\s+ (?P<operand>     # Operands are integers, quoted strings, or names
+# Operand of an instruction
+OPERAND = r"""
              [0-9]+           # Integers are strings of digits
            |
              ["](             # String begins and ends with quote 
@@ -487,11 +783,26 @@ INSTR_PAT = re.compile(r"""
              )*["]
            |
              (\w|[:$])+         # name, which may be part:part or $:part
+             (,-?(\w|[$])+)*   # or a list of names or numbers
+"""
+OPERAND_PAT = re.compile(OPERAND, re.VERBOSE)
+
+# Instruction pattern (single operation of vm)
+INSTR_PAT = re.compile(r"""
+    ((?P<label> \w+) [:] )?   # Optional label
+    \s*
+    (?P<opname> [a-zA-Z_]+)      # Operation name is required
+    (\s+ (?P<operand>     # Operands are integers, quoted strings, or names
+""" + OPERAND + r"""
              )
     )?                # Operand is optional
    \s*
     """, re.VERBOSE)
 
+# Parts of an instruction line, when it is split at spaces
+NAME_PAT = re.compile(r"\w+")
+OPNAME_PAT = re.compile(r"[a-zA-Z_]+")
+
 # Bare labels
 LABEL_PAT = re.compile(r"""
     ((?P<label> \w+):)   # Nothing but the label
@@ -540,6 +851,21 @@ LOCALS_DECL_PAT = re.compile(r"""
 \s*
 """, re.VERBOSE)
 
+# Source span (line:column-line:column) of the next instruction,
+#   by which the VM's profiler names it
+SITE_DECL_PAT = re.compile(r"""
+[.]site \s+
+(?P<site> [0-9]+:[0-9]+-[0-9]+:[0-9]+[+]?)
+\s*
+""", re.VERBOSE)
+
+# Line of source of the instructions that follow
+LINE_DECL_PAT = re.compile(r"""
+[.]line \s+
+(?P<line> [0-9]+)
+\s*
+""", re.VERBOSE)
+
 # Method argument:
 #    These will have addresses that are at a negative
 #    offset from the frame pointer
@@ -550,83 +876,168 @@ ARGS_DECL_PAT = re.compile(r"""
 """, re.VERBOSE)
 
 
-def translate(lines: List[str]) -> ObjectCode:
-    code = ObjectCode()
-    for line in lines:
-        line = strip_comments(line)
-        if not line:
-            continue
+# Kinds of assembly language line, by the directive they start with
 
-        # Kinds of assembly language line:
-        # Class declaration (.class)
-        match = CLASS_DECL_PAT.match(line)
-        if match:
-            class_name = match.groupdict()["class_name"]
-            superclass_name = match.groupdict()["super_name"]
-            code.declare_class(class_name, superclass_name)
-            continue
+def class_decl(code: ObjectCode, match: re.Match):
+    # Class declaration (.class)
+    class_name = match.groupdict()["class_name"]
+    superclass_name = match.groupdict()["super_name"]
+    code.declare_class(class_name, superclass_name)
 
-        # Method (.method f forward) to be filled in later
-        match = METHOD_DECL_PAT.match(line)
-        if match:
-            method_name = match.groupdict()["method_name"]
-            code.declare_method(method_name)
-            continue
 
-        # Method (.method) followed immediately by body
-        match = METHOD_DEF_PAT.match(line)
-        if match:
-            method_name = match.groupdict()["method_name"]
-            code.begin_method(method_name)
-            continue
+def method_decl(code: ObjectCode, match: re.Match):
+    # Method (.method f forward) to be filled in later
+    code.declare_method(match.groupdict()["method_name"])
 
-        # Field declaration, ".field name"
-        match = FIELD_DECL_PAT.match(line)
-        if match:
-            field_name = match.groupdict()["field_name"]
-            code.declare_field(field_name)
+
+def method_def(code: ObjectCode, match: re.Match):
+    # Method (.method) followed immediately by body
+    code.begin_method(match.groupdict()["method_name"])
+
+
+def field_decl(code: ObjectCode, match: re.Match):
+    # Field declaration, ".field name"
+    code.declare_field(match.groupdict()["field_name"])
+
+
+def locals_decl(code: ObjectCode, match: re.Match):
+    # Local variable declaration, ".local name,name,name"
+    locals_name_list = match.groupdict()["local_var_name"]
+    method_locals = locals_name_list.split(",")
+    n_locals = len(method_locals)
+    # Allocate space on stack for local variables
+    code.add_instruction(Instruction(
+        label=None,
+        operation=code.instrs["alloc"],
+        operand=n_locals))
+    # Now set up locals symbol table information
+    code.declare_locals(method_locals)
+
+
+def args_decl(code: ObjectCode, match: re.Match):
+    # Argument declaration, ".args name,name,name"
+    locals_name_list = match.groupdict()["arg_var_name"]
+    args = locals_name_list.split(",")
+    # No space allocation needed, unlike local variables,
+    # because these are *before* (at negative offsets from)
+    # the frame pointer.
+    # Set up locals symbol table information
+    code.declare_args(args)
+
+
+def site_decl(code: ObjectCode, match: re.Match):
+    # Source span of a profiled instruction, ".site 3:5-3:12"
+    code.add_site(match.groupdict()["site"])
+
+
+def line_decl(code: ObjectCode, match: re.Match):
+    # Line of source the code that follows comes from, ".line 12"
+    code.add_line(int(match.groupdict()["line"]))
+
+
+# Directive -> the patterns its line may match, in order,
+# each with what to do with a match
+DIRECTIVES = {
+    ".class": [(CLASS_DECL_PAT, class_decl)],
+    ".method": [(METHOD_DECL_PAT, method_decl),
+                (METHOD_DEF_PAT, method_def)],
+    ".field": [(FIELD_DECL_PAT, field_decl)],
+    ".local": [(LOCALS_DECL_PAT, locals_decl)],
+    ".args": [(ARGS_DECL_PAT, args_decl)],
+    ".site": [(SITE_DECL_PAT, site_decl)],
+    ".line": [(LINE_DECL_PAT, line_decl)]
+}
+
+
+# How many distinct instruction lines translate remembers
+PARSED_LINES = 4096
+
+
+def split_instruction(line: str) -> Optional[Tuple[Optional[str], str,
+                                                   Optional[str]]]:
+    """Label, operation and operand of an instruction line,
+    found by splitting it at spaces rather than by INSTR_PAT.
+    None if the line is not so simple, and so must be matched
+    against the patterns.
+    """
+    label = None
+    head, *rest = line.split(None, 1)
+    if ":" in head:
+        label, head = head.split(":", 1)
+        if not NAME_PAT.fullmatch(label):
+            return None
+        if not head:
+            if not rest:
+                return label, "", None
+            head, *rest = rest[0].split(None, 1)
+    if not OPNAME_PAT.fullmatch(head):
+        return None
+    if not rest:
+        return label, head, None
+    operand = rest[0]
+    if not OPERAND_PAT.fullmatch(operand):
+        return None
+    return label, head, operand
+
+
+def translate(lines: Iterable[str], code: ObjectCode) -> ObjectCode:
+    """Assemble lines into code, which is empty to begin with.
+    Lines are read one at a time, so they may come straight
+    from a file of any size.
+    """
+    # Instruction line -> its parts, since generated code
+    # repeats the same few lines ("load x", "call Int:PLUS")
+    # over and over; bounded, so memory does not grow with
+    # the size of the input
+    parsed: Dict[str, Optional[tuple]] = {}
+    for line in lines:
+        line = line.partition("#")[0].strip()
+        if not line:
             continue
 
-        # Local variable declaration, ".local name,name,name"
-        match = LOCALS_DECL_PAT.match(line)
-        if match:
-            locals_name_list = match.groupdict()["local_var_name"]
-            method_locals = locals_name_list.split(",")
-            n_locals = len(method_locals)
-            # Allocate space on stack for local variables
-            code.add_instruction(Instruction(
-                label=None,
-                operation=INSTRS["alloc"],
-                operand=n_locals))
-            # Now set up locals symbol table information
-            code.declare_locals(method_locals)
+        if line[0] == ".":
+            # A directive
+            patterns = DIRECTIVES.get(line.split(None, 1)[0], [])
+            for pattern, action in patterns:
+                match = pattern.match(line)
+                if match:
+                    action(code, match)
+                    break
+            else:
+                log.error(f"NO MATCH on '{line}'")
             continue
 
-        # Local variable declaration, ".local name,name,name"
-        match = ARGS_DECL_PAT.match(line)
-        if match:
-            locals_name_list = match.groupdict()["arg_var_name"]
-            args = locals_name_list.split(",")
-            # No space allocation needed, unlike local variables,
-            # because these are *before* (at negative offsets from)
-            # the frame pointer.
-            # Set up locals symbol table information
-            code.declare_args(args)
+        # An operation (label: operation operand), which is
+        # usually simple enough to take apart without a pattern
+        if line in parsed:
+            parts = parsed[line]
+        else:
+            parts = split_instruction(line)
+            if parts and parts[1]:
+                label, opname, operand = parts
+                parts = label, code.instrs[opname], operand
+            if len(parsed) < PARSED_LINES:
+                parsed[line] = parts
+        if parts:
+            label, operation, operand = parts
+            if not operation:
+                # A label with no instruction
+                code.add_label(label)
+            else:
+                code.add_instruction(Instruction(label, operation, operand))
             continue
 
-        # An operation (label: operation operand)
         match = INSTR_PAT.fullmatch(line)
         if match:
             parts = match.groupdict()
             label = parts["label"]
             opname = parts["opname"]
             operand = parts["operand"]
-            instruction = Instruction(label, INSTRS[opname], operand)
+            instruction = Instruction(label, code.instrs[opname], operand)
             code.add_instruction(instruction)
             continue
 
         # A label with no instruction
-        # An operation (label: operation operand)
         match = LABEL_PAT.match(line)
         if not match:
             log.error(f"NO MATCH on '{line}'")
@@ -635,18 +1046,214 @@ def translate(lines: List[str]) -> ObjectCode:
         label = parts["label"]
         code.add_label(label)
 
-
-
     code.resolve_jumps()  # Of the last method entered
     return code
 
 
+# ----------------
+#  The assembler proper.  It owns everything that used to be
+#  global: the configuration, the instruction set, and the cache
+#  of imported modules, which every module it assembles shares.
+#  The cache is guarded by a lock, and all other state of an
+#  assembly lives in its ObjectCode, so one Assembler may be
+#  used from several threads at once.
+#
+
+class Assembler:
+    def __init__(self, config: str = "asm.conf",
+                 opdefs: str = "opdefs.txt",
+                 tvmlib: Optional[Path] = None,
+                 superinstructions: bool = True):
+        self.tvmlib = tvmlib or Configuration(config).tvmlib
+        self.instrs = InstructionSet(opdefs)
+        self.operations = verify.operations(opdefs)
+        self.superinstructions = superinstructions
+        self.modules: Dict[str, ImportedModule] = {}
+        self.lock = threading.Lock()
+
+    def import_module(self, module: str) -> ImportedModule:
+        with self.lock:
+            if module not in self.modules:
+                path = self.tvmlib.joinpath(module).with_suffix(".json")
+                self.modules[module] = ImportedModule.load(path)
+            return self.modules[module]
+
+    def add_module(self, code: ObjectCode):
+        """Modules assembled later in this process import this
+        one as assembled, not as its (possibly stale) object file
+        """
+        module = ImportedModule(list(code.method_list),
+                                list(code.field_list),
+                                list(code.method_arities))
+        with self.lock:
+            self.modules[code.class_name] = module
+
+    def translate(self, lines: Iterable[str],
+                  modules: Optional["Batch"] = None) -> ObjectCode:
+        code = translate(lines, ObjectCode(self.instrs, modules or self))
+        if code.class_name:
+            if self.superinstructions:
+                code.select_superinstructions(self.operations)
+            code.verify(self.operations)
+            self.add_module(code)
+        return code
+
+    def assemble_files(self, paths: List[Path]) -> List[ObjectCode]:
+        """Assemble several source files, in one process"""
+        return Batch(self, paths).run()
+
+
+class Batch:
+    """Source files assembled together.  A module that imports
+    another module of the batch gets it as assembled from its
+    source, whatever order the files were given in.  Modules
+    that refer to each other (a class and one it calls, which
+    calls it back) cannot each be assembled first; a module
+    still being assembled is imported as its source declares
+    it, from the declarations of its class, fields, methods and
+    their arguments, read before anything is assembled.
+    """
+    def __init__(self, assembler: Assembler, paths: List[Path]):
+        self.assembler = assembler
+        self.sources = list(paths)
+        # class name -> source, for sources not yet assembled
+        self.pending: Dict[str, Path] = {}
+        # source -> class name
+        self.names: Dict[Path, str] = {}
+        # class name -> (superclass, fields, methods, arities)
+        # as declared in its source
+        self.headers: Dict[str, tuple] = {}
+        # classes being assembled
+        self.active: Set[str] = set()
+        for path in paths:
+            with open(path, "r") as source:
+                header = read_header(source)
+            if header:
+                class_name = header[0]
+                self.pending[class_name] = path
+                self.names[path] = class_name
+                self.headers[class_name] = header[1:]
+        self.results: Dict[Path, ObjectCode] = {}
+
+    def import_module(self, module: str) -> ImportedModule:
+        if module in self.active:
+            return self.declared_module(module)
+        path = self.pending.pop(module, None)
+        if path is not None:
+            self.assemble(path)
+        return self.assembler.import_module(module)
+
+    def declared_module(self, module: str) -> ImportedModule:
+        """A module as its source declares it"""
+        super_name, fields, methods, arities = self.headers[module]
+        super_module = self.import_module(super_name)
+        method_list = list(super_module.methods)
+        method_arities = list(super_module.arities)
+        for name, arity in zip(methods, arities):
+            if name in super_module.method_slots:
+                method_arities[super_module.method_slots[name]] = arity
+            else:
+                method_list.append(name)
+                method_arities.append(arity)
+        return ImportedModule(method_list, list(super_module.fields) + fields,
+                              method_arities)
+
+    def assemble(self, path: Path):
+        class_name = self.names.get(path)
+        self.active.add(class_name)
+        with open(path, "r") as source:
+            self.results[path] = self.assembler.translate(source, self)
+        self.active.discard(class_name)
+
+    def run(self) -> List[ObjectCode]:
+        for path in self.sources:
+            if path in self.results:
+                continue
+            self.pending.pop(self.names.get(path), None)
+            self.assemble(path)
+        return [self.results[path] for path in self.sources]
+
+
+def read_header(lines: Iterable[str]) -> Optional[tuple]:
+    """Class name, superclass, fields, methods (in the order
+    they get slots, after those inherited) and the number of
+    arguments of each (None if only declared) of an assembly
+    source, found from its directives alone
+    """
+    header = None
+    fields: List[str] = []
+    methods: List[str] = []
+    arities: List[Optional[int]] = []
+    # Slot of the method being defined
+    current = None
+    for line in lines:
+        line = strip_comments(line).strip()
+        if not line.startswith("."):
+            continue
+        directive = line.split(None, 1)[0]
+        if directive == ".class":
+            match = CLASS_DECL_PAT.match(line)
+            if match:
+                header = match.group("class_name"), match.group("super_name")
+        elif directive == ".field":
+            match = FIELD_DECL_PAT.match(line)
+            if match:
+                fields.append(match.group("field_name"))
+        elif directive == ".method":
+            forward = METHOD_DECL_PAT.match(line)
+            match = forward or METHOD_DEF_PAT.match(line)
+            if not match:
+                continue
+            name = match.group("method_name")
+            if name not in methods:
+                methods.append(name)
+                arities.append(None)
+            if not forward:
+                # Until .args says otherwise, as in begin_method
+                current = methods.index(name)
+                arities[current] = 0
+        elif directive == ".args" and current is not None:
+            match = ARGS_DECL_PAT.match(line)
+            if match:
+                arities[current] = len(match.group("arg_var_name").split(","))
+    if header is None:
+        return None
+    return header + (fields, methods, arities)
+
+
+def write_object(objcode: ObjectCode, path: Path):
+    """Write the JSON object file, and the binary one
+    beside it (path with suffix .qbc)
+    """
+    with open(path, "w") as target:
+        print(objcode.json(), file=target)
+    with open(path.with_suffix(".qbc"), "wb") as target:
+        target.write(objcode.qbc())
+
+
 def main():
-    """Assemble one file into object code in json format"""
+    """Assemble files into object code in json and binary format"""
     args = cli()
-    source = [line for line in args.source]
-    objcode = translate(source)
-    print(objcode.json(), file=args.target)
+    assembler = Assembler(superinstructions=not args.no_super)
+    if args.output:
+        # Batch: every source to DIR/Class.json
+        out_dir = Path(args.output)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        paths = [Path(source) for source in args.sources]
+        for path, objcode in zip(paths,
+                                 assembler.assemble_files(paths)):
+            name = objcode.class_name or path.stem
+            write_object(objcode, out_dir.joinpath(name).with_suffix(".json"))
+        return
+    # Single source, to a named object file or stdout
+    if len(args.sources) > 2:
+        sys.exit("assemble.py: use -o DIR to assemble several sources")
+    with open(args.sources[0], "r") as source:
+        objcode = assembler.translate(source)
+    if len(args.sources) == 2:
+        write_object(objcode, Path(args.sources[1]))
+    else:
+        print(objcode.json())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+"""Compare the interpreters of pyvm.py.
+
+Runs each program with the closure-compiling interpreter and
+with the one that decodes code words as it goes, checks that
+they print the same, and lists the time each took, the best of
+a few runs, e.g.
+
+    python3 bench_pyvm.py tests/OBJ/Pair.json work/OBJ/Main.json
+
+Each program is named by the object file of its main class;
+the other classes are loaded from the same directory.  The time
+of the closure interpreter includes compiling the methods.
+"""
+
+import io
+import sys
+import time
+import argparse
+from pathlib import Path
+from typing import List, Tuple
+
+import pyvm
+import verify
+
+
+def timed(engine: type, program_class: str, library: str,
+          ops: List[verify.Operation], repeat: int) -> Tuple[float, str]:
+    """Best time of repeat runs, and what the program printed"""
+    best = float("inf")
+    printed = ""
+    for _ in range(repeat):
+        out = io.StringIO()
+        program = pyvm.load([program_class], library, ops)
+        start = time.perf_counter()
+        try:
+            engine(program, out).run(program_class)
+        except pyvm.VMError as e:
+            # Still comparable: both stop at the same place
+            out.write(f"{e}\n")
+        best = min(best, time.perf_counter() - start)
+        printed = out.getvalue()
+    return best, printed
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Time the interpreters of pyvm.py against each other")
+    parser.add_argument("mains", nargs="+",
+                        help="OBJ/Main.json (or .qbc) of each program")
+    parser.add_argument("--opdefs", default="opdefs.txt")
+    parser.add_argument("-n", "--repeat", type=int, default=3,
+                        help="runs of each, of which the best counts "
+                             "(default 3)")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    ops = verify.operations(args.opdefs)
+    width = max(len(name) for name in args.mains + ["program"])
+    print(f"{'program':{width}} {'switch':>10} {'closure':>10} {'speedup':>8}")
+    total_switch = total_closure = 0.0
+    ok = True
+    for main_file in args.mains:
+        path = Path(main_file)
+        try:
+            switch_time, switch_out = timed(pyvm.SwitchInterpreter, path.stem,
+                                            str(path.parent), ops, args.repeat)
+            closure_time, closure_out = timed(pyvm.ClosureInterpreter,
+                                              path.stem, str(path.parent),
+                                              ops, args.repeat)
+        except pyvm.VMError as e:
+            print(f"{main_file}: {e}", file=sys.stderr)
+            ok = False
+            continue
+        total_switch += switch_time
+        total_closure += closure_time
+        note = ""
+        if switch_out != closure_out:
+            note = "  (output differs)"
+            ok = False
+        print(f"{main_file:{width}} {switch_time:10.4f} {closure_time:10.4f} "
+              f"{switch_time / closure_time:7.2f}x{note}")
+    if total_closure:
+        print(f"{'total':{width}} {total_switch:10.4f} {total_closure:10.4f} "
+              f"{total_switch / total_closure:7.2f}x")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 """Build table mapping integer byte codes to function pointers.
 Machine operations, their names, and the number of operands
-for each are given in opdefs.txt.
+for each are given in opdefs.txt.  So are superinstructions,
+each a sequence of those operations, for which we generate
+a function that calls theirs in turn.
 """
 import argparse
 import datetime
@@ -26,12 +28,14 @@ PROLOGUE = f"""
  */
  
 #include "vm_code_table.h"
-op_tbl_entry vm_op_bytecodes[] = {LB}
 """
 
+TABLE = f"""
+op_tbl_entry vm_op_bytecodes[] = {LB}"""
+
 # Fixed code at end of generated file
 CODA = """
-    { 0, 0, 0}  // SENTRY
+    { 0, 0, 0, 0}  // SENTRY
 };
 """
 
@@ -49,10 +53,33 @@ def cli() -> object:
     return args
 
 
+def superinstruction(name: str, parts: list, ops: dict,
+                     outfile) -> int:
+    """Print the function of a superinstruction (and the
+    opcodes of its parts, for the loader); its operand count
+    """
+    for part in parts:
+        assert part in ops, f"Superinstruction {name}: no operation {part}"
+    # Each operation fetches its own operand, which follows
+    # those of the operations before it
+    codes = ", ".join(str(ops[part]["code"]) for part in parts)
+    print(f"/* {name} = {' '.join(parts)} */", file=outfile)
+    print(f"static int vm_super_{name}_parts[] = {LB} {codes}, -1 {RB};",
+          file=outfile)
+    print(f"static void vm_super_{name}(void) {LB}", file=outfile)
+    for part in parts:
+        print(f"    {ops[part]['func']}();", file=outfile)
+    print(f"{RB}\n", file=outfile)
+    return sum(ops[part]["inlines"] for part in parts)
+
+
 def main():
     log.info("Bytecode table generation")
     args = cli()
     print(PROLOGUE, file=args.outfile)
+    # name -> opcode, function and number of operands
+    ops = {}
+    entries = []
     next_byte_code = 0;
     for line in args.infile:
         line = line.strip()
@@ -65,12 +92,28 @@ def main():
         # Is there anything left?
         if len(line) == 0:
             continue
-        parts = line.split(",")
-        assert len(parts) == 3, f"Couldn't parse {line}"
-        name, func, inlines = parts
-        print(f'\t {LB} "{name}", {func}, {inlines} {RB}, //{next_byte_code} {comment}',
-              file=args.outfile)
+        if "=" in line:
+            # Superinstruction:  name = operation operation ...
+            name, _, sequence = line.partition("=")
+            name = name.strip()
+            func = f"vm_super_{name}"
+            inlines = superinstruction(name, sequence.split(), ops,
+                                       args.outfile)
+            parts = f"{func}_parts"
+        else:
+            parts = line.split(",")
+            # The stack effect and flow columns are for the verifier
+            assert len(parts) == 5, f"Couldn't parse {line}"
+            name, func, inlines = parts[:3]
+            inlines = int(inlines)
+            parts = 0
+        ops[name] = {"code": next_byte_code, "func": func, "inlines": inlines}
+        entries.append(f'\t {LB} "{name}", {func}, {inlines}, {parts} {RB}, '
+                       f'//{next_byte_code} {comment}')
         next_byte_code += 1
+    print(TABLE, file=args.outfile)
+    for entry in entries:
+        print(entry, file=args.outfile)
     print(CODA, file=args.outfile)
     log.info("Finished bytecode table generation")
 
@@ -11,6 +11,7 @@
 #include "vm_core.h"
 #include "vm_state.h"
 #include "vm_ops.h"
+#include "vm_profile.h"  // For vm_report_position
 #include "logger.h"
 
 #include <assert.h>
@@ -26,25 +27,20 @@
 void assert_is_type(obj_ref thing, class_ref expected) {
     if (thing->header.tag != GOOD_OBJ_TAG) {
         fprintf(stderr, "Type check failure: %p is Not on object!\n", thing);
+        vm_report_position();
         assert(0);
     }
     assert(expected->header.healthy_class_tag == HEALTHY);
     class_ref thing_class = thing->header.clazz;
-    class_ref clazz = thing_class;
-    while (clazz) {
-        if (clazz == expected) {
-            return; // OK
-        }
-        if (clazz == the_class_Obj) {
-            break;
-         }
-        clazz = clazz->header.super;
-        assert(clazz->header.healthy_class_tag == HEALTHY);
+    assert(thing_class->header.healthy_class_tag == HEALTHY);
+    if (is_subclass_of(thing_class, expected)) {
+        return; // OK
     }
     fprintf(stderr,
             "Type check failure:%s is not subclass of %s\n",
             thing_class->header.class_name,
             expected->header.class_name);
+    vm_report_position();
     assert(0);
 }
 
@@ -202,7 +198,11 @@ struct  class_struct  the_class_Obj_struct = {
                    .healthy_class_tag = HEALTHY,
                    .super = 0,
                    .n_fields = 0,
-                   .object_size = sizeof(struct obj_Obj_struct) },
+                   .object_size = sizeof(struct obj_Obj_struct),
+                   // Built-in classes are numbered in the order the
+                   // loader registers them, until it renumbers them
+                   .preorder = 0,
+                   .postorder = 4 },
         .vtable =
                 {method_Obj_constructor, // constructor
                  method_Obj_string, // STRING
@@ -498,7 +498,9 @@ struct  class_struct  the_class_String_struct = {
                    .healthy_class_tag = HEALTHY,
                    .n_fields = 0,
                    .object_size = sizeof(struct obj_String_struct),
-                   .super=the_class_Obj},
+                   .super=the_class_Obj,
+                   .preorder = 1,
+                   .postorder = 0 },
         method_String_constructor,     /* Constructor */
         method_String_string,
         method_String_print,
@@ -594,7 +596,9 @@ struct  class_struct  the_class_Boolean_struct = {
                    .healthy_class_tag = HEALTHY,
                    .super = the_class_Obj,
                    .n_fields = 0,
-                   .object_size = sizeof (struct obj_Boolean_struct) },
+                   .object_size = sizeof (struct obj_Boolean_struct),
+                   .preorder = 2,
+                   .postorder = 1 },
         .vtable =
                 {
                  method_Boolean_constructor, // constructor
@@ -680,7 +684,9 @@ struct  class_struct  the_class_Nothing_struct = {
                 .healthy_class_tag = HEALTHY,
                 .super = the_class_Obj,
                 .n_fields = 0,
-                .object_size = sizeof (struct class_Nothing_struct) },
+                .object_size = sizeof (struct class_Nothing_struct),
+                .preorder = 4,
+                .postorder = 3 },
         .vtable =
                 {method_Nothing_constructor, // constructor
                  method_Nothing_string, // STRING
@@ -1030,6 +1036,8 @@ struct  class_struct  the_class_Int_struct = {
                 .super = the_class_Obj,
                 .n_fields = 0,
                 .object_size = sizeof(struct obj_Int_struct),
+                .preorder = 3,
+                .postorder = 2
         },
         .vtable = {
                 method_int_constructor,  // constructor
@@ -6,10 +6,21 @@ import traceback
 import json
 import sys
 
+from compiler.allocator import allocate_locals
 from compiler.checker import FieldLoader, ReturnChecker, VarChecker
 from compiler.errors import CompileError
 from compiler.generator import Generator, generate_file
+from compiler.hierarchy import HierarchyAnalysis
+from compiler.hoister import LoopHoister
+from compiler.inliner import inline_methods, default_budget
+from compiler.ir import format_function
+from compiler.irbuilder import IRBuilder
+from compiler.iremitter import emit_classes
+from compiler.iroptimizer import optimize
 from compiler.loader import load_classes, create_main
+from compiler.numbering import number_values
+from compiler.profile import load_profile
+from compiler.reachability import eliminate_dead_code
 from compiler.transformer import OpTransformer
 from compiler.typechecker import TypeChecker, check_inherited
 
@@ -24,7 +35,23 @@ def cli_parser():
     parser.add_argument('--tree', '-t', action='count', default=0)
     parser.add_argument('--verbose', '-v', action='store_true')
     parser.add_argument('--list', '-l', action='store_true')
-    return parser.parse_args()
+    parser.add_argument('--roll-calls', action='store_true')
+    parser.add_argument('--inline-budget', type=int, default=default_budget)
+    parser.add_argument('--inline-report', action='store_true')
+    parser.add_argument('--unbox-ints', action='store_true')
+    parser.add_argument('--profile-use', metavar='FILE')
+    parser.add_argument('--ssa', action='store_true')
+    parser.add_argument('--emit-ir', action='store_true')
+    args = parser.parse_args()
+    #the SSA path makes its code without a profile
+    if args.profile_use and (args.ssa or args.emit_ir):
+        parser.error('--profile-use cannot be used with --ssa or --emit-ir')
+    #nor does it unbox ints or roll calls into loops
+    for option in ['unbox_ints', 'roll_calls']:
+        if getattr(args, option) and (args.ssa or args.emit_ir):
+            parser.error('--%s cannot be used with --ssa or --emit-ir'
+                         % option.replace('_', '-'))
+    return args
 
 def main():
     args = cli_parser()
@@ -95,10 +122,53 @@ def main():
         #ensure overridden method signatures are compatible
         check_inherited(tree, types)
 
+        #find calls that can bypass the vtable
+        hierarchy = HierarchyAnalysis(tree, types)
+        hierarchy.visit(tree)
+
+        #find loop invariant expressions to evaluate before their loops
+        loop_hoister = LoopHoister(types)
+        loop_hoister.visit(tree)
+
         #generate class objects and method code
         classes = []
-        generator = Generator(classes, types)
-        generator.visit(tree)
+        if args.ssa or args.emit_ir:
+            #build and optimize the SSA form of every method
+            class_irs = IRBuilder(types).build(tree)
+            for class_ir in class_irs:
+                for function in class_ir['functions']:
+                    optimize(function, types)
+            #if the IR option was given, output the optimized IR
+            if args.emit_ir:
+                for class_ir in class_irs:
+                    for function in class_ir['functions']:
+                        print(format_function(function), end='\n\n')
+                return
+            #lower the IR to stack machine code
+            generator = emit_classes(class_irs, classes)
+            profile = None
+        else:
+            #execution counts from an earlier run (tiny_vm -P FILE)
+            profile = load_profile(args.profile_use) if args.profile_use \
+                else None
+            generator = Generator(classes, types, args.roll_calls,
+                                  args.unbox_ints, profile)
+            generator.visit(tree)
+
+        #copy small methods into the calls that can only reach them
+        report = inline_methods(classes, types, generator.temp_var,
+                                generator.label, args.inline_budget, profile)
+        if args.inline_report:
+            print(*report, sep='\n', file=sys.stderr)
+
+        #drop methods and classes the main constructor can never reach
+        classes = eliminate_dead_code(classes, types, args.name)
+
+        #reuse values computed earlier in the same basic block
+        number_values(classes, types, generator.temp_var)
+
+        #share frame slots between variables that are never live together
+        allocate_locals(classes)
 
         #output code to files
         for class_ in classes:
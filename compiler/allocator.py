@@ -0,0 +1,224 @@
+#packs local variables into as few frame slots as possible
+#variables whose live ranges never overlap can share one slot
+
+#branches that compare two Ints
+int_jumps = (
+    'jump_ilt',
+    'jump_ile',
+    'jump_igt',
+    'jump_ige',
+    'jump_ieq',
+    'jump_ine'
+)
+
+#instructions that read or write a local variable
+#the _int versions move an unboxed Int
+loads = ('load', 'load_int')
+stores = ('store', 'store_int')
+
+#instructions that may transfer control to the label in their operand
+branches = (
+    'jump',
+    'jump_if',
+    'jump_ifnot'
+) + int_jumps
+
+#instructions followed by a table of jumps, one of which they take
+#the table has a jump for each item in the operand and one more
+jump_tables = (
+    'typeswitch',
+    'jump_table'
+)
+
+#instruction that counts a for loop: its operand is counter,end,step
+#it is followed by a jump back to the top of the loop, which it either
+#takes or steps over
+for_next = 'for_next'
+
+#instructions that never fall through to the next instruction
+terminators = (
+    'jump',
+    'return',
+    'tailcall',
+    'tailcall_direct',
+    'halt'
+)
+
+
+#split a line of generated assembly into its label, operation and operand
+#a line holds either a label or an instruction, never both
+#a directive (such as .site) is neither, and splits into three Nones
+def split_line(line):
+    line = line.strip()
+    if line.endswith(':'):
+        return line[:-1], None, None
+    if line.startswith('.'):
+        return None, None, None
+    op, _, operand = line.partition(' ')
+    return None, op, operand or None
+
+
+#find the source span a .site directive gives the next instruction
+def site_of(line):
+    directive, _, span = line.strip().partition(' ')
+    return span if directive == '.site' else None
+
+
+#check whether a line is a .line directive, which gives the line of
+#source the instructions after it come from
+def is_line_directive(line):
+    return line.strip().startswith('.line ')
+
+
+#parse the code of a method into a list of (operation, operand) pairs
+#and a map from each label to the index of the instruction it precedes
+def parse_code(code):
+    instrs = []
+    labels = {}
+    for line in code:
+        label, op, operand = split_line(line)
+        if label is not None:
+            labels[label] = len(instrs)
+        elif op is not None:
+            instrs.append((op, operand))
+    return instrs, labels
+
+
+#find the indexes of the instructions that may run after instruction i
+def successors(instrs, labels, i):
+    op, operand = instrs[i]
+    succ = []
+    if op not in terminators and i + 1 < len(instrs):
+        succ.append(i + 1)
+    if op in branches and labels[operand] < len(instrs):
+        succ.append(labels[operand])
+    if op in jump_tables:
+        #the jumps after the instruction are its table of targets
+        n_jumps = len(operand.split(',')) + 1
+        succ.extend(range(i + 2, i + 1 + n_jumps))
+    if op == for_next:
+        #leaving the loop skips the jump back to its top
+        succ.append(i + 2)
+    return succ
+
+
+#find the local variables an instruction reads
+def reads(op, operand):
+    if op in loads:
+        return [operand]
+    if op == for_next:
+        counter, end, step = operand.split(',')
+        return [counter, end]
+    return []
+
+
+#find the local variables an instruction writes
+def writes(op, operand):
+    if op in stores:
+        return [operand]
+    if op == for_next:
+        return [operand.split(',')[0]]
+    return []
+
+
+#rename the local variables an instruction uses
+def rename(op, operand, names):
+    if op in loads + stores:
+        return names.get(operand, operand)
+    if op == for_next:
+        counter, end, step = operand.split(',')
+        return ','.join([names.get(counter, counter),
+                         names.get(end, end), step])
+    return operand
+
+
+#compute the set of local variables live after each instruction
+def liveness(instrs, labels, variables):
+    n = len(instrs)
+    succs = [successors(instrs, labels, i) for i in range(n)]
+    live_in = [set() for i in range(n)]
+    live_out = [set() for i in range(n)]
+    changed = True
+    #iterate backwards until no live set grows any more
+    while changed:
+        changed = False
+        for i in reversed(range(n)):
+            op, operand = instrs[i]
+            out = set()
+            for s in succs[i]:
+                out |= live_in[s]
+            new_in = out - set(writes(op, operand))
+            new_in |= set(reads(op, operand)) & variables
+            if new_in != live_in[i] or out != live_out[i]:
+                live_in[i] = new_in
+                live_out[i] = out
+                changed = True
+    return live_out
+
+
+#assign every local variable of a method to a shared slot
+#returns a map from variable name to the name of its slot
+def pack_slots(method):
+    #a local that shares its name with an argument is stored in the
+    #argument's slot by the assembler, so it never needs its own
+    variables = [v for v in method['locals'] if v not in method['args']]
+    instrs, labels = parse_code(method['code'])
+    live_out = liveness(instrs, labels, set(variables))
+
+    #two variables interfere if one is written while the other is live
+    interference = {v: set() for v in variables}
+    for (op, operand), out in zip(instrs, live_out):
+        for var in writes(op, operand):
+            if var not in interference:
+                continue
+            for other in out:
+                if other != var:
+                    interference[var].add(other)
+                    interference[other].add(var)
+
+    #greedily give each variable the first slot none of its neighbors use
+    #the first variable placed in a slot lends the slot its name
+    slots = []
+    assignment = {}
+    for var in variables:
+        taken = {assignment[other] for other in interference[var]
+                 if other in assignment}
+        for slot in slots:
+            if slot not in taken:
+                break
+        else:
+            slot = var
+            slots.append(slot)
+        assignment[var] = slot
+    return assignment
+
+
+#rewrite each method to use the packed slots and shrink its locals list
+def allocate_locals(classes):
+    for class_ in classes:
+        for method in class_['methods']:
+            assignment = pack_slots(method)
+
+            #a shared slot keeps a type only if every variable in it agrees
+            locals = {}
+            for var, slot in assignment.items():
+                type = method['locals'][var]
+                if slot in locals and locals[slot] != type:
+                    type = ''
+                locals[slot] = type
+            method['locals'] = locals
+
+            #rename every load and store to refer to its variable's slot
+            code = []
+            for line in method['code']:
+                label, op, operand = split_line(line)
+                if op in loads + stores + (for_next,):
+                    operand = rename(op, operand, assignment)
+                    line = '    %s %s' % (op, operand)
+                #copying a slot into itself does nothing
+                if op in stores and code and \
+                        code[-1] == '    %s %s' % (loads[stores.index(op)], operand):
+                    code.pop()
+                    continue
+                code.append(line)
+            method['code'] = code
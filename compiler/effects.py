@@ -0,0 +1,47 @@
+from lark import Tree
+
+
+#builtin methods that have no side effects and cannot fail
+#calling one of these twice with the same operands gives equal results
+pure_methods = {
+    'Int': ('PLUS', 'MINUS', 'TIMES', 'NEG', 'LESS', 'ATMOST',
+            'MORE', 'ATLEAST', 'EQUALS', 'string'),
+    'String': ('PLUS', 'LESS', 'ATMOST', 'MORE', 'ATLEAST',
+               'EQUALS', 'string'),
+    'Bool': ('NEGATE', 'EQUALS', 'string')
+}
+
+#builtin methods that are pure except that they fail on a zero argument
+partial_methods = {
+    'Int': ('DIVIDE', 'MOD')
+}
+
+
+#check whether no user-defined class extends the given class
+#calls on a receiver of a final class always run that class's method
+def is_final(typ, types):
+    for name, class_ in types.items():
+        if class_['super'] == typ and name != typ:
+            return False
+    return True
+
+
+#check whether a method call is a call to a pure builtin method
+def is_pure_call(tree, types):
+    if not isinstance(tree, Tree) or tree.data != 'm_call':
+        return False
+    receiver, m_name, args = tree.children
+    typ = receiver.type
+    if not is_final(typ, types):
+        return False
+    if m_name in pure_methods.get(typ, ()):
+        #Int and String equality fail when given some other type of object
+        if m_name == 'EQUALS' and typ != 'Bool':
+            return args.children[0].type == typ
+        return True
+    if m_name in partial_methods.get(typ, ()):
+        #division is only safe when the divisor is a nonzero literal
+        divisor = args.children[0]
+        return (divisor.data == 'lit_number'
+                and int(divisor.children[0]) != 0)
+    return False
@@ -3,3 +3,9 @@ class CompileError(Exception):
     def __init__(self, msg, meta=None):
         super().__init__(msg)
         self.meta = meta
+
+
+#raised when the intermediate representation is malformed
+#this is always a bug in the compiler, not in the program compiled
+class IRError(Exception):
+    pass
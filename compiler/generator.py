@@ -1,6 +1,8 @@
 import lark
 import itertools
 from collections import defaultdict as dd
+from compiler.profile import site, source_line
+from compiler.typechecker import is_subclass
 
 preorder = (
     'class_',
@@ -12,13 +14,74 @@ preorder = (
     'while_lp',
     'typecase',
     'store_field',
-    'ret_exp'
+    'ret_exp',
+    'm_call',
+    'assign'
 )
 
+#nodes whose evaluation has no side effects and cannot observe any
+#evaluating them earlier or later than written produces the same value
+unobservable = (
+    'var',
+    'lit_number',
+    'lit_string',
+    'lit_true',
+    'lit_false',
+    'lit_nothing'
+)
+
+#Int methods that have their own instruction
+#Int cannot be subclassed, so an Int receiver always runs these
+int_ops = {
+    'PLUS': 'iadd',
+    'MINUS': 'isub',
+    'TIMES': 'imul',
+    'DIVIDE': 'idiv',
+    'MOD': 'imod',
+    'NEG': 'ineg',
+    'LESS': 'ilt',
+    'ATMOST': 'ile',
+    'MORE': 'igt',
+    'ATLEAST': 'ige',
+    'EQUALS': 'ieq'
+}
+
+#Int comparisons that can be fused with the branch that tests them,
+#as the instruction that jumps if the comparison is true and the one
+#that jumps if it is false
+int_branches = {
+    'ilt': ('jump_ilt', 'jump_ige'),
+    'ile': ('jump_ile', 'jump_igt'),
+    'igt': ('jump_igt', 'jump_ile'),
+    'ige': ('jump_ige', 'jump_ilt'),
+    'ieq': ('jump_ieq', 'jump_ine')
+}
+
+#Int instructions that have a version leaving its result unboxed
+raw_ops = {
+    'iadd': 'radd',
+    'isub': 'rsub',
+    'imul': 'rmul',
+    'idiv': 'rdiv',
+    'imod': 'rmod',
+    'ineg': 'rneg'
+}
+
+#nodes that can be evaluated once instead of several times, since
+#evaluating them has no effects and nothing runs between the evaluations
+switchable = (
+    'var',
+    'load_field'
+)
+
+#fewest conditions in an if/elif chain worth a jump table
+min_switch_cases = 3
+
 
 #generate assembly code from the parse tree
 class Generator(lark.visitors.Visitor_Recursive):
-    def __init__(self, classes, types):
+    def __init__(self, classes, types, roll_calls=False, unbox_ints=False,
+                 profile=None):
         #store the code array and types table
         super().__init__()
         #array of class objects, initially empty
@@ -33,10 +96,29 @@ class Generator(lark.visitors.Visitor_Recursive):
         self.labels = dd(itertools.count)
         #stores count of temporary variables
         self.temp_vars = 0
+        #if set, use the original calling sequence that evaluates the
+        #receiver first and rolls it above the arguments
+        self.roll_calls = roll_calls
+        #if set, keep Int variables as raw integers in their frame slots
+        self.unbox_ints = unbox_ints
+        #Int variables of the current method that are kept unboxed
+        self.unboxed = set()
+        #execution counts from an earlier run, used to order code
+        self.profile = profile
+        #line of source of the node being generated, and the line the
+        #last .line directive of the current method gave
+        self.line = None
+        self.emitted_line = None
 
     def emit(self, line, tab=True):
         #emits a line of code to the output array
         #adds a tab to the beginning by default
+        #an instruction (or the site of one) from another line of source
+        #than the instruction before it is preceded by a .line directive
+        if (tab or line.startswith('.site')) and self.line is not None \
+                and self.line != self.emitted_line:
+            self.emitted_line = self.line
+            self.emit('.line %d' % self.line, False)
         if tab:
             line = '    ' + line
         self.current_method['code'].append(line)
@@ -46,12 +128,128 @@ class Generator(lark.visitors.Visitor_Recursive):
         num = next(self.labels[prefix]) #get current number for given prefix
         return f'{prefix}_{num}'
 
+    def site(self, tree, suffix=''):
+        #name the next instruction by the source span of the node it
+        #was generated for, so a profile can count its executions
+        span = site(tree)
+        if span is not None:
+            self.emit('.site %s%s' % (span, suffix), False)
+
     def temp_var(self):
         ret = '__TEMP_VAR%d' % self.temp_vars
         self.temp_vars += 1
         return ret
 
+    def unobservable(self, tree):
+        #hoisted expressions are loaded from a temporary like a variable
+        return tree.data in unobservable or getattr(tree, 'temp', None)
+
+    def int_op(self, tree):
+        #find the instruction for a call with Int receiver and arguments
+        receiver, m_name, args = tree.children
+        if receiver.type != 'Int' or str(m_name) not in int_ops:
+            return None
+        if any(arg.type != 'Int' for arg in args.children):
+            return None
+        return int_ops[str(m_name)]
+
+    def branch(self, cond, label, when):
+        #jump to label if the condition evaluates to when (True or False)
+        #conditions of if, elif and while are wrapped in a condition node
+        #which names the branch in profiles
+        condition = None
+        if cond.data == 'condition':
+            condition = cond
+            cond = cond.children[0]
+        op = None
+        if cond.data == 'm_call' and not getattr(cond, 'temp', None):
+            op = self.int_op(cond)
+        if op in int_branches:
+            #compare and branch in one instruction, with no Bool between
+            receiver, _, args = cond.children
+            self.visit_int(receiver)
+            for arg in args.children:
+                self.visit_int(arg)
+            jump = int_branches[op][0 if when else 1]
+        else:
+            self.visit(cond)
+            jump = 'jump_if' if when else 'jump_ifnot'
+        #a profile tells which way the branch went; + marks a branch
+        #that is taken when the condition is true
+        if condition is not None:
+            self.site(condition, '+' if when else '')
+        self.emit('%s %s' % (jump, label))
+
+    def unboxed_locals(self, tree):
+        #find the variables of a method that are only ever assigned Ints
+        #arguments arrive boxed and typecase variables are stored boxed,
+        #so they stay boxed
+        ints = set()
+        others = {str(arg.children[0]) for arg in tree.children[1].children}
+        for node in tree.iter_subtrees():
+            if node.data == 'assign':
+                type = node.children[1] or node.type
+                if type == 'Int':
+                    ints.add(str(node.children[0]))
+                else:
+                    others.add(str(node.children[0]))
+            elif node.data == 'type_alternative':
+                others.add(str(node.children[0]))
+        return ints - others
+
+    def uses_unboxed(self, tree):
+        #check whether an Int expression reads an unboxed variable,
+        #so computing it unboxed saves boxing that variable
+        if getattr(tree, 'temp', None):
+            return False
+        if tree.data == 'var':
+            return str(tree.children[0]) in self.unboxed
+        if tree.data == 'm_call' and self.int_op(tree) in raw_ops:
+            receiver, _, args = tree.children
+            return any(map(self.uses_unboxed, [receiver] + args.children))
+        return False
+
+    def visit_raw(self, tree):
+        #leave the value of an Int expression on the stack unboxed
+        if getattr(tree, 'temp', None):
+            self.visit(tree)
+            self.emit('unbox')
+        elif tree.data == 'lit_number':
+            self.emit('push_int %s' % tree.children[0])
+        elif tree.data == 'var' and str(tree.children[0]) in self.unboxed:
+            self.emit('load_int %s' % tree.children[0])
+        elif tree.data == 'm_call' and self.int_op(tree) in raw_ops:
+            receiver, _, args = tree.children
+            for operand in [receiver] + args.children:
+                self.visit_raw(operand)
+            self.emit(raw_ops[self.int_op(tree)])
+        else:
+            self.visit(tree)
+            self.emit('unbox')
+
+    def visit_int(self, tree):
+        #push an operand of an Int instruction, which accepts it either
+        #boxed or unboxed, in whichever form is cheaper to produce
+        if self.unbox_ints and (tree.data == 'lit_number'
+                                or self.uses_unboxed(tree)):
+            self.visit_raw(tree)
+        else:
+            self.visit(tree)
+
     def visit(self, tree):
+        #code generated for a node comes from its line, except the code
+        #of nodes within it that start on other lines
+        outer = self.line
+        self.line = source_line(tree) or outer
+        self.visit_node(tree)
+        self.line = outer
+
+    def visit_node(self, tree):
+        #an expression hoisted out of a loop was already evaluated
+        #before the loop, so its value only needs to be loaded
+        if getattr(tree, 'temp', None):
+            self.emit('load %s' % tree.temp)
+            return
         #some nodes need to be visited before their children
         #if this node is such a node, visit it directly
         #the node's method may visit its children
@@ -113,6 +311,10 @@ class Generator(lark.visitors.Visitor_Recursive):
         self.current_class['methods'].append(obj)
         #store the current method for use in other generator functions
         self.current_method = obj
+        self.emitted_line = None
+        #decide which of its variables live unboxed
+        if self.unbox_ints:
+            self.unboxed = self.unboxed_locals(tree)
 
         #all methods start with an enter command
         self.emit('enter')
@@ -127,8 +329,16 @@ class Generator(lark.visitors.Visitor_Recursive):
             #ret_exp is preorder so that "none" is not visited
             self.emit('load $')
         else:
+            expr = tree.children[0]
+            #a call in tail position replaces this method's frame with its
+            #own and returns straight to our caller, so no return is needed
+            if (expr.data == 'm_call' and not getattr(expr, 'temp', None)
+                    and not self.int_op(expr)):
+                expr.tail = True
+                self.visit(expr)
+                return
             #visit the expression to be returned
-            self.visit(tree.children[0])
+            self.visit(expr)
         #emit a return statement that pops off the arguments
         num_args = len(self.current_method['args'])
         self.emit('return %s' % num_args)
@@ -160,6 +370,10 @@ class Generator(lark.visitors.Visitor_Recursive):
         if v_name == 'this':
             #load the "this" object onto the stack
             self.emit('load $')
+        elif v_name in self.unboxed:
+            #an unboxed variable is boxed where its value is used as an object
+            self.emit('load_int %s' % v_name)
+            self.emit('box')
         else:
             #load a local variable onto the stack
             self.emit('load %s' % tree.children[0])
@@ -183,12 +397,26 @@ class Generator(lark.visitors.Visitor_Recursive):
             type = tree.type
         #map the variable name to the type of the value
         self.current_method['locals'][name] = type
-        #emit a store instruction
-        self.emit('store %s' % name)
+        #evaluate the value and emit a store instruction
+        if name in self.unboxed:
+            self.visit_raw(tree.children[2])
+            self.emit('store_int %s' % name)
+        else:
+            self.visit(tree.children[2])
+            self.emit('store %s' % name)
 
     def store_field(self, tree):
         #unpack children for convenience
         obj, field, value = tree.children
+        #a compound assignment such as "obj.f += v" loads from and stores to
+        #the same object expression, which must only be evaluated once
+        if (not self.unobservable(obj)
+                and any(node is obj for node in value.iter_subtrees())):
+            temp_var = self.temp_var()
+            self.current_method['locals'][temp_var] = obj.type
+            self.visit(obj)
+            self.emit('store %s' % temp_var)
+            obj.temp = temp_var
         #visit in the opposite of the usual order - value then name
         self.visit(value)
         self.visit(obj)
@@ -201,16 +429,59 @@ class Generator(lark.visitors.Visitor_Recursive):
         self.emit('store_field %s:%s' % (c_name, field))
 
     def m_call(self, tree):
-        #emit a method call command and possibly a roll
-        m_name = str(tree.children[1])
-        #functions need to roll so that the receiver
-        #is the first thing popped off the stack
-        num_ops = len(tree.children[2].children)
-        if num_ops: #don't roll for functions with no arguments
-            self.emit('roll %d' % num_ops)
-        left_type = tree.children[0].type
+        #unpack children for convenience
+        receiver, m_name, args = tree.children
+        #Int operations are instructions that take their operands in
+        #source order, so neither a call nor a spill is needed
+        op = self.int_op(tree)
+        if op in raw_ops and self.unbox_ints and self.uses_unboxed(tree):
+            #compute unboxed from unboxed variables, and box only the result
+            self.visit_raw(tree)
+            self.emit('box')
+            return
+        if op:
+            self.visit_int(receiver)
+            for arg in args.children:
+                self.visit_int(arg)
+            self.emit(op)
+            return
+        #the callee expects the arguments in order with the receiver
+        #on top of them, which is also where its frame pointer will point
+        if not args.children:
+            #with no arguments, the receiver is already in place
+            self.visit(receiver)
+        elif self.roll_calls:
+            #evaluate the receiver first, then roll it above the arguments
+            self.visit(receiver)
+            self.visit(args)
+            self.emit('roll %d' % len(args.children))
+        elif (self.unobservable(receiver)
+                or all(self.unobservable(arg) for arg in args.children)):
+            #nothing can tell whether the receiver was evaluated before or
+            #after the arguments, so push it last and skip the roll
+            self.visit(args)
+            self.visit(receiver)
+        else:
+            #both sides may have effects, so keep the source order by
+            #spilling the receiver to a temporary until the arguments are done
+            temp_var = self.temp_var()
+            self.current_method['locals'][temp_var] = receiver.type
+            self.visit(receiver)
+            self.emit('store %s' % temp_var)
+            self.visit(args)
+            self.emit('load %s' % temp_var)
+        #calls whose target is known can skip the vtable
+        left_type = getattr(tree, 'direct', None) or receiver.type
+        call = 'call_direct' if getattr(tree, 'direct', None) else 'call'
+        #calls in tail position become tailcall or tailcall_direct
+        if getattr(tree, 'tail', False):
+            call = 'tail' + call
+        #if object type is the current class, use the $ alias
+        if left_type == self.current_class['name']:
+            left_type = '$'
         #emit a method call of the correct type
-        self.emit('call %s:%s' % (left_type, tree.children[1]))
+        self.site(tree)
+        self.emit('%s %s:%s' % (call, left_type, m_name))
 
     def c_call(self, tree):
         c_name = str(tree.children[0])
@@ -220,7 +491,8 @@ class Generator(lark.visitors.Visitor_Recursive):
         #allocate space for a new object of type c_name
         self.emit('new %s' % c_name)
         #call the constructor on the new object
-        self.emit('call %s:$constructor' % c_name)
+        call = 'call_direct' if getattr(tree, 'direct', None) else 'call'
+        self.emit('%s %s:$constructor' % (call, c_name))
 
     def raw_rexp(self, tree):
         #if a statement is just a right_expression, the value of the expression
@@ -234,15 +506,13 @@ class Generator(lark.visitors.Visitor_Recursive):
         join_label = self.label('and')
 
         #generate assembly for first expression, which will always run
-        self.visit(left)
         #if the first expression evaluates to false, jump to join point
-        self.emit('jump_ifnot %s' % false_label)
+        self.branch(left, false_label, False)
 
         #generate assembly for second expression
         #this will only run if the first expression evaluated to true
-        self.visit(right)
         #if the second expression evaluates to false, jump to join point
-        self.emit('jump_ifnot %s' % false_label)
+        self.branch(right, false_label, False)
 
         #if neither jump was taken, push true as the result
         self.emit('const true')
@@ -264,15 +534,13 @@ class Generator(lark.visitors.Visitor_Recursive):
         join_label = self.label('or')
 
         #generate assembly for first expression, which will always run
-        self.visit(left)
         #if the first expression evaluates to true, jump to join point
-        self.emit('jump_if %s' % true_label)
+        self.branch(left, true_label, True)
 
         #generate assembly for second expression
         #this will only run if the first expression evaluated to false
-        self.visit(right)
         #if the second expression evaluates to true, jump to join point
-        self.emit('jump_if %s' % true_label)
+        self.branch(right, true_label, True)
 
         #if neither jump was taken, push false as the result
         self.emit('const false')
@@ -295,9 +563,8 @@ class Generator(lark.visitors.Visitor_Recursive):
         join_label = self.label('join')
 
         #evaluate the condition
-        self.visit(cond)
         #jump to the false branch if condition was false
-        self.emit('jump_ifnot %s' % f_label)
+        self.branch(cond, f_label, False)
 
         #if condition was true, evaluate the true branch
         self.visit(t_exp)
@@ -310,10 +577,97 @@ class Generator(lark.visitors.Visitor_Recursive):
 
         self.emit('%s:' % join_label, False)
 
+    def switch_case(self, cond):
+        #if the condition compares an Int expression with an Int literal,
+        #return the expression and the literal's value
+        if cond.data == 'condition':
+            cond = cond.children[0]
+        if cond.data != 'm_call' or str(cond.children[1]) != 'EQUALS':
+            return None
+        left, _, args = cond.children
+        if len(args.children) != 1:
+            return None
+        right = args.children[0]
+        if left.data == 'lit_number':
+            left, right = right, left
+        if right.data != 'lit_number' or left.type != 'Int':
+            return None
+        #only a field of a variable can be loaded without effects
+        if left.data == 'load_field' and left.children[0].data != 'var':
+            return None
+        if left.data not in switchable:
+            return None
+        return left, int(right.children[0])
+
+    def switch_cases(self, conds, minimum=min_switch_cases):
+        #if every condition compares the same expression against a
+        #different Int literal, return the expression and the values
+        cases = [self.switch_case(cond) for cond in conds]
+        if len(cases) < minimum or None in cases:
+            return None
+        expr = cases[0][0]
+        values = [value for _, value in cases]
+        if any(e != expr for e, _ in cases) or len(set(values)) < len(values):
+            return None
+        return expr, values
+
+    def switch(self, tree, expr, values, blocks, else_block):
+        #dispatch on the value of expr with one jump_table instruction
+        labels = [self.label('case') for value in values]
+        else_label = self.label('else')
+        join_label = self.label('join')
+
+        #the jump_table is followed by a jump for each value, in order,
+        #and one for a value that matches none of them
+        cases = sorted(zip(values, labels))
+        self.visit_int(expr)
+        self.site(tree)
+        self.emit('jump_table %s' % ','.join(str(v) for v, _ in cases))
+        for _, label in cases:
+            self.emit('jump %s' % label)
+        self.emit('jump %s' % else_label)
+
+        #blocks are emitted in source order, or the most often run first
+        arms = list(zip(labels, blocks))
+        counts = self.profile and self.profile.alternatives(tree)
+        if counts:
+            order = {label: -counts.get(value, 0) for value, label in cases}
+            arms.sort(key=lambda arm: order[arm[0]])
+        for label, block in arms:
+            self.emit('%s:' % label, False)
+            self.visit(block)
+            self.emit('jump %s' % join_label)
+        self.emit('%s:' % else_label, False)
+        if else_block is not None:
+            self.visit(else_block)
+        self.emit('%s:' % join_label, False)
+
     def if_stmt(self, tree):
         #unpack children nodes for convenience
         if_cond, if_block, elifs, _else = tree.children
 
+        #a chain of comparisons of one value with constants is a switch
+        conds = [if_cond] + [_elif.children[0] for _elif in elifs.children]
+        switch = self.switch_cases(conds)
+        if switch:
+            blocks = [if_block] + [_elif.children[1] for _elif in elifs.children]
+            else_block = _else.children[0] if _else.children else None
+            self.switch(tree, *switch, blocks, else_block)
+            return
+
+        if self.profile:
+            #such a chain too short to be a switch tests the most common
+            #value first, since at most one of its conditions is true
+            if elifs.children and self.switch_cases(conds, 2):
+                self.reorder_arms(tree)
+                if_cond, if_block, elifs, _else = tree.children
+            #lay out the more often run of an if and its else to fall through
+            counts = self.profile.condition(if_cond)
+            if (not elifs.children and _else.children
+                    and counts and counts[1] > counts[0]):
+                self.if_else_inverted(if_cond, if_block, _else.children[0])
+                return
+
         join_label = self.label('join') #generate join label - emitted at end
         #holds all labels used in this block
         #must be pregenerated so that future labels can be accessed
@@ -324,14 +678,13 @@ class Generator(lark.visitors.Visitor_Recursive):
             labels.append(self.label('else')) #if else block exists, add "else"
 
         #unconditionally evaluate the if statement's condition
-        self.visit(if_cond)
         #emit the correct label to jump to if the condition was false
         if not labels:
             #if the if statement is alone, jump to the join point
-            self.emit('jump_ifnot %s' % join_label)
+            self.branch(if_cond, join_label, False)
         else:
             #if the if statement has friends, jump to the next condition
-            self.emit('jump_ifnot %s' % labels[0])
+            self.branch(if_cond, labels[0], False)
         #if condition was true, execute the block
         self.visit(if_block)
         if labels:
@@ -352,9 +705,8 @@ class Generator(lark.visitors.Visitor_Recursive):
             #emit this block's label
             self.emit('%s:' % current_label, False)
             #evaluate the elif's condition
-            self.visit(elif_cond)
             #jump to next block or join point if condition was false
-            self.emit('jump_ifnot %s' % next_label)
+            self.branch(elif_cond, next_label, False)
             #execute block if condition was true
             self.visit(elif_block)
             #only jump to join if there is a block in between here and there
@@ -375,6 +727,32 @@ class Generator(lark.visitors.Visitor_Recursive):
         #emit the join label - this point will always be reached
         self.emit('%s:' % join_label, False)
 
+    def reorder_arms(self, tree):
+        #sort the arms of an if/elif chain whose conditions cannot both
+        #be true by how often each condition was true
+        if_cond, if_block, elifs, _else = tree.children
+        arms = [(if_cond, if_block)] + [tuple(_elif.children)
+                                        for _elif in elifs.children]
+        def times_true(arm):
+            counts = self.profile.condition(arm[0])
+            return -counts[0] if counts else 0
+        arms.sort(key=times_true)
+        for _elif, arm in zip(elifs.children, arms[1:]):
+            _elif.children = list(arm)
+        tree.children = [arms[0][0], arms[0][1], elifs, _else]
+
+    def if_else_inverted(self, cond, if_block, else_block):
+        #an if/else whose condition is usually false runs its else block
+        #when the branch falls through, and jumps to the if block
+        if_label = self.label('if')
+        join_label = self.label('join')
+        self.branch(cond, if_label, True)
+        self.visit(else_block)
+        self.emit('jump %s' % join_label)
+        self.emit('%s:' % if_label, False)
+        self.visit(if_block)
+        self.emit('%s:' % join_label, False)
+
     def while_lp(self, tree):
         #unpack children nodes for convenience
         condition, block = tree.children
@@ -382,6 +760,21 @@ class Generator(lark.visitors.Visitor_Recursive):
         block_label = self.label('while_block')
         cond_label = self.label('while_cond')
 
+        #evaluate loop invariant expressions once, before entering the loop
+        for expr in getattr(tree, 'invariants', []):
+            self.visit(expr)
+            temp_var = self.temp_var()
+            self.current_method['locals'][temp_var] = expr.type
+            self.emit('store %s' % temp_var)
+            #later visits of the expression load the temporary instead
+            expr.temp = temp_var
+
+        #a desugared for loop tests its range once on entry, then
+        #counts and tests in a single instruction at the bottom
+        if hasattr(tree, 'counter'):
+            self.for_lp(tree, block_label)
+            return
+
         #unconditionally jump to condition check
         self.emit('jump %s' % cond_label)
         #emit label for start of block
@@ -393,9 +786,45 @@ class Generator(lark.visitors.Visitor_Recursive):
         self.emit('%s:' % cond_label, False)
 
         #generate code for condition check
-        self.visit(condition)
         #if condition evaluates to true, jump to beginning of block
-        self.emit('jump_if %s' % block_label)
+        #(for an Int comparison this back edge is a single instruction)
+        self.branch(condition, block_label, True)
+
+    def for_lp(self, tree, block_label):
+        #unpack children nodes for convenience
+        condition, block = tree.children
+        count, limit, step = tree.counter
+        end_label = self.label('for_end')
+        #skip the loop if the range is empty
+        self.branch(condition, end_label, False)
+        self.emit('%s:' % block_label, False)
+        #the last statement of the block is the increment of the counter,
+        #which for_next does
+        for statement in block.children[:-1]:
+            self.visit(statement)
+        self.emit('for_next %s,%s,%d' % (count, limit, step))
+        #taken by for_next without being executed, unless the loop is done
+        self.emit('jump %s' % block_label)
+        self.emit('%s:' % end_label, False)
+
+    def reorder_alternatives(self, alts, counts):
+        #test the most often chosen alternatives of a typecase first
+        #an object of a class and its subclass takes the first of their
+        #alternatives, so those two must stay in order
+        def related(a, b):
+            a, b = str(a.children[1]), str(b.children[1])
+            return (is_subclass(a, b, self.types)
+                    or is_subclass(b, a, self.types))
+        remaining = list(alts.children)
+        ordered = []
+        while remaining:
+            #alternatives with no related alternative still before them
+            ready = [alt for i, alt in enumerate(remaining)
+                     if not any(related(alt, other) for other in remaining[:i])]
+            best = max(ready, key=lambda alt: counts.get(str(alt.children[1]), 0))
+            ordered.append(best)
+            remaining.remove(best)
+        alts.children = ordered
 
     def typecase(self, tree):
         #unpack children for convenience
@@ -407,38 +836,52 @@ class Generator(lark.visitors.Visitor_Recursive):
         self.visit(expr)
         self.emit('store %s' % temp_var)
 
-        #pregenerate labels for each alternative after the first
+        #a typecase with no alternatives only evaluates its expression
+        if not alts.children:
+            return
+        counts = self.profile and self.profile.alternatives(tree)
+        if counts:
+            self.reorder_alternatives(alts, counts)
+
+        #pregenerate a label for each alternative
         labels = []
-        for alt in alts.children[1:]:
+        types = []
+        for alt in alts.children:
             labels.append(self.label('type_alt'))
+            type = str(alt.children[1])
+            if type == self.current_class['name']:
+                type = '$'
+            types.append(type)
         #there will always be a join label at the end
-        labels.append(self.label('type_join'))
+        join_label = self.label('type_join')
+
+        #test the expression against every type at once
+        #the typeswitch takes the jump for the first type that matches,
+        #or the last jump if none of them do
+        self.emit('load %s' % temp_var)
+        self.site(tree)
+        self.emit('typeswitch %s' % ','.join(types))
+        for label in labels + [join_label]:
+            self.emit('jump %s' % label)
 
         #iterate over alternatives and labels
-        for alt, label in zip(alts.children, labels):
-            name, type, block = alt.children
-            if type == self.current_class['name']:
-                type = '$'
+        for alt, label, type in zip(alts.children, labels, types):
+            name, _, block = alt.children
             #add the current typecase variable to the list of locals
             self.current_method['locals'][name] = type
 
-            #test the expression against the given type
-            #if it fails, jump to the next alternative/join point
-            self.emit('load %s' % temp_var)
-            self.emit('is_instance %s' % type)
-            self.emit('jump_ifnot %s' % label)
-
             #if the expression was of the correct type, assign it
             #to the given variable name and evaluate the block
+            self.emit('%s:' % label, False)
             self.emit('load %s' % temp_var)
             self.emit('store %s' % name)
             self.visit(block)
             #jump to the join label, unless this is the last alternative
             if label != labels[-1]:
-                self.emit('jump %s' % labels[-1])
+                self.emit('jump %s' % join_label)
 
-            #output the label for the next alternative
-            self.emit('%s:' % label, False)
+        #output the join label
+        self.emit('%s:' % join_label, False)
 
 
 #generates assembly file for the given class object
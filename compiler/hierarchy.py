@@ -0,0 +1,45 @@
+import lark
+from compiler.typechecker import is_subclass
+
+
+#class hierarchy analysis over the whole program
+#marks calls whose target method is known at compile time, because no
+#subclass of the receiver's static type overrides the called method
+class HierarchyAnalysis(lark.visitors.Visitor_Recursive):
+    def __init__(self, tree, types):
+        #method tables of builtin and user-defined classes
+        self.types = types
+        #maps each class to the names of the methods it defines itself
+        #builtin classes are assumed to define every method they have
+        self.own = {}
+        for c_name, class_ in types.items():
+            self.own[c_name] = set(class_['methods'])
+        for class_ in tree.children[0].children:
+            c_name = str(class_.children[0].children[0])
+            methods = class_.children[1].children[0]
+            self.own[c_name] = {str(m.children[0]) for m in methods.children}
+
+    def overridden(self, typ, m_name):
+        #check whether any proper subclass defines its own version
+        for c_name in self.types:
+            if c_name == typ or not is_subclass(c_name, typ, self.types):
+                continue
+            if m_name in self.own[c_name]:
+                return True
+        return False
+
+    def defining_class(self, typ, m_name):
+        #walk up the hierarchy to the class whose method is inherited
+        while m_name not in self.own[typ]:
+            typ = self.types[typ]['super']
+        return typ
+
+    def m_call(self, tree):
+        typ = tree.children[0].type
+        m_name = str(tree.children[1])
+        if typ in self.types and not self.overridden(typ, m_name):
+            tree.direct = self.defining_class(typ, m_name)
+
+    def c_call(self, tree):
+        #a new object's class is exactly the one constructed
+        tree.direct = str(tree.children[0])
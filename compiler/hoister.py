@@ -0,0 +1,82 @@
+import lark
+from lark import Tree
+from compiler.effects import is_pure_call
+
+#literals evaluate to the same value everywhere
+literals = (
+    'lit_number',
+    'lit_string',
+    'lit_true',
+    'lit_false',
+    'lit_nothing'
+)
+
+
+#finds expressions in while loops that compute the same value on every
+#iteration, so the generator can evaluate them once before the loop
+class LoopHoister(lark.visitors.Visitor_Recursive):
+    def __init__(self, types):
+        #method tables - used to recognize pure builtin methods
+        self.types = types
+
+    def visit(self, tree):
+        #loops are handled before their children, so that an expression
+        #hoisted out of an outer loop is not hoisted again by an inner loop
+        if tree.data == 'while_lp':
+            self._while_lp(tree)
+        for child in tree.children:
+            if isinstance(child, Tree):
+                self.visit(child)
+
+    def _while_lp(self, tree):
+        #find everything the loop (condition and body) can change
+        self.written_vars = set()
+        self.written_fields = set()
+        self.has_calls = False
+        for node in tree.iter_subtrees():
+            if node.data == 'assign':
+                self.written_vars.add(str(node.children[0]))
+            elif node.data == 'type_alternative':
+                self.written_vars.add(str(node.children[0]))
+            elif node.data == 'store_field':
+                self.written_fields.add(str(node.children[1]))
+            elif node.data == 'c_call':
+                self.has_calls = True
+            elif node.data == 'm_call' and not is_pure_call(node, self.types):
+                self.has_calls = True
+
+        #collect the largest invariant expressions in the loop
+        tree.invariants = []
+        self._collect(tree, tree.invariants)
+
+    def _collect(self, tree, invariants):
+        for child in tree.children:
+            if not isinstance(child, Tree):
+                continue
+            if getattr(child, 'hoisted', False):
+                #already evaluated before an enclosing loop
+                continue
+            if child.data in ('load_field', 'm_call') and self._invariant(child):
+                child.hoisted = True
+                invariants.append(child)
+            else:
+                self._collect(child, invariants)
+
+    def _invariant(self, tree):
+        if getattr(tree, 'hoisted', False):
+            return True
+        if tree.data == 'var':
+            return str(tree.children[0]) not in self.written_vars
+        if tree.data in literals:
+            return True
+        if tree.data == 'load_field':
+            #any call in the loop might store to the field
+            obj, field = tree.children
+            return (not self.has_calls
+                    and str(field) not in self.written_fields
+                    and self._invariant(obj))
+        if is_pure_call(tree, self.types):
+            receiver, m_name, args = tree.children
+            return (self._invariant(receiver)
+                    and all(self._invariant(arg) for arg in args.children))
+        return False
@@ -0,0 +1,221 @@
+from compiler.allocator import split_line, branches, loads, stores, \
+    for_next, rename, site_of, is_line_directive
+from compiler.profile import hot_budget_factor
+
+#instructions whose operand may name the current class as $
+class_operands = (
+    'load_field',
+    'store_field',
+    'call',
+    'call_direct',
+    'new',
+    'is_instance',
+    'typeswitch'
+)
+
+#the largest callee, in instructions, that is copied into its callers
+default_budget = 16
+
+
+#count the instructions of a method, not counting labels
+def code_size(code):
+    return sum(1 for line in code if split_line(line)[1] is not None)
+
+
+#replaces calls to small methods, whose target is known at compile time,
+#with a copy of the called method's code
+class Inliner:
+    def __init__(self, classes, types, temp_var, label, budget=default_budget,
+                 profile=None):
+        #method tables - used for the types of arguments
+        self.types = types
+        #functions that generate fresh temporary and label names
+        self.temp_var = temp_var
+        self.label = label
+        #callees larger than this are still called
+        self.budget = budget
+        #execution counts from an earlier run; hot call sites get
+        #a larger budget
+        self.profile = profile
+        #maps (class name, method name) to the class and method objects
+        self.methods = {}
+        for class_ in classes:
+            for method in class_['methods']:
+                self.methods[class_['name'], method['name']] = class_, method
+        #methods whose code has already had its calls inlined
+        self.done = set()
+        #methods currently being inlined into, to stop recursion
+        self.active = []
+        #list of (callee, caller) pairs, one for each inlined call
+        self.inlined = []
+
+    def callee(self, class_name, operand):
+        #find the method object a call_direct operand refers to
+        c_name, m_name = operand.split(':')
+        if c_name == '$':
+            c_name = class_name
+        return self.methods.get((c_name, m_name))
+
+    def expand(self, class_, method):
+        #inline calls in a method, after inlining calls in its callees
+        key = class_['name'], method['name']
+        if key in self.done:
+            return
+        self.active.append(key)
+        code = []
+        span = None
+        #the .line directive the caller's code is currently under
+        source_line = None
+        for line in method['code']:
+            label, op, operand = split_line(line)
+            #the source span of a call comes just before it
+            call_span, span = span, site_of(line)
+            if is_line_directive(line):
+                source_line = line
+            target = None
+            if op in ('call_direct', 'tailcall_direct'):
+                target = self.callee(class_['name'], operand)
+            if target is None:
+                code.append(line)
+                continue
+            t_class, t_method = target
+            t_key = t_class['name'], t_method['name']
+            #never inline a method into itself, however indirectly
+            if t_key in self.active:
+                code.append(line)
+                continue
+            self.expand(t_class, t_method)
+            budget = self.budget
+            if self.profile and self.profile.hot_call(call_span):
+                budget *= hot_budget_factor
+            if code_size(t_method['code']) > budget:
+                code.append(line)
+                continue
+            #the copy is not a call, so nothing profiles it
+            if call_span is not None:
+                code.pop()
+            copy = self.substitute(t_class, t_method, class_, method,
+                                   op == 'tailcall_direct')
+            code.extend(copy)
+            #the copy gives the callee's lines, so the caller's code
+            #after it needs its own line again
+            if source_line is not None and any(map(is_line_directive, copy)):
+                code.append(source_line)
+            #an inlined tail call still has to return its result
+            if op == 'tailcall_direct':
+                code.append('    return %d' % len(method['args']))
+            self.inlined.append(('%s:%s' % t_key, '%s:%s' % key))
+        method['code'] = code
+        self.active.pop()
+        self.done.add(key)
+
+    def substitute(self, t_class, t_method, class_, method, tail=False):
+        #produce a copy of the callee's code that runs in the caller's frame
+        #tail is true if the call replaced is in the caller's tail position
+        c_name = t_class['name']
+        class_name = class_['name']
+        m_type = self.types.get(c_name, {}).get('methods', {})
+        params = m_type.get(t_method['name'], {}).get('params', [])
+        params = params or [''] * len(t_method['args'])
+        #each argument, local and the receiver gets a fresh caller temp
+        names = {}
+        for name in t_method['args'] + list(t_method['locals']):
+            names[name] = self.temp_var()
+        names['$'] = self.temp_var()
+        for arg, type in zip(t_method['args'], params):
+            method['locals'][names[arg]] = type
+        for var, type in t_method['locals'].items():
+            method['locals'][names[var]] = c_name if type == '$' else type
+        method['locals'][names['$']] = c_name
+
+        #each label gets a fresh name with the same prefix
+        labels = {}
+        for line in t_method['code']:
+            label = split_line(line)[0]
+            if label is not None:
+                labels[label] = self.label(label.rpartition('_')[0] or label)
+        join = self.label('inline')
+
+        def retarget(operand):
+            #the callee's class is named, unless it is the caller's
+            #class, which is always $ so the assembler can find it
+            #(a typeswitch names a list of classes)
+            if ',' in operand:
+                return ','.join(map(retarget, operand.split(',')))
+            o_class, colon, member = operand.partition(':')
+            if o_class == '$':
+                o_class = c_name
+            if o_class == class_name:
+                o_class = '$'
+            return o_class + colon + member
+
+        #the receiver is on top of the stack, above the last argument
+        code = []
+        for name in ['$'] + t_method['args'][::-1]:
+            code.append('    store %s' % names[name])
+        for line in t_method['code']:
+            label, op, operand = split_line(line)
+            if label is not None:
+                code.append('%s:' % labels[label])
+            elif op == 'enter':
+                continue
+            elif op == 'return':
+                #the result is left on the stack for the caller
+                code.append('    jump %s' % join)
+            elif op in ('tailcall', 'tailcall_direct') and tail:
+                #a call in the callee's tail position is in the caller's
+                #too, which keeps tail recursion through the callee a loop
+                code.append('    %s %s' % (op, retarget(operand)))
+            elif op in ('tailcall', 'tailcall_direct'):
+                #a call in the callee's tail position is not in the
+                #caller's, so it must return to the copied code
+                operand = retarget(operand)
+                code.append('    %s %s' % (op[len('tail'):], operand))
+                code.append('    jump %s' % join)
+            elif op in loads + stores or op == for_next:
+                code.append('    %s %s' % (op, rename(op, operand, names)))
+            elif op in branches:
+                code.append('    %s %s' % (op, labels[operand]))
+            elif op in class_operands:
+                code.append('    %s %s' % (op, retarget(operand)))
+            else:
+                code.append(line)
+
+        #the last return falls through to the join point
+        if code[-1] == '    jump %s' % join:
+            code.pop()
+        if '    jump %s' % join in code:
+            code.append('%s:' % join)
+        return code
+
+    def run(self, classes):
+        for class_ in classes:
+            for method in class_['methods']:
+                self.expand(class_, method)
+
+    def report(self, before, after):
+        #one line for each method inlined into each caller, with a count
+        lines = []
+        counts = {}
+        for pair in self.inlined:
+            counts[pair] = counts.get(pair, 0) + 1
+        for (callee, caller), count in counts.items():
+            sites = '' if count == 1 else ' (%d sites)' % count
+            lines.append('inlined %s into %s%s' % (callee, caller, sites))
+        growth = after - before
+        percent = 100 * growth / before if before else 0
+        lines.append('code size: %d -> %d instructions (%+d, %+.1f%%)' %
+                     (before, after, growth, percent))
+        return lines
+
+
+#inline small monomorphic methods in every class
+#returns lines describing what was inlined and how much the code grew
+def inline_methods(classes, types, temp_var, label, budget=default_budget,
+                   profile=None):
+    size = lambda: sum(code_size(method['code'])
+                       for class_ in classes for method in class_['methods'])
+    before = size()
+    inliner = Inliner(classes, types, temp_var, label, budget, profile)
+    inliner.run(classes)
+    return inliner.report(before, size())
@@ -0,0 +1,310 @@
+import itertools
+from compiler.errors import IRError
+
+#a typed intermediate representation in static single assignment form
+#every value is computed by exactly one instruction, and a variable
+#assigned on several paths is merged by a phi at the block they join in
+
+#operations that compute no value
+void_ops = (
+    'store_field',
+)
+
+#operations that end a basic block
+#branch goes to its first target if its operand is true, else the second
+#typeswitch goes to the target of the first class its operand is an
+#instance of, or to its last target if there is none
+terminators = (
+    'jump',
+    'branch',
+    'return',
+    'typeswitch'
+)
+
+
+#one instruction, which is also the value it computes
+class Instr:
+    def __init__(self, op, args=(), type='', **attrs):
+        #name of the operation
+        self.op = op
+        #values the instruction uses, in order
+        #the operands of a phi are in the order of its block's predecessors
+        self.args = list(args)
+        #static type of the value, or '' for instructions with no value
+        self.type = type
+        #operation-specific data, such as the name of a called method
+        self.attrs = attrs
+        #block the instruction belongs to
+        self.block = None
+        #number of the value, given when the function is numbered
+        self.number = None
+        #line of source the instruction comes from, if known
+        self.line = None
+
+    def has_value(self):
+        return self.op not in void_ops + terminators
+
+
+#a straight-line run of instructions that ends in a terminator
+class Block:
+    def __init__(self, name):
+        self.name = name
+        #phis come first, then other instructions
+        self.instrs = []
+        #instruction that ends the block, once it has one
+        self.term = None
+        #blocks that can jump to this one, in the order of phi operands
+        self.preds = []
+
+    def phis(self):
+        return [instr for instr in self.instrs if instr.op == 'phi']
+
+    def succs(self):
+        return list(self.term.targets) if self.term else []
+
+    def append(self, instr):
+        instr.block = self
+        if instr.op == 'phi':
+            #phis stay before every other instruction
+            index = len(self.phis())
+            self.instrs.insert(index, instr)
+        else:
+            self.instrs.append(instr)
+        return instr
+
+
+#the code of one method
+#blocks are kept in the order they should be laid out in
+class Function:
+    def __init__(self, class_name, name, params):
+        self.class_name = class_name
+        self.name = name
+        #names of the arguments, not counting the receiver
+        self.params = params
+        self.blocks = []
+        #source of block names
+        self.block_numbers = itertools.count()
+
+    def new_block(self):
+        block = Block('bb%d' % next(self.block_numbers))
+        self.blocks.append(block)
+        return block
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def instrs(self):
+        #every instruction, including terminators
+        for block in self.blocks:
+            yield from block.instrs
+            if block.term:
+                yield block.term
+
+    def uses(self):
+        #maps each value to the instructions that use it
+        users = {}
+        for instr in self.instrs():
+            for arg in instr.args:
+                users.setdefault(arg, []).append(instr)
+        return users
+
+    def replace_uses(self, old, new):
+        #make every instruction that uses old use new instead
+        for instr in self.instrs():
+            instr.args[:] = [new if arg is old else arg for arg in instr.args]
+
+    def remove(self, instr):
+        instr.block.instrs.remove(instr)
+        instr.block = None
+
+    def remove_edge(self, pred, block):
+        #forget that pred may jump to block, along with its phi operands
+        index = block.preds.index(pred)
+        del block.preds[index]
+        for phi in block.phis():
+            del phi.args[index]
+
+    def remove_unreachable(self):
+        #drop blocks no path from the entry reaches
+        reached = set()
+        work = [self.entry]
+        while work:
+            block = work.pop()
+            if block in reached:
+                continue
+            reached.add(block)
+            work.extend(block.succs())
+        for block in self.blocks:
+            if block in reached:
+                continue
+            for succ in set(block.succs()):
+                if succ in reached:
+                    while block in succ.preds:
+                        self.remove_edge(block, succ)
+        self.blocks = [block for block in self.blocks if block in reached]
+
+    def dominators(self):
+        #maps each block to the set of blocks that dominate it
+        blocks = set(self.blocks)
+        dom = {block: set(blocks) for block in self.blocks}
+        dom[self.entry] = {self.entry}
+        changed = True
+        while changed:
+            changed = False
+            for block in self.blocks[1:]:
+                preds = [dom[pred] for pred in block.preds if pred in dom]
+                new = set.intersection(*preds) if preds else set()
+                new = new | {block}
+                if new != dom[block]:
+                    dom[block] = new
+                    changed = True
+        return dom
+
+    def loop_headers(self):
+        #blocks that a block they dominate can jump back to
+        dom = self.dominators()
+        return {block for block in self.blocks
+                if any(block in dom[pred] for pred in block.preds)}
+
+    def number(self):
+        #give every value a number, in layout order
+        numbers = itertools.count()
+        for instr in self.instrs():
+            instr.number = next(numbers) if instr.has_value() else None
+
+
+#terminators keep the blocks they go to in their targets
+def terminator(op, args, targets, **attrs):
+    instr = Instr(op, args, **attrs)
+    instr.targets = targets
+    return instr
+
+
+#textual form of a value, as an operand
+def value_name(instr):
+    return '%%%d' % instr.number
+
+
+#textual form of one instruction
+def format_instr(instr):
+    args = ', '.join(map(value_name, instr.args))
+    attrs = instr.attrs
+    if instr.op == 'param':
+        text = 'param %s' % attrs['name']
+    elif instr.op == 'const':
+        text = 'const %s' % attrs['value']
+    elif instr.op == 'phi':
+        text = 'phi ' + ', '.join('[%s, %s]' % (value_name(arg), pred.name)
+                                  for arg, pred in
+                                  zip(instr.args, instr.block.preds))
+    elif instr.op == 'call':
+        kind = 'call_direct' if attrs['direct'] else 'call'
+        text = '%s %s:%s(%s)' % (kind, attrs['class_name'],
+                                 attrs['method'], args)
+    elif instr.op in ('load_field', 'store_field'):
+        text = '%s %s:%s(%s)' % (instr.op, attrs['class_name'],
+                                 attrs['field'], args)
+    elif instr.op == 'new':
+        text = 'new %s' % attrs['class_name']
+    elif instr.op == 'typeswitch':
+        cases = ', '.join('%s -> %s' % (c_name, target.name) for c_name, target
+                          in zip(attrs['classes'], instr.targets))
+        text = 'typeswitch %s [%s] else %s' % (args, cases,
+                                               instr.targets[-1].name)
+    elif instr.op in terminators:
+        parts = [value_name(arg) for arg in instr.args]
+        parts += [target.name for target in instr.targets]
+        text = '%s %s' % (instr.op, ', '.join(parts))
+    else:
+        text = '%s %s' % (instr.op, args)
+    if instr.has_value():
+        return '%s: %s = %s' % (value_name(instr), instr.type or '?', text)
+    return text
+
+
+#textual form of a function, for --emit-ir
+def format_function(function):
+    function.number()
+    params = ', '.join(function.params)
+    lines = ['method %s:%s(%s)' % (function.class_name, function.name, params)]
+    for block in function.blocks:
+        header = '%s:' % block.name
+        if block.preds:
+            header += ' ; preds ' + ', '.join(p.name for p in block.preds)
+        lines.append(header)
+        for instr in block.instrs:
+            lines.append('    ' + format_instr(instr))
+        if block.term:
+            lines.append('    ' + format_instr(block.term))
+    return '\n'.join(lines)
+
+
+#check that a function is well formed
+#raises IRError on the first problem found
+def verify(function):
+    def fail(msg, block):
+        raise IRError('%s:%s, %s: %s' % (function.class_name, function.name,
+                                         block.name, msg))
+
+    blocks = set(function.blocks)
+    defined = {}
+    for block in function.blocks:
+        if block.term is None or block.term.op not in terminators:
+            fail('block does not end in a terminator', block)
+        seen_other = False
+        for instr in block.instrs:
+            if instr.block is not block:
+                fail('%s is in the wrong block' % instr.op, block)
+            if instr.op in terminators:
+                fail('terminator in the middle of a block', block)
+            if instr.op == 'phi':
+                if seen_other:
+                    fail('phi after another instruction', block)
+                if len(instr.args) != len(block.preds):
+                    fail('phi does not have an operand for each predecessor',
+                         block)
+            else:
+                seen_other = True
+            if instr in defined:
+                fail('value defined twice', block)
+            defined[instr] = block
+        for target in block.succs():
+            if target not in blocks:
+                fail('jump to a block not in the function', block)
+            if block not in target.preds:
+                fail('%s does not list it as a predecessor' % target.name,
+                     block)
+    for block in function.blocks:
+        for pred in block.preds:
+            if pred not in blocks or block not in pred.succs():
+                fail('%s is not a predecessor' % pred.name, block)
+    if function.entry.preds:
+        fail('the entry block has predecessors', function.entry)
+
+    #every use must be dominated by the definition of its value
+    dom = function.dominators()
+    for block in function.blocks:
+        position = {instr: i for i, instr in enumerate(block.instrs)}
+        for instr in block.instrs + [block.term]:
+            for i, arg in enumerate(instr.args):
+                if arg not in defined:
+                    fail('%s uses a value that is not defined' % instr.op,
+                         block)
+                if not arg.has_value():
+                    fail('%s uses an instruction with no value' % instr.op,
+                         block)
+                if instr.op == 'phi':
+                    #a phi operand is used at the end of its predecessor
+                    use_block = block.preds[i]
+                    if defined[arg] not in dom[use_block]:
+                        fail('phi operand does not dominate its predecessor',
+                             block)
+                elif defined[arg] is block:
+                    if instr is not block.term and \
+                            position[arg] >= position[instr]:
+                        fail('%s uses a value before it is defined'
+                             % instr.op, block)
+                elif defined[arg] not in dom[block]:
+                    fail('%s uses a value that does not dominate it'
+                         % instr.op, block)
@@ -0,0 +1,486 @@
+from compiler.ir import Instr, Function, terminator, verify
+from compiler.generator import unobservable, int_ops
+from compiler.profile import site, source_line
+from compiler.iroptimizer import int_min, int_max
+
+#literals, and the type and constant each one has
+literals = {
+    'lit_true': ('Bool', 'true'),
+    'lit_false': ('Bool', 'false'),
+    'lit_nothing': ('Nothing', 'nothing')
+}
+
+
+#builds the SSA form of every method from the type checked tree
+#variables are renamed as they are assigned, and phis are placed where
+#their values are first read (Braun et al., "Simple and Efficient
+#Construction of Static Single Assignment Form")
+class IRBuilder:
+    def __init__(self, types):
+        #method tables of builtin and user-defined classes
+        self.types = types
+        #class objects, each with the functions of its methods
+        self.classes = []
+
+    def build(self, tree):
+        for class_ in tree.children[0].children:
+            self.class_(class_)
+        return self.classes
+
+    def class_(self, tree):
+        #the class object holds the same data as the generator's
+        name = str(tree.children[0].children[0])
+        sup = str(tree.children[0].children[2] or 'Obj')
+        obj = {
+            'name': name,
+            'super': sup,
+            'functions': [],
+            'inherited_fields': set(),
+            'fields': set()
+        }
+        if name in self.types:
+            obj['fields'] = set(self.types[name]['fields'])
+            obj['inherited_fields'] = set(self.types[sup]['fields'])
+        self.classes.append(obj)
+        self.current_class = obj
+        for method in tree.children[1].children[0].children:
+            obj['functions'].append(self.method(method))
+
+    def method(self, tree):
+        name = str(tree.children[0])
+        params = [str(arg.children[0]) for arg in tree.children[1].children]
+        self.function = Function(self.current_class['name'], name, params)
+        #value of each variable at the end of each block it is assigned in
+        self.current_def = {}
+        #blocks whose predecessors are all known
+        self.sealed = set()
+        #phis placed in blocks that were not yet sealed, by variable
+        self.incomplete = {}
+        #phis whose operands are being added
+        self.filling = set()
+        #values of expressions evaluated out of place, by node
+        self.values = {}
+        #blocks in the order they will be laid out
+        self.layout = []
+        self.var_types = self.variable_types(tree)
+        #line of source of the statement or expression being built
+        self.line = source_line(tree)
+
+        entry = self.function.new_block()
+        self.start(entry)
+        self.seal(entry)
+        this = self.emit(Instr('param', [], self.current_class['name'],
+                               name='this'))
+        self.write_var('this', entry, this)
+        for arg in tree.children[1].children:
+            arg_name = str(arg.children[0])
+            value = self.emit(Instr('param', [], str(arg.children[1]),
+                                    name=arg_name))
+            self.write_var(arg_name, entry, value)
+
+        self.statements(tree.children[3].children)
+        #the checker ends every method with a return, but an if/else whose
+        #branches all return leaves an unreachable join block behind
+        if self.current is not None:
+            self.ret(self.read_var('this', self.current))
+
+        self.function.blocks = self.layout
+        self.function.remove_unreachable()
+        verify(self.function)
+        return self.function
+
+    def variable_types(self, tree):
+        #the type of each variable, used as the type of its phis
+        types = {'this': self.current_class['name']}
+        for arg in tree.children[1].children:
+            types[str(arg.children[0])] = str(arg.children[1])
+        for node in tree.iter_subtrees():
+            if node.data == 'assign':
+                types[str(node.children[0])] = node.children[1] or node.type
+            elif node.data == 'type_alternative':
+                types[str(node.children[0])] = str(node.children[1])
+        return types
+
+    #blocks and instructions
+
+    def start(self, block):
+        #continue building in the given block, laid out after the others
+        self.current = block
+        self.layout.append(block)
+
+    def emit(self, instr):
+        if instr.line is None:
+            instr.line = self.line
+        return self.current.append(instr)
+
+    def end(self, op, args, targets, **attrs):
+        #end the current block, which becomes a predecessor of its targets
+        term = terminator(op, args, targets, **attrs)
+        term.block = self.current
+        term.line = self.line
+        self.current.term = term
+        for target in targets:
+            target.preds.append(self.current)
+        self.current = None
+
+    def jump(self, target):
+        self.end('jump', [], [target])
+
+    def ret(self, value):
+        self.end('return', [value], [])
+
+    #variables
+
+    def write_var(self, var, block, value):
+        self.current_def.setdefault(var, {})[block] = value
+
+    def read_var(self, var, block):
+        defs = self.current_def.get(var, {})
+        if block in defs:
+            return defs[block]
+        return self.read_var_recursive(var, block)
+
+    def read_var_recursive(self, var, block):
+        if block not in self.sealed:
+            #more predecessors may come, so the phi is completed later
+            value = block.append(Instr('phi', [], self.var_types.get(var, '')))
+            self.incomplete.setdefault(block, {})[var] = value
+        elif len(block.preds) == 1:
+            value = self.read_var(var, block.preds[0])
+        elif not block.preds:
+            #only unreachable code reads a variable no path defines
+            value = self.undefined()
+        else:
+            #write the phi first, so that a loop back to this block ends
+            phi = block.append(Instr('phi', [], self.var_types.get(var, '')))
+            self.write_var(var, block, phi)
+            value = self.add_phi_operands(var, phi)
+        self.write_var(var, block, value)
+        return value
+
+    def add_phi_operands(self, var, phi):
+        #a phi is not checked for being trivial while it is still missing
+        #some of its operands
+        self.filling.add(phi)
+        for pred in phi.block.preds:
+            value = self.read_var(var, pred)
+            phi.args.append(value)
+        self.filling.discard(phi)
+        return self.remove_trivial_phi(phi)
+
+    def remove_trivial_phi(self, phi):
+        #a phi that only merges one value (and itself) is that value
+        same = None
+        for arg in phi.args:
+            if arg is same or arg is phi:
+                continue
+            if same is not None:
+                return phi
+            same = arg
+        if same is None:
+            same = self.undefined()
+        users = [user for user in self.function.uses().get(phi, [])
+                 if user is not phi]
+        self.function.replace_uses(phi, same)
+        for defs in self.current_def.values():
+            for block, value in defs.items():
+                if value is phi:
+                    defs[block] = same
+        for node, value in self.values.items():
+            if value is phi:
+                self.values[node] = same
+        self.function.remove(phi)
+        #phis that used this one may have become trivial too
+        for user in users:
+            if user.op == 'phi' and user.block is not None \
+                    and user not in self.filling:
+                self.remove_trivial_phi(user)
+        return same
+
+    def seal(self, block):
+        #all predecessors of the block are known, so its phis can be filled
+        for var, phi in self.incomplete.pop(block, {}).items():
+            self.add_phi_operands(var, phi)
+        self.sealed.add(block)
+
+    def undefined(self):
+        #the value of a variable read where it was never assigned
+        return self.function.entry.append(Instr('const', [], 'Nothing',
+                                                value='nothing'))
+
+    #statements
+
+    def statements(self, statements):
+        for statement in statements:
+            if self.current is None:
+                #code after a return is never run, and is dropped later
+                self.start(self.function.new_block())
+                self.seal(self.current)
+            outer = self.line
+            self.line = source_line(statement) or outer
+            getattr(self, statement.data)(statement)
+            self.line = outer
+
+    def block(self, tree):
+        self.statements(tree.children)
+
+    statement_block = block
+
+    def raw_rexp(self, tree):
+        self.expr(tree.children[0])
+
+    def assign(self, tree):
+        value = self.expr(tree.children[2])
+        self.write_var(str(tree.children[0]), self.current, value)
+
+    def store_field(self, tree):
+        obj, field, value = tree.children
+        #a compound assignment such as "obj.f += v" loads from and stores to
+        #the same object expression, which must only be evaluated once
+        if any(node is obj for node in value.iter_subtrees()):
+            self.values[id(obj)] = self.expr(obj)
+        new_value = self.expr(value)
+        obj_value = self.expr(obj)
+        self.emit(Instr('store_field', [obj_value, new_value],
+                        class_name=obj.type, field=str(field)))
+
+    def ret_exp(self, tree):
+        #a constructor returns the object it constructed
+        if self.function.name == '$constructor':
+            self.ret(self.read_var('this', self.current))
+        else:
+            self.ret(self.expr(tree.children[0]))
+
+    def if_stmt(self, tree):
+        if_cond, if_block, elifs, _else = tree.children
+        arms = [(if_cond, if_block)] + [tuple(_elif.children)
+                                        for _elif in elifs.children]
+        join = self.function.new_block()
+        for i, (cond, block) in enumerate(arms):
+            then = self.function.new_block()
+            #the last condition without an else falls through to the join
+            if i == len(arms) - 1 and not _else.children:
+                other = join
+            else:
+                other = self.function.new_block()
+            self.branch(cond, then, other)
+            self.start(then)
+            self.seal(then)
+            self.visit(block)
+            if self.current is not None:
+                self.jump(join)
+            if other is not join:
+                self.start(other)
+                self.seal(other)
+        if _else.children:
+            self.visit(_else.children[0])
+            if self.current is not None:
+                self.jump(join)
+        self.start(join)
+        self.seal(join)
+
+    def while_lp(self, tree):
+        condition, block = tree.children
+        #loop invariant expressions are evaluated once, before the loop
+        for expr in getattr(tree, 'invariants', []):
+            self.values[id(expr)] = self.expr(expr)
+        header = self.function.new_block()
+        body = self.function.new_block()
+        exit = self.function.new_block()
+        self.jump(header)
+
+        #the condition is laid out after the body, so that the loop
+        #takes one branch per iteration, as the generator's loops do
+        mark = len(self.layout)
+        self.start(header)
+        self.branch(condition, body, exit)
+        test = self.layout[mark:]
+        del self.layout[mark:]
+
+        self.start(body)
+        self.seal(body)
+        if hasattr(tree, 'counter') and self.may_wrap(*tree.counter):
+            self.count_up(tree.counter, block, header, exit)
+        else:
+            self.visit(block)
+        if self.current is not None:
+            self.jump(header)
+        self.seal(header)
+        self.layout.extend(test)
+        self.start(exit)
+        self.seal(exit)
+
+    def may_wrap(self, count, limit, step):
+        #check whether a step past the end of a for loop's range could
+        #carry the counter past the largest or smallest Int
+        #the counter is short of the end before each step, so a step
+        #of one never passes it
+        if not limit.isdigit():
+            return abs(step) > 1
+        if step > 0:
+            return int(limit) - 1 + step > int_max
+        return int(limit) + 1 + step < int_min
+
+    def count_up(self, counter, block, header, exit):
+        #the Int sum wraps around, so a counter that would pass the end of
+        #the Ints leaves the loop, as for_next does, before it is tested
+        count, limit, step = counter
+        self.statements(block.children[:-1])
+        if self.current is None:
+            return
+        old = self.read_var(count, self.current)
+        self.visit(block.children[-1])
+        new = self.read_var(count, self.current)
+        value = self.emit(Instr('call', [new, old], 'Bool', class_name='Int',
+                                method='MORE' if step > 0 else 'LESS',
+                                direct=False, site=None))
+        self.end('branch', [value], [header, exit])
+
+    def typecase(self, tree):
+        expr, alts = tree.children
+        value = self.expr(expr)
+        if not alts.children:
+            return
+        blocks = [self.function.new_block() for alt in alts.children]
+        join = self.function.new_block()
+        classes = [str(alt.children[1]) for alt in alts.children]
+        self.end('typeswitch', [value], blocks + [join], classes=classes,
+                 site=site(tree))
+        for alt, block in zip(alts.children, blocks):
+            name, _, alt_block = alt.children
+            self.start(block)
+            self.seal(block)
+            #the variable names the same object, known to be of its class
+            self.write_var(str(name), block, value)
+            self.visit(alt_block)
+            if self.current is not None:
+                self.jump(join)
+        self.start(join)
+        self.seal(join)
+
+    def visit(self, tree):
+        getattr(self, tree.data)(tree)
+
+    def branch(self, cond, if_true, if_false):
+        #conditions of if, elif and while name the branch in profiles
+        span = site(cond) if cond.data == 'condition' else None
+        if cond.data == 'condition':
+            cond = cond.children[0]
+        value = self.expr(cond)
+        self.end('branch', [value], [if_true, if_false], site=span)
+
+    #expressions
+
+    def int_op(self, tree):
+        #check whether a call is made by an Int instruction
+        receiver, m_name, args = tree.children
+        return (receiver.type == 'Int' and str(m_name) in int_ops
+                and all(arg.type == 'Int' for arg in args.children))
+
+    def unobservable(self, tree):
+        #evaluating these has no effects and cannot observe any
+        return tree.data in unobservable or id(tree) in self.values
+
+    def expr(self, tree):
+        #an expression evaluated out of place already has its value
+        if id(tree) in self.values:
+            return self.values[id(tree)]
+        outer = self.line
+        self.line = source_line(tree) or outer
+        value = getattr(self, 'x_' + tree.data)(tree)
+        self.line = outer
+        return value
+
+    def x_lit_number(self, tree):
+        return self.emit(Instr('const', [], 'Int', value=str(tree.children[0])))
+
+    def x_lit_string(self, tree):
+        return self.emit(Instr('const', [], 'String',
+                               value=str(tree.children[0])))
+
+    def x_lit_true(self, tree):
+        return self.literal(tree)
+
+    x_lit_false = x_lit_nothing = x_lit_true
+
+    def literal(self, tree):
+        type, value = literals[tree.data]
+        return self.emit(Instr('const', [], type, value=value))
+
+    def x_var(self, tree):
+        return self.read_var(str(tree.children[0]), self.current)
+
+    def x_load_field(self, tree):
+        obj, field = tree.children
+        value = self.expr(obj)
+        return self.emit(Instr('load_field', [value], tree.type,
+                               class_name=obj.type, field=str(field)))
+
+    def x_m_call(self, tree):
+        receiver, m_name, args = tree.children
+        #the receiver is evaluated before the arguments, unless nothing
+        #could tell the difference; the callee takes the receiver last
+        #(Int instructions take the receiver first, like the source)
+        if not self.int_op(tree) and \
+                all(self.unobservable(arg) for arg in args.children):
+            values = [self.expr(arg) for arg in args.children]
+            values.insert(0, self.expr(receiver))
+        else:
+            values = [self.expr(receiver)]
+            values += [self.expr(arg) for arg in args.children]
+        direct = getattr(tree, 'direct', None)
+        return self.emit(Instr('call', values, tree.type,
+                               class_name=direct or receiver.type,
+                               method=str(m_name), direct=bool(direct),
+                               site=site(tree)))
+
+    def x_c_call(self, tree):
+        c_name, args = tree.children
+        values = [self.expr(arg) for arg in args.children]
+        obj = self.emit(Instr('new', [], str(c_name), class_name=str(c_name)))
+        return self.emit(Instr('call', [obj] + values, str(c_name),
+                               class_name=str(c_name), method='$constructor',
+                               direct=bool(getattr(tree, 'direct', None)),
+                               site=None))
+
+    def x_and_exp(self, tree):
+        #false if the left side is false, else the value of the right side
+        return self.short_circuit(tree, 'false', True)
+
+    def x_or_exp(self, tree):
+        #true if the left side is true, else the value of the right side
+        return self.short_circuit(tree, 'true', False)
+
+    def short_circuit(self, tree, constant, right_when):
+        left, right = tree.children
+        known = self.emit(Instr('const', [], 'Bool', value=constant))
+        rest = self.function.new_block()
+        join = self.function.new_block()
+        if right_when:
+            self.branch(left, rest, join)
+        else:
+            self.branch(left, join, rest)
+        self.start(rest)
+        self.seal(rest)
+        value = self.expr(right)
+        self.jump(join)
+        self.start(join)
+        self.seal(join)
+        #the join's first predecessor is the block that tested the left side
+        return self.emit(Instr('phi', [known, value], 'Bool'))
+
+    def x_ternary(self, tree):
+        cond, t_exp, f_exp = tree.children
+        t_block = self.function.new_block()
+        f_block = self.function.new_block()
+        join = self.function.new_block()
+        self.branch(cond, t_block, f_block)
+        values = []
+        for block, expr in ((t_block, t_exp), (f_block, f_exp)):
+            self.start(block)
+            self.seal(block)
+            values.append(self.expr(expr))
+            self.jump(join)
+        self.start(join)
+        self.seal(join)
+        return self.emit(Instr('phi', values, tree.type))
@@ -0,0 +1,375 @@
+import itertools
+from collections import defaultdict as dd
+from compiler.generator import int_ops, int_branches
+
+#values that are never kept in a variable, since pushing them again
+#costs no more than loading them
+#a constant used once in its own block is still pushed where it is
+#computed, so that it can be under the values computed after it
+rematerialized = (
+    'const',
+    'param'
+)
+
+
+#lowers SSA functions to stack machine code
+#a value used once, later in the block it is computed in, stays on the
+#stack until it is used; every other value is stored in a variable of
+#its own, which the slot allocator later packs with the others
+#a phi is a variable its block's predecessors store their values to
+class StackEmitter:
+    def __init__(self):
+        #stores count of label prefixes
+        self.labels = dd(itertools.count)
+        #stores count of temporary variables
+        self.temp_vars = 0
+
+    def label(self, prefix):
+        #generates a unique label name with the given prefix
+        num = next(self.labels[prefix])
+        return f'{prefix}_{num}'
+
+    def temp_var(self):
+        ret = '__TEMP_VAR%d' % self.temp_vars
+        self.temp_vars += 1
+        return ret
+
+    def emit(self, line, tab=True):
+        #like the generator, marks where the line of source changes
+        if (tab or line.startswith('.site')) and self.line is not None \
+                and self.line != self.emitted_line:
+            self.emitted_line = self.line
+            self.emit('.line %d' % self.line, False)
+        if tab:
+            line = '    ' + line
+        self.code.append(line)
+
+    def emit_class(self, class_ir):
+        #a class object like the ones the generator makes
+        class_ = {key: value for key, value in class_ir.items()
+                  if key != 'functions'}
+        class_['methods'] = [self.emit_function(function)
+                             for function in class_ir['functions']]
+        return class_
+
+    def emit_function(self, function):
+        self.function = function
+        self.method = {
+            'name': function.name,
+            'args': list(function.params),
+            'locals': {},
+            'code': []
+        }
+        self.code = self.method['code']
+        self.uses = function.uses()
+        self.headers = function.loop_headers()
+        #variable holding each value that is not kept on the stack
+        self.vars = {}
+        #label of each block something jumps to
+        self.block_labels = {}
+        #code of the edges whose phi copies need a block of their own
+        self.edges = []
+        #line of source of the instruction being lowered, and the line
+        #the last .line directive gave
+        self.line = None
+        self.emitted_line = None
+        self.coalesce()
+
+        self.emit('enter')
+        starts = []
+        for i, block in enumerate(function.blocks):
+            starts.append(len(self.code))
+            following = function.blocks[i + 1] if i + 1 < len(function.blocks) \
+                else None
+            self.emit_block(block, following)
+        for lines in self.edges:
+            self.code.extend(lines)
+
+        #labels are placed only where something jumps to
+        for block, start in reversed(list(zip(function.blocks, starts))):
+            if block in self.block_labels:
+                self.code.insert(start, '%s:' % self.block_labels[block])
+        return self.method
+
+    #variables
+
+    def var(self, value):
+        #the variable a value is kept in, made the first time it is needed
+        if value not in self.vars:
+            name = self.temp_var()
+            self.vars[value] = name
+            self.method['locals'][name] = value.type
+        return self.vars[value]
+
+    def coalesce(self):
+        #a value used only by a phi, computed in the predecessor it comes
+        #from, can be stored straight into the phi's variable
+        #unless the phi's block starts a loop, no path from the phi to the
+        #predecessor exists, so the phi's old value is never needed there
+        for block in self.function.blocks:
+            if block in self.headers:
+                continue
+            for phi in block.phis():
+                for pred, value in zip(block.preds, phi.args):
+                    if (value.block is pred and value.op != 'phi'
+                            and value.op not in rematerialized
+                            and len(self.uses[value]) == 1
+                            and value not in self.vars):
+                        self.vars[value] = self.var(phi)
+
+    def stackable(self, value):
+        #check whether a value stays on the stack until it is used
+        if value.op in ('param', 'phi'):
+            return False
+        users = self.uses.get(value, [])
+        if (len(users) != 1 or users[0].op == 'phi'
+                or users[0].block is not value.block or value in self.vars):
+            return False
+        if value.op == 'const':
+            #a constant is pushed early only if the values its user takes
+            #before it are already on the stack under it
+            needed = self.push_order(users[0])
+            index = next(i for i, arg in enumerate(needed) if arg is value)
+            return all(arg.op != 'const' and self.stackable(arg)
+                       for arg in needed[:index])
+        return True
+
+    def push_order(self, instr):
+        #the values an instruction takes, in the order they are pushed
+        if instr.op == 'call' and not self.int_op(instr):
+            #the callee expects the arguments in order with the receiver
+            #on top of them
+            return instr.args[1:] + instr.args[:1]
+        if instr.op == 'store_field':
+            return instr.args[::-1]
+        return instr.args
+
+    def push(self, value):
+        if value.op == 'const':
+            literal = value.attrs['value']
+            if value.type == 'Int' and literal.startswith('-'):
+                #the assembler takes no negative literals
+                self.emit('const %s' % literal[1:])
+                self.emit('ineg')
+            else:
+                self.emit('const %s' % literal)
+        elif value.op == 'param':
+            name = value.attrs['name']
+            self.emit('load %s' % ('$' if name == 'this' else name))
+        else:
+            self.emit('load %s' % self.var(value))
+
+    def ensure(self, needed):
+        #push the values an instruction takes, in the order it takes them
+        #values waiting on the stack are used where they are, if they
+        #are the first of the needed values; otherwise they are stored
+        pending = self.pending
+        kept = 0
+        for n in range(min(len(pending), len(needed)), 0, -1):
+            if all(a is b for a, b in zip(pending[-n:], needed[:n])):
+                kept = n
+                break
+        rest = needed[kept:]
+        if any(value in pending for value in rest):
+            while pending:
+                value = pending.pop()
+                if value.op == 'const':
+                    #pushed again where it is needed
+                    self.emit('pop')
+                else:
+                    self.emit('store %s' % self.var(value))
+            kept = 0
+            rest = needed
+        for value in rest:
+            self.push(value)
+        del pending[len(pending) - kept:]
+
+    def result(self, instr):
+        #keep the value an instruction pushed, or discard it
+        if not self.uses.get(instr):
+            self.emit('pop')
+        elif self.stackable(instr):
+            self.pending.append(instr)
+        else:
+            self.emit('store %s' % self.var(instr))
+
+    #instructions
+
+    def class_name(self, c_name):
+        #the current class has the $ alias
+        return '$' if c_name == self.function.class_name else c_name
+
+    def site(self, span, suffix=''):
+        if span is not None:
+            self.emit('.site %s%s' % (span, suffix), False)
+
+    def int_op(self, instr):
+        #the instruction for a call with Int receiver and arguments
+        if instr.op != 'call' or instr.args[0].type != 'Int':
+            return None
+        if any(arg.type != 'Int' for arg in instr.args[1:]):
+            return None
+        return int_ops.get(instr.attrs['method'])
+
+    def emit_block(self, block, following):
+        self.pending = []
+        instrs = [instr for instr in block.instrs
+                  if instr.op not in ('phi', 'param')]
+        term = block.term
+        #a comparison that only decides the branch is made by the branch
+        fused = bool(instrs) and self.fused(instrs[-1], term)
+        if fused:
+            instrs.pop()
+        for i, instr in enumerate(instrs):
+            last = i == len(instrs) - 1
+            self.line = instr.line or self.line
+            if last and term.op == 'return' and term.args[0] is instr \
+                    and instr.op == 'call' and not self.int_op(instr) \
+                    and self.stackable(instr):
+                #a call in tail position returns straight to our caller
+                self.call(instr, 'tail')
+                return
+            self.instr(instr)
+        self.copies(block)
+        self.line = term.line or self.line
+        self.terminator(block, following, fused)
+
+    def instr(self, instr):
+        op = instr.op
+        attrs = instr.attrs
+        if op == 'const':
+            if self.stackable(instr):
+                self.push(instr)
+                self.pending.append(instr)
+        elif op == 'call':
+            self.call(instr)
+            self.result(instr)
+        elif op == 'new':
+            self.emit('new %s' % self.class_name(attrs['class_name']))
+            self.result(instr)
+        elif op == 'load_field':
+            self.ensure(instr.args)
+            self.emit('load_field %s:%s' % (self.class_name(attrs['class_name']),
+                                            attrs['field']))
+            self.result(instr)
+        elif op == 'store_field':
+            self.ensure(self.push_order(instr))
+            self.emit('store_field %s:%s' % (self.class_name(attrs['class_name']),
+                                             attrs['field']))
+
+    def call(self, instr, prefix=''):
+        op = self.int_op(instr)
+        if op:
+            #Int instructions take their operands in source order
+            self.ensure(instr.args)
+            self.emit(op)
+            return
+        self.ensure(self.push_order(instr))
+        call = 'call_direct' if instr.attrs['direct'] else 'call'
+        self.site(instr.attrs['site'])
+        self.emit('%s%s %s:%s' % (prefix, call,
+                                  self.class_name(instr.attrs['class_name']),
+                                  instr.attrs['method']))
+
+    def fused(self, instr, term):
+        #check whether a comparison only decides the branch after it
+        return (term.op == 'branch' and term.args[0] is instr
+                and self.int_op(instr) in int_branches
+                and self.stackable(instr))
+
+    def copies(self, block):
+        #store the values the block gives to the phis of its successors
+        for succ in dict.fromkeys(block.succs()):
+            moves = self.moves(block, succ)
+            if not moves:
+                continue
+            if len(block.succs()) > 1 and succ in self.headers:
+                #the phis of a loop may still be needed on the other path,
+                #so the copies are made on the way into the loop only
+                label = self.label('edge')
+                lines = ['%s:' % label]
+                saved, self.code = self.code, lines
+                #the edge is placed after all the blocks
+                emitted, self.emitted_line = self.emitted_line, None
+                self.move(moves)
+                self.emit('jump %s' % self.block_label(succ))
+                self.code = saved
+                self.emitted_line = emitted
+                self.edges.append(lines)
+                self.block_labels[(block, succ)] = label
+            else:
+                self.move(moves)
+
+    def moves(self, block, succ):
+        index = succ.preds.index(block)
+        moves = []
+        for phi in succ.phis():
+            value = phi.args[index]
+            if self.vars.get(value) != self.var(phi):
+                moves.append((phi, value))
+        return moves
+
+    def move(self, moves):
+        #all values are read before any phi is written, since a phi may
+        #be the value given to another
+        for phi, value in moves:
+            self.push(value)
+        for phi, value in reversed(moves):
+            self.emit('store %s' % self.var(phi))
+
+    def block_label(self, block):
+        if block not in self.block_labels:
+            self.block_labels[block] = self.label('block')
+        return self.block_labels[block]
+
+    def target(self, block, succ):
+        #the label to jump to from block to succ, which may be an edge
+        return self.block_labels.get((block, succ)) or self.block_label(succ)
+
+    def terminator(self, block, following, fused):
+        term = block.term
+        attrs = term.attrs
+        if term.op == 'jump':
+            succ = term.targets[0]
+            if succ is not following or (block, succ) in self.block_labels:
+                self.emit('jump %s' % self.target(block, succ))
+        elif term.op == 'return':
+            self.ensure(term.args)
+            self.emit('return %d' % len(self.function.params))
+        elif term.op == 'typeswitch':
+            self.ensure(term.args)
+            self.site(attrs.get('site'))
+            classes = [self.class_name(c_name) for c_name in attrs['classes']]
+            self.emit('typeswitch %s' % ','.join(classes))
+            for succ in term.targets:
+                self.emit('jump %s' % self.target(block, succ))
+        elif term.op == 'branch':
+            cond = term.args[0]
+            if_true, if_false = term.targets
+            op = self.int_op(cond)
+            if fused:
+                self.ensure(cond.args)
+                on_true, on_false = int_branches[op]
+            else:
+                self.ensure([cond])
+                on_true, on_false = 'jump_if', 'jump_ifnot'
+            span = attrs.get('site')
+            if if_true is following and (block, if_true) not in self.block_labels:
+                #fall through to the true block
+                self.site(span)
+                self.emit('%s %s' % (on_false, self.target(block, if_false)))
+            else:
+                self.site(span, '+')
+                self.emit('%s %s' % (on_true, self.target(block, if_true)))
+                if if_false is not following or \
+                        (block, if_false) in self.block_labels:
+                    self.emit('jump %s' % self.target(block, if_false))
+
+
+#lower the SSA form of every class to the class objects of the generator
+#returns the emitter, whose label and temp_var later passes use
+def emit_classes(class_irs, classes):
+    emitter = StackEmitter()
+    for class_ir in class_irs:
+        classes.append(emitter.emit_class(class_ir))
+    return emitter
@@ -0,0 +1,245 @@
+from compiler.effects import pure_methods, partial_methods, is_final
+from compiler.ir import Instr, verify
+
+#Ints are 32 bits wide in the VM, so only results that fit are folded
+int_min = -2 ** 31
+int_max = 2 ** 31 - 1
+
+
+#Int division and remainder as C computes them, rounding toward zero
+def c_divide(a, b):
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+def c_mod(a, b):
+    return a - b * c_divide(a, b)
+
+
+#Int methods and the value each computes from constant operands
+int_folds = {
+    'PLUS': lambda a, b: a + b,
+    'MINUS': lambda a, b: a - b,
+    'TIMES': lambda a, b: a * b,
+    'DIVIDE': c_divide,
+    'MOD': c_mod,
+    'NEG': lambda a: -a,
+    'LESS': lambda a, b: a < b,
+    'ATMOST': lambda a, b: a <= b,
+    'MORE': lambda a, b: a > b,
+    'ATLEAST': lambda a, b: a >= b,
+    'EQUALS': lambda a, b: a == b
+}
+
+#instructions other than calls that have no effect and cannot fail
+pure_ops = (
+    'param',
+    'const',
+    'phi',
+    'new',
+    'load_field'
+)
+
+
+def is_const(instr, type=None):
+    return instr.op == 'const' and (type is None or instr.type == type)
+
+
+#the value of a constant, as a Python value
+def const_value(instr):
+    value = instr.attrs['value']
+    if instr.type == 'Int':
+        return int(value)
+    if instr.type == 'Bool':
+        return value == 'true'
+    return value
+
+
+#a new constant instruction for a Python Int or Bool
+def make_const(value):
+    if isinstance(value, bool):
+        return Instr('const', [], 'Bool', value='true' if value else 'false')
+    return Instr('const', [], 'Int', value=str(value))
+
+
+#check whether a call always runs a pure builtin method that cannot fail
+#with the operands it is given, so it can be removed if its value is unused
+def is_pure(instr, types):
+    if instr.op in pure_ops:
+        return True
+    if instr.op != 'call':
+        return False
+    typ = instr.args[0].type
+    m_name = instr.attrs['method']
+    if typ not in types or not is_final(typ, types):
+        return False
+    if m_name in pure_methods.get(typ, ()):
+        #Int and String equality fail when given some other type of object
+        if m_name == 'EQUALS' and typ != 'Bool':
+            return instr.args[1].type == typ
+        return True
+    if m_name in partial_methods.get(typ, ()):
+        divisor = instr.args[1]
+        return is_const(divisor, 'Int') and const_value(divisor) != 0
+    return False
+
+
+#replace a value with a new instruction placed where it was
+#(or, for a phi, right after the block's phis)
+def replace(function, old, new):
+    block = old.block
+    index = block.instrs.index(old)
+    if old.op == 'phi':
+        index = len(block.phis())
+    block.instrs.insert(index, new)
+    new.block = block
+    function.replace_uses(old, new)
+    function.remove(old)
+
+
+#evaluate Int and Bool operations on constants at compile time, and
+#replace branches on constants with jumps
+def propagate_constants(function):
+    changed = False
+    for block in function.blocks:
+        for instr in list(block.instrs):
+            folded = fold(instr)
+            if folded is not None:
+                replace(function, instr, folded)
+                changed = True
+        term = block.term
+        if term.op == 'branch' and is_const(term.args[0], 'Bool'):
+            #the branch always goes the same way
+            taken, skipped = term.targets
+            if not const_value(term.args[0]):
+                taken, skipped = skipped, taken
+            function.remove_edge(block, skipped)
+            term.op = 'jump'
+            term.args = []
+            term.targets = [taken]
+            changed = True
+    if changed:
+        function.remove_unreachable()
+    return changed
+
+
+def fold(instr):
+    #the constant a call on constants computes, if it can be known
+    if instr.op == 'phi':
+        #a phi of equal constants is that constant
+        if instr.args and all(is_const(arg) for arg in instr.args):
+            values = {(arg.type, arg.attrs['value']) for arg in instr.args}
+            if len(values) == 1:
+                first = instr.args[0]
+                return Instr('const', [], first.type, **first.attrs)
+        return None
+    if instr.op != 'call' or not all(map(is_const, instr.args)):
+        return None
+    receiver = instr.args[0]
+    m_name = instr.attrs['method']
+    values = [const_value(arg) for arg in instr.args]
+    if receiver.type == 'Bool' and m_name == 'NEGATE':
+        return make_const(not values[0])
+    if receiver.type != 'Int' or m_name not in int_folds:
+        return None
+    if any(arg.type != 'Int' for arg in instr.args):
+        return None
+    if m_name in ('DIVIDE', 'MOD') and values[1] == 0:
+        #division by zero fails at run time, which must still happen
+        return None
+    result = int_folds[m_name](*values)
+    if not isinstance(result, bool) and not int_min <= result <= int_max:
+        return None
+    return make_const(result)
+
+
+#replace values that only copy another value with that value
+#a phi whose operands are all one value (or itself) copies that value,
+#and a field loaded after it was stored or loaded in the same block,
+#with no call or store to the field in between, is the same value
+def propagate_copies(function):
+    changed = False
+    for block in function.blocks:
+        for phi in block.phis():
+            others = {id(arg): arg for arg in phi.args if arg is not phi}
+            if len(others) == 1 and phi.block is not None:
+                replace_value(function, phi, *others.values())
+                changed = True
+
+        #value of each field of each object, as (object, field)
+        known = {}
+        for instr in list(block.instrs):
+            if instr.op == 'load_field':
+                key = instr.args[0], instr.attrs['field']
+                if key in known:
+                    replace_value(function, instr, known[key])
+                    changed = True
+                else:
+                    known[key] = instr
+            elif instr.op == 'store_field':
+                obj, value = instr.args
+                field = instr.attrs['field']
+                #another object may be the same one, so forget the field
+                for key in list(known):
+                    if key[1] == field:
+                        del known[key]
+                known[obj, field] = value
+            elif instr.op == 'call':
+                #any call may store to any field
+                known = {}
+    return changed
+
+
+def replace_value(function, old, new):
+    function.replace_uses(old, new)
+    function.remove(old)
+
+
+#remove stores whose value is never read, and values that are never used
+#a field store is dead if the same field of the same object is stored
+#again later in the block, with no call or load of the field in between
+def eliminate_dead_stores(function, types):
+    changed = False
+    for block in function.blocks:
+        #the last store to each (object, field) not yet read
+        pending = {}
+        for instr in list(block.instrs):
+            if instr.op == 'store_field':
+                key = instr.args[0], instr.attrs['field']
+                if key in pending:
+                    function.remove(pending[key])
+                    changed = True
+                pending[key] = instr
+            elif instr.op == 'load_field':
+                field = instr.attrs['field']
+                for key in list(pending):
+                    if key[1] == field:
+                        del pending[key]
+            elif instr.op == 'call':
+                pending = {}
+
+    #mark the values that something with an effect depends on
+    live = set()
+    work = [instr for instr in function.instrs()
+            if not instr.has_value() or not is_pure(instr, types)]
+    while work:
+        instr = work.pop()
+        if instr in live:
+            continue
+        live.add(instr)
+        work.extend(instr.args)
+    for block in function.blocks:
+        for instr in list(block.instrs):
+            if instr not in live:
+                function.remove(instr)
+                changed = True
+    return changed
+
+
+#run the optimizations on a function until none of them changes it
+def optimize(function, types):
+    changed = True
+    while changed:
+        changed = propagate_constants(function)
+        changed |= propagate_copies(function)
+        changed |= eliminate_dead_stores(function, types)
+    verify(function)
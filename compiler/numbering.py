@@ -0,0 +1,301 @@
+import itertools
+from compiler.allocator import split_line, branches, terminators, int_jumps, \
+    for_next
+from compiler.effects import pure_methods, partial_methods, is_final
+from compiler.generator import int_ops
+
+#instructions that end a basic block
+#labels also start a new block, since other code may jump to them
+block_enders = branches + terminators
+
+#instructions that call a method
+calls = ('call', 'call_direct')
+
+#Int instructions, and the Int method each one performs
+int_methods = {op: m_name for m_name, op in int_ops.items()}
+
+#instructions on unboxed Ints, and how many values each one pops
+#(each pushes one value)
+raw_effects = {
+    'load_int': 0,
+    'push_int': 0,
+    'box': 1,
+    'unbox': 1,
+    'radd': 2,
+    'rsub': 2,
+    'rmul': 2,
+    'rdiv': 2,
+    'rmod': 2,
+    'rneg': 1
+}
+
+#a replaced computation must cost at least this much to be worth
+#keeping in a temporary, which costs a store and a load
+worth_spilling = 4
+
+
+#one value on the abstract evaluation stack
+#start is the index of the first instruction that computes the value,
+#or None if that code is not a contiguous run in the current block
+class Entry:
+    def __init__(self, number, start):
+        self.number = number
+        self.start = start
+
+
+#local value numbering over the basic blocks of generated code
+#a computation whose value is already available is replaced with a load
+class ValueNumbering:
+    def __init__(self, class_name, types, temp_var):
+        #name of the class whose methods are numbered, for the $ alias
+        self.class_name = class_name
+        #method tables - used for method arity and result types
+        self.types = types
+        #function that generates a fresh temporary variable name
+        self.temp_var = temp_var
+        #source of fresh value numbers
+        self.numbers = itertools.count()
+
+    def number_method(self, method):
+        self.method = method
+        code = []
+        block = []
+        for line in method['code']:
+            label, op, operand = split_line(line)
+            if label is not None:
+                #a label starts a new block
+                code.extend(self.number_block(block))
+                block = []
+                code.append(line)
+                continue
+            block.append(line)
+            if op in block_enders:
+                code.extend(self.number_block(block))
+                block = []
+        code.extend(self.number_block(block))
+        method['code'] = code
+
+    def fresh(self):
+        return next(self.numbers)
+
+    def class_of(self, name):
+        return self.class_name if name == '$' else name
+
+    def lookup(self, key):
+        #find the value number of a computation, creating one if needed
+        if key not in self.table:
+            self.table[key] = self.fresh()
+        return self.table[key]
+
+    def kill_fields(self, field=None):
+        #forget loaded field values, either of one field or of all fields
+        #a field is known by its name only, since P:x and $:x may be the
+        #same field of the same object
+        name = field.split(':')[1] if field is not None else None
+        for key in list(self.table):
+            if key[0] == 'field' and \
+                    (name is None or key[1].split(':')[1] == name):
+                del self.table[key]
+
+    def forget(self, var):
+        #the variable now holds a value nothing else is known to equal
+        old = self.versions.get(var)
+        if old is not None:
+            self.holders[old].discard(var)
+        self.versions[var] = self.fresh()
+        self.holders[self.versions[var]] = {var}
+
+    def pop(self):
+        #values pushed in another block are unknown here
+        if self.stack:
+            return self.stack.pop()
+        return Entry(self.fresh(), None)
+
+    def pop_many(self, n):
+        entries = [self.pop() for i in range(n)]
+        entries.reverse()
+        return entries
+
+    def value_type(self, op, operand):
+        #static type of the value an instruction computes
+        class_name, member = operand.split(':')
+        class_ = self.types.get(self.class_of(class_name), {})
+        if op == 'load_field':
+            return class_.get('fields', {}).get(member, '')
+        return class_.get('methods', {}).get(member, {}).get('ret', '')
+
+    def is_pure(self, operand):
+        #only calls that always run a pure builtin method can be reused
+        #(a call whose first evaluation succeeded gives the same value again)
+        class_name, m_name = operand.split(':')
+        methods = pure_methods.get(class_name, ()) + \
+            partial_methods.get(class_name, ())
+        return m_name in methods and is_final(class_name, self.types)
+
+    def arity(self, operand):
+        class_name, m_name = operand.split(':')
+        try:
+            class_ = self.types[self.class_of(class_name)]
+            return len(class_['methods'][m_name]['params'])
+        except KeyError:
+            return None
+
+    def number_block(self, block):
+        #current value number of each local variable
+        self.versions = {}
+        #local variables holding each value number
+        self.holders = {}
+        #value number of each computation seen in this block
+        self.table = {}
+        #first instruction and type of computed values nobody holds
+        self.sites = {}
+        self.stack = []
+        #rewrites: replaced instruction runs, and stores after first sites
+        replaced = {}
+        deleted = set()
+        inserted = {}
+
+        for i, line in enumerate(block):
+            label, op, operand = split_line(line)
+            if op == 'load':
+                if operand not in self.versions:
+                    self.versions[operand] = self.fresh()
+                    self.holders[self.versions[operand]] = {operand}
+                self.stack.append(Entry(self.versions[operand], i))
+            elif op == 'store':
+                entry = self.pop()
+                old = self.versions.get(operand)
+                if old is not None:
+                    self.holders[old].discard(operand)
+                self.versions[operand] = entry.number
+                self.holders.setdefault(entry.number, set()).add(operand)
+            elif op == 'store_int':
+                #the slot holds a raw number, which no load can reuse
+                self.pop()
+                self.forget(operand)
+            elif op == for_next:
+                #the counter is given a new value
+                self.forget(operand.split(',')[0])
+            elif op in raw_effects:
+                #unboxed values are not numbered, but keep the stack shape
+                self.pop_many(raw_effects[op])
+                self.stack.append(Entry(self.fresh(), None))
+            elif op == 'const':
+                number = self.lookup(('const', operand))
+                self.stack.append(Entry(number, i))
+            elif op == 'load_field':
+                obj = self.pop()
+                number = self.lookup(('field', operand, obj.number))
+                start = obj.start
+                self.push_value(block, i, start, number, op, operand,
+                                replaced, deleted, inserted)
+            elif op == 'store_field':
+                self.pop_many(2)
+                self.kill_fields(operand)
+            elif op in calls and self.arity(operand) is not None:
+                entries = self.pop_many(self.arity(operand) + 1)
+                if self.is_pure(operand):
+                    key = ('call', operand) + tuple(e.number for e in entries)
+                    number = self.lookup(key)
+                    start = entries[0].start
+                    if any(e.start is None for e in entries):
+                        start = None
+                    self.push_value(block, i, start, number, op, operand,
+                                    replaced, deleted, inserted)
+                else:
+                    #any other call may store to any field
+                    self.kill_fields()
+                    self.stack.append(Entry(self.fresh(), None))
+            elif op in int_methods:
+                #operands are in source order, receiver first
+                m_name = int_methods[op]
+                operand = 'Int:' + m_name
+                entries = self.pop_many(self.arity(operand) + 1)
+                key = ('int', op) + tuple(e.number for e in entries)
+                number = self.lookup(key)
+                start = entries[0].start
+                if any(e.start is None for e in entries):
+                    start = None
+                self.push_value(block, i, start, number, op, operand,
+                                replaced, deleted, inserted)
+            elif op == 'new':
+                self.stack.append(Entry(self.fresh(), None))
+            elif op in ('pop', 'jump_if', 'jump_ifnot', 'jump_table'):
+                self.pop()
+            elif op in int_jumps:
+                self.pop_many(2)
+            elif op == 'is_instance':
+                self.pop()
+                self.stack.append(Entry(self.fresh(), None))
+            elif op in ('enter', 'alloc', 'jump', 'return', None):
+                #None is a directive, which generates no code
+                pass
+            else:
+                #an instruction we do not model; forget everything
+                self.stack = [Entry(self.fresh(), None) for e in self.stack]
+                self.table = {}
+                self.kill_fields()
+
+        #apply the rewrites
+        code = []
+        for i, line in enumerate(block):
+            if i in deleted:
+                continue
+            code.append(replaced.get(i, line))
+            if i in inserted:
+                code.extend(inserted[i])
+        return code
+
+    def push_value(self, block, i, start, number, op, operand,
+                   replaced, deleted, inserted):
+        holders = self.holders.get(number)
+        if start is not None and i > start:
+            if holders:
+                #a variable already holds this value
+                holder = sorted(holders)[0]
+            elif number in self.sites:
+                #the value was computed before but nobody kept it
+                first, typ, cost = self.sites[number]
+                if cost < worth_spilling:
+                    holder = None
+                else:
+                    holder = self.temp_var()
+                    self.method['locals'][holder] = typ
+                    inserted[first] = ['    store %s' % holder,
+                                       '    load %s' % holder]
+                    self.holders[number] = {holder}
+                    del self.sites[number]
+            else:
+                holder = None
+            if holder is not None:
+                #replace the whole computation with a load of the holder
+                deleted.update(range(start, i))
+                #temporaries written by the removed code no longer hold
+                #the values they were given there
+                for j in range(start, i):
+                    dead_op, dead_var = split_line(block[j])[1:]
+                    if dead_op in ('store', 'store_int'):
+                        self.forget(dead_var)
+                    if j in inserted:
+                        self.forget(split_line(inserted.pop(j)[0])[2])
+                #values first computed by the removed code are not there
+                for key, site in list(self.sites.items()):
+                    if start <= site[0] < i:
+                        del self.sites[key]
+                replaced[i] = '    load %s' % holder
+                self.stack.append(Entry(number, i))
+                return
+            if number not in self.sites:
+                ops = [split_line(line)[1] for line in block[start:i + 1]]
+                cost = sum(4 if run_op in calls else 1
+                           for run_op in ops if run_op is not None)
+                self.sites[number] = (i, self.value_type(op, operand), cost)
+        self.stack.append(Entry(number, start))
+
+
+#number the values of every method in every class
+def number_values(classes, types, temp_var):
+    for class_ in classes:
+        numbering = ValueNumbering(class_['name'], types, temp_var)
+        for method in class_['methods']:
+            numbering.number_method(method)
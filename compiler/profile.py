@@ -0,0 +1,86 @@
+import json
+
+#a call site is hot if it makes at least this share of all profiled calls
+hot_share = 0.01
+
+#a hot call site may inline a callee this many times the inlining budget
+hot_budget_factor = 4
+
+
+#the line of source a node starts on, which the code generated for
+#it is said to come from; returns None for nodes the compiler made up
+def source_line(tree):
+    meta = tree.meta
+    return None if meta.empty else meta.line
+
+
+#the source span of a node, which names the code generated for it
+#in profiles; returns None for nodes the compiler made up
+def site(tree):
+    meta = tree.meta
+    if meta.empty:
+        return None
+    return '%d:%d-%d:%d' % (meta.line, meta.column,
+                            meta.end_line, meta.end_column)
+
+
+#counts from a VM execution profile (tiny_vm -P), by source span
+#the VM keys its counts by class, method and instruction offset, and
+#gives the span the compiler recorded for each profiled instruction,
+#so a profile still applies when the code it was taken from changes
+class Profile:
+    def __init__(self, data):
+        #times each method was entered, by (class name, method name)
+        self.methods = {}
+        #[times true, times false] for each branch on a condition
+        self.branches = {}
+        #times each alternative was chosen, for each dispatch
+        self.dispatches = {}
+        #calls made at each call site
+        self.calls = {}
+        for c_name, methods in data.items():
+            for m_name, record in methods.items():
+                key = c_name, m_name
+                self.methods[key] = self.methods.get(key, 0) + record['calls']
+                for entry in record['sites'].values():
+                    self.add(entry['site'], entry)
+        self.total_calls = sum(self.calls.values())
+
+    def add(self, span, entry):
+        #inlined copies of code share spans, so their counts are summed
+        counts = entry['counts']
+        if 'keys' in entry:
+            #a typeswitch or jump_table, whose last count is for no match
+            alts = self.dispatches.setdefault(span, {})
+            for key, count in zip(entry['keys'] + [None], counts):
+                alts[key] = alts.get(key, 0) + count
+        elif len(counts) == 2:
+            #taken and not taken; a span ending in + names a branch
+            #taken when its condition is true, and others when it is false
+            if span.endswith('+'):
+                span = span[:-1]
+            else:
+                counts = counts[::-1]
+            old = self.branches.get(span, [0, 0])
+            self.branches[span] = [old[0] + counts[0], old[1] + counts[1]]
+        else:
+            self.calls[span] = self.calls.get(span, 0) + counts[0]
+
+    def condition(self, tree):
+        #how often a condition was true and how often false, if known
+        return self.branches.get(site(tree))
+
+    def alternatives(self, tree):
+        #how often a dispatch chose each class or value, if known
+        return self.dispatches.get(site(tree))
+
+    def hot_call(self, span):
+        #whether a call site makes a large share of all calls
+        count = self.calls.get(span, 0)
+        return count > 0 and count >= hot_share * self.total_calls
+
+
+#read a profile written by the VM
+def load_profile(path):
+    with open(path, 'r') as f:
+        return Profile(json.load(f))
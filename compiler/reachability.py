@@ -0,0 +1,146 @@
+from compiler.allocator import split_line
+
+#instructions that call a method, whose operand is class:method
+calls = ('call', 'call_direct', 'tailcall', 'tailcall_direct')
+
+#instructions that call exactly the method their operand names
+direct_calls = ('call_direct', 'tailcall_direct')
+
+#instructions whose operand names a class before any colon
+class_refs = ('load_field', 'store_field', 'new', 'is_instance') + calls
+
+#the body left in place of a method the program never calls
+#it keeps the method's vtable slot, and stops the VM if it is ever run
+stub_code = ['    enter', '    halt']
+
+
+#whole-program reachability over the generated code
+#starting from the main constructor, follows every call that may run,
+#resolving virtual calls to every override in a class the program uses
+class Reachability:
+    def __init__(self, classes, types):
+        #method tables of builtin and user-defined classes
+        self.types = types
+        #maps each user-defined class name to its class object
+        self.classes = {class_['name']: class_ for class_ in classes}
+        #maps each user-defined class to its methods, by name
+        self.methods = {
+            class_['name']: {m['name']: m for m in class_['methods']}
+            for class_ in classes
+        }
+        #user-defined classes the reachable code refers to
+        self.live_classes = set()
+        #(class name, method name) of every method that may run
+        self.live_methods = set()
+        #virtual calls seen so far, as (static type, method name)
+        #a class that becomes live later may add an override to any of them
+        self.slots = set()
+        #methods found reachable whose code has not been scanned yet
+        self.worklist = []
+
+    def super(self, c_name):
+        #the main class has no entry in the method tables
+        if c_name in self.classes:
+            return self.classes[c_name]['super']
+        return self.types[c_name]['super']
+
+    def is_subclass(self, c_name, typ):
+        while c_name != typ:
+            if self.super(c_name) == c_name:
+                return False
+            c_name = self.super(c_name)
+        return True
+
+    def own(self, c_name, m_name):
+        #whether a user-defined class defines its own version of a method
+        return m_name in self.methods.get(c_name, {})
+
+    def defining_class(self, typ, m_name):
+        #walk up the hierarchy to the class whose method is inherited
+        while typ in self.methods and not self.own(typ, m_name):
+            typ = self.super(typ)
+        return typ
+
+    def reach_method(self, c_name, m_name):
+        if not self.own(c_name, m_name):
+            #builtin methods have no code here to scan
+            return
+        key = c_name, m_name
+        if key not in self.live_methods:
+            self.live_methods.add(key)
+            self.worklist.append(key)
+
+    def reach_class(self, c_name):
+        #a class needs its superclasses to be loaded
+        while c_name in self.classes and c_name not in self.live_classes:
+            self.live_classes.add(c_name)
+            #any slot called so far may dispatch to this class's override
+            for typ, m_name in self.slots:
+                if self.is_subclass(c_name, typ):
+                    self.reach_method(c_name, m_name)
+            #builtin methods (such as Obj:print, which calls string) call
+            #overrides of other builtin methods without any visible call
+            for m_name in self.methods[c_name]:
+                if m_name == '$constructor':
+                    continue
+                if self.builtin_slot(c_name, m_name):
+                    self.reach_method(c_name, m_name)
+            c_name = self.super(c_name)
+
+    def builtin_slot(self, c_name, m_name):
+        #check whether a builtin superclass already has the method
+        while c_name in self.classes:
+            c_name = self.super(c_name)
+        return m_name in self.types[c_name]['methods']
+
+    def reach_call(self, op, typ, m_name):
+        #the method the static type has, whether its own or inherited
+        self.reach_method(self.defining_class(typ, m_name), m_name)
+        if op in direct_calls:
+            return
+        #a virtual call may also run any override in a live subclass
+        self.slots.add((typ, m_name))
+        for c_name in self.live_classes:
+            if c_name != typ and self.is_subclass(c_name, typ):
+                self.reach_method(c_name, m_name)
+
+    def scan(self, c_name, m_name):
+        method = self.methods[c_name][m_name]
+        for line in method['code']:
+            label, op, operand = split_line(line)
+            if op in class_refs:
+                typ, _, member = operand.partition(':')
+                #$ is an alias for the class the code belongs to
+                typ = c_name if typ == '$' else typ
+                self.reach_class(typ)
+                if op in calls:
+                    self.reach_call(op, typ, member)
+            elif op == 'typeswitch':
+                for typ in operand.split(','):
+                    self.reach_class(c_name if typ == '$' else typ)
+
+    def run(self, main_name):
+        self.reach_class(main_name)
+        self.reach_method(main_name, '$constructor')
+        while self.worklist:
+            self.scan(*self.worklist.pop())
+
+
+#drop the code of every method the program can never run,
+#and every class its code never refers to
+#a dropped method keeps a stub, so every vtable slot keeps its number
+#returns the classes still to be emitted
+def eliminate_dead_code(classes, types, main_name):
+    reachability = Reachability(classes, types)
+    reachability.run(main_name)
+    live = []
+    for class_ in classes:
+        c_name = class_['name']
+        if c_name not in reachability.live_classes:
+            continue
+        for method in class_['methods']:
+            if (c_name, method['name']) not in reachability.live_methods:
+                method['locals'] = {}
+                method['code'] = list(stub_code)
+        live.append(class_)
+    return live
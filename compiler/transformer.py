@@ -30,6 +30,11 @@ assign_ops = (
 #desugars binary operators into method calls
 @lark.v_args(tree=True)
 class OpTransformer(lark.Transformer):
+    def __init__(self):
+        super().__init__()
+        #number of for loops seen, used to name their hidden variables
+        self.for_loops = 0
+
     #"!=" is translated into "==" followed by a negation
     def notequals(self, tree):
         #create and return method call subtree
@@ -74,6 +79,71 @@ class OpTransformer(lark.Transformer):
             return Tree('ret_exp', [ret_val], tree.meta)
         return tree
 
+    def for_lp(self, tree):
+        #desugar a for loop into a while loop over a hidden counter:
+        #   __FOR_COUNTn = start; __FOR_ENDn = end;
+        #   while __FOR_COUNTn < __FOR_ENDn {
+        #       name = __FOR_COUNTn; ...; __FOR_COUNTn = __FOR_COUNTn + step;
+        #   }
+        #the body cannot change how often the loop runs by assigning to name
+        name, start, end, step, block = tree.children
+        meta = tree.meta
+        #the step defaults to 1 and must be a nonzero constant
+        if step is None:
+            step = 1
+        elif isinstance(step, Tree):
+            step = -int(step.children[0])
+        else:
+            step = int(step)
+        if step == 0:
+            raise CompileError('Step of a for loop cannot be 0', meta)
+
+        count = '__FOR_COUNT%d' % self.for_loops
+        statements = [Tree('assign', [count, None, start], meta)]
+        #an end that is not a literal is evaluated once, before the loop
+        if end.data == 'lit_number':
+            limit = str(end.children[0])
+        else:
+            limit = '__FOR_END%d' % self.for_loops
+            statements.append(Tree('assign', [limit, None, end], meta))
+        self.for_loops += 1
+        #the bounds are type checked as Int
+        for statement in statements:
+            statement.bound = True
+
+        def limit_exp():
+            if limit.isdigit():
+                return Tree('lit_number', [limit], meta)
+            return Tree('var', [limit], meta)
+        #a negative step counts down to the end
+        compare = 'LESS' if step > 0 else 'MORE'
+        condition = Tree('condition', [
+            Tree('m_call', [
+                Tree('var', [count], meta),
+                compare,
+                Tree('args', [limit_exp()])
+            ], meta)
+        ], meta)
+        increment = Tree('assign', [
+            count,
+            None,
+            Tree('m_call', [
+                Tree('var', [count], meta),
+                'PLUS' if step > 0 else 'MINUS',
+                Tree('args', [Tree('lit_number', [str(abs(step))], meta)])
+            ], meta)
+        ], meta)
+        body = Tree('block', [
+            Tree('assign', [name, None, Tree('var', [count], meta)], meta),
+            *block.children,
+            increment
+        ], meta)
+        loop = Tree('while_lp', [condition, body], meta)
+        #the generator uses this to count with a single instruction
+        loop.counter = (count, limit, step)
+        statements.append(loop)
+        return Tree('block', statements, meta)
+
     def LONG_STRING(self, token):
         #sanitize triple quoted string
         return '"' + token[3:-3].replace('\n', '\\n') + '"'
@@ -125,6 +125,10 @@ class TypeChecker(lark.visitors.Visitor_Recursive):
         if not is_subclass(imp_type, given_type, self.types):
             e = '%r is not a subclass of %r' % (imp_type, given_type)
             raise CompileError(e, tree.meta)
+        #the bounds of a for loop must be Ints
+        if getattr(tree, 'bound', False) and imp_type != 'Int':
+            e = 'Bounds of a for loop must be Int, not %r' % imp_type
+            raise CompileError(e, tree.meta)
 
         #get the current type of the variable if it exists, blank otherwise
         old_type = self.variables.get(name, '')
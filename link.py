@@ -0,0 +1,308 @@
+"""Offline linker for the tiny virtual machine.
+
+Does ahead of time what the VM loader does at startup: loads
+a program's classes from their object files, lays out their
+code, builds the global constant pool, the class table with
+its vtables, and the tables of tail calls, typeswitches, jump
+tables and for loops, and resolves every operand that refers
+to them.  The result is a program image, which the VM loads
+with one read (tiny_vm -I image) and no lookups by name.
+
+The image has the layout of a .qbc file (see qbc.py): header,
+string table, body, with its own magic number.  Its body is,
+in this order:
+
+    main class (index in the class table)
+    verified (1 if every class was verified, else 0), and the
+        frame bound: most frame stack words a call can use
+    constants: index of the first, count, (kind, value) pairs
+    builtin classes: count, names (they come first in the
+        class table, in the order the VM loads them)
+    classes: count, then for each its name, superclass index,
+        n_fields, n_methods and a vtable entry per method:
+        a code offset, INHERITED or MISSING
+    code: offset of the first word, count, code words
+    direct calls: count, (code offset, class, slot)
+    tail calls: count, (slot, args, locals, class or -1)
+    typeswitches: count, each a count and classes
+    jump tables: count, each a count and values
+    for loops: count, (counter, end, const, step)
+    methods: count, (class, method, start, end) to profile
+    sites: count, (code offset, site) pairs
+    lines: count, (code offset, line) pairs where the line of
+        source changes; line 0 (unknown) ends each method
+
+Classes, constants and code are placed exactly where the
+loader would place them if it loaded the same classes, so a
+program behaves (and profiles) the same either way.
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import Dict, List
+
+import qbc
+import verify
+
+# "QIMG" read as a little-endian word
+MAGIC = 0x474d4951
+VERSION = 3
+
+# Vtable entries that are not code offsets
+INHERITED = -1
+MISSING = -2
+
+# Must match vm_loader_init and vm_loader.h
+BUILTINS = ["Obj", "String", "Bool", "Int", "Nothing"]
+INITIAL_CONSTANTS = ["No main program loaded!\n",
+                     "$nothing", "$true", "$false"]
+NAMED_LITERALS = {-1: "$nothing", -2: "$false", -3: "$true"}
+CODE_START = 16
+# A native method's frame: saved pc and fp, and its result
+# (the initial vm_frame_bound in vm_state.c)
+NATIVE_FRAME = 3
+
+
+class LinkError(Exception):
+    pass
+
+
+def read_module(library: str, class_name: str) -> dict:
+    """The object module of a class, from its .qbc file unless
+    the JSON file is newer (as vm_load_class chooses)
+    """
+    json_path = os.path.join(library, f"{class_name}.json")
+    qbc_path = os.path.join(library, f"{class_name}.qbc")
+    if os.path.exists(qbc_path) and (
+            not os.path.exists(json_path)
+            or os.path.getmtime(json_path) <= os.path.getmtime(qbc_path)):
+        return qbc.read(qbc_path)
+    try:
+        with open(json_path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise LinkError(f"No object file for class {class_name} in {library}")
+
+
+class Linker:
+    """Loads classes in the order the VM loader would,
+    recording where everything goes
+    """
+    def __init__(self, library: str, ops: List[verify.Operation]):
+        self.library = library
+        self.ops = ops
+        self.constants: List[tuple] = []
+        self.constant_index: Dict[str, int] = {
+            name: i + 1 for i, name in enumerate(INITIAL_CONSTANTS)}
+        self.first_constant = len(INITIAL_CONSTANTS) + 1
+        # class name -> index in the class table
+        self.class_index: Dict[str, int] = {
+            name: i for i, name in enumerate(BUILTINS)}
+        self.classes: List[dict] = []
+        self.code: List[int] = []
+        self.direct_calls: List[tuple] = []
+        self.tail_calls: List[tuple] = []
+        self.typeswitches: List[List[int]] = []
+        self.jump_tables: List[List[int]] = []
+        self.for_loops: List[tuple] = []
+        self.methods: List[tuple] = []
+        self.sites: List[tuple] = []
+        self.lines: List[tuple] = []
+        self.verified = True
+        self.frame_bound = NATIVE_FRAME
+
+    def address(self) -> int:
+        return CODE_START + len(self.code)
+
+    def constant(self, kind: str, literal: str) -> int:
+        # Literals share one pool, looked up by their text
+        if literal not in self.constant_index:
+            self.constant_index[literal] = (self.first_constant
+                                            + len(self.constants))
+            self.constants.append((kind, literal))
+        return self.constant_index[literal]
+
+    def ensure_loaded(self, class_name: str) -> int:
+        if class_name not in self.class_index:
+            self.load(class_name)
+        return self.class_index[class_name]
+
+    def load(self, class_name: str):
+        """The steps of link_module in vm_loader.c, in its order"""
+        module = read_module(self.library, class_name)
+        const_map = [self.constant(c["kind"], c["value"])
+                     for c in module["constants"]]
+        super_index = self.ensure_loaded(module["super"])
+        entry = {"name": module["class_name"], "super": super_index,
+                 "n_fields": module["n_fields"],
+                 "n_methods": module["n_methods"],
+                 "vtable": [INHERITED] * module["n_inherited"]
+                 + [MISSING] * (module["n_methods"] - module["n_inherited"])}
+        self.class_index[entry["name"]] = len(BUILTINS) + len(self.classes)
+        self.classes.append(entry)
+        self.note_verified(module)
+        class_map = [self.ensure_loaded(name) for name in module["imports"]]
+        direct_map = [(class_map[call["class"]], call["slot"])
+                      for call in module["direct_calls"]]
+        tail_call_base = len(self.tail_calls)
+        for call in module["tail_calls"]:
+            target = class_map[call["class"]] if "class" in call else -1
+            self.tail_calls.append((call["slot"], call["args"],
+                                    call["locals"], target))
+        typeswitch_base = len(self.typeswitches)
+        for classes in module["typeswitches"]:
+            self.typeswitches.append([class_map[i] for i in classes])
+        jump_table_base = len(self.jump_tables)
+        self.jump_tables.extend(module["jump_tables"])
+        for_loop_base = len(self.for_loops)
+        for loop in module["for_loops"]:
+            self.for_loops.append((loop["counter"], loop["end"],
+                                   int(loop["const"]), loop["step"]))
+        bases = {"vm_op_tailcall": tail_call_base,
+                 "vm_op_tailcall_direct": tail_call_base,
+                 "vm_op_typeswitch": typeswitch_base,
+                 "vm_op_jump_table": jump_table_base,
+                 "vm_op_for_next": for_loop_base}
+        for method in module["code"]:
+            start = self.address()
+            self.translate(method["code"], const_map, class_map,
+                           direct_map, bases)
+            entry["vtable"][method["slot"]] = start
+            self.methods.append((entry["name"], method["name"],
+                                 start, self.address()))
+            for offset, site in method.get("sites", {}).items():
+                self.sites.append((start + int(offset), site))
+            lines = method.get("lines", [])
+            self.lines.extend((start + offset, line) for offset, line in lines)
+            if lines:
+                self.lines.append((self.address(), 0))
+
+    def note_verified(self, module: dict):
+        # As note_verified in vm_loader.c
+        if not module.get("verified"):
+            self.verified = False
+            return
+        for method in module["code"]:
+            self.frame_bound = max(self.frame_bound,
+                                   2 + method["max_stack"])
+
+    def translate(self, words: List[int], const_map: List[int],
+                  class_map: List[int], direct_map: List[tuple],
+                  bases: Dict[str, int]):
+        """As translate_method_code, but operands stay numbers:
+        classes are indexes in the class table, and a direct
+        call's address is left for the VM to patch in
+        """
+        pc = 0
+        while pc < len(words):
+            op = self.ops[words[pc]]
+            self.code.append(words[pc])
+            # A superinstruction's operands are those of its parts
+            for part in op.parts or [op]:
+                if part.n_operands:
+                    pc += 1
+                    self.operand(part.function, words[pc], const_map,
+                                 class_map, direct_map, bases)
+            pc += 1
+
+    def operand(self, function: str, operand: int, const_map: List[int],
+                class_map: List[int], direct_map: List[tuple],
+                bases: Dict[str, int]):
+        """Translate the operand of an operation (its VM
+        function) and add it to the code
+        """
+        if function == "vm_op_const":
+            if operand in NAMED_LITERALS:
+                operand = self.constant_index[NAMED_LITERALS[operand]]
+            else:
+                operand = const_map[operand]
+        elif function in ("vm_op_new", "vm_op_is_instance"):
+            operand = class_map[operand]
+        elif function == "vm_op_call_direct":
+            clazz, slot = direct_map[operand]
+            self.direct_calls.append((self.address(), clazz, slot))
+        elif function in bases:
+            operand += bases[function]
+        self.code.append(operand)
+
+    def image(self, main_class: str) -> bytes:
+        strings = qbc.StringTable()
+        body: List[int] = [self.class_index[main_class],
+                           int(self.verified), self.frame_bound]
+
+        def entries(items: list):
+            body.append(len(items))
+            for item in items:
+                body.extend(item)
+
+        def tables(items: List[List[int]]):
+            body.append(len(items))
+            for table in items:
+                body.append(len(table))
+                body.extend(table)
+
+        body += [self.first_constant, len(self.constants)]
+        for kind, literal in self.constants:
+            body += [ord(kind[0]), strings.add(literal)]
+        body.append(len(BUILTINS))
+        body.extend(strings.add(name) for name in BUILTINS)
+        body.append(len(self.classes))
+        for entry in self.classes:
+            body += [strings.add(entry["name"]), entry["super"],
+                     entry["n_fields"], entry["n_methods"]]
+            body.extend(entry["vtable"])
+        body += [CODE_START, len(self.code)]
+        body.extend(self.code)
+        entries(self.direct_calls)
+        entries(self.tail_calls)
+        tables(self.typeswitches)
+        tables(self.jump_tables)
+        entries(self.for_loops)
+        entries([(strings.add(class_name), strings.add(name), start, end)
+                 for class_name, name, start, end in self.methods])
+        entries([(offset, strings.add(site)) for offset, site in self.sites])
+        entries(self.lines)
+        return qbc.pack(MAGIC, VERSION, strings, body)
+
+
+def link(classes: List[str], library: str,
+         ops: List[verify.Operation]) -> bytes:
+    """The image of a program whose classes are loaded in the
+    given order, as tiny_vm loads the classes named on its
+    command line; the last is the main class
+    """
+    linker = Linker(library, ops)
+    for class_name in classes:
+        linker.ensure_loaded(class_name)
+    return linker.image(classes[-1])
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Link a program into an image for tiny_vm -I")
+    parser.add_argument("classes", nargs="+",
+                        help="classes to load, in order; the last is main")
+    parser.add_argument("-L", "--library", default="OBJ",
+                        help="directory of object files (default OBJ)")
+    parser.add_argument("-o", "--output",
+                        help="image file (default <main class>.img)")
+    parser.add_argument("--opdefs", default="opdefs.txt")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    output = args.output or f"{args.classes[-1]}.img"
+    try:
+        image = link(args.classes, args.library, verify.operations(args.opdefs))
+    except (LinkError, qbc.FormatError) as e:
+        print(f"link: {e}", file=sys.stderr)
+        sys.exit(1)
+    with open(output, "wb") as f:
+        f.write(image)
+
+
+if __name__ == "__main__":
+    main()
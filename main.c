@@ -5,6 +5,7 @@
 #include <unistd.h>
 #include "vm_state.h"
 #include "vm_loader.h"
+#include "vm_profile.h"
 #include "logger.h"
 
 #define PATHBUFSIZE 1000
@@ -21,8 +22,19 @@ int main(int argc, char *argv[]) {
     char load_path[PATHBUFSIZE];
     int ok = 1;
     char *load_library = "./OBJ";
-    while ((opt = getopt(argc, argv, ":DL:")) != -1) {
+    char *profile_path = NULL;
+    char *image_path = NULL;
+    while ((opt = getopt(argc, argv, ":DI:L:P:")) != -1) {
         switch (opt) {
+            case 'I':
+                image_path = optarg;
+                fprintf(stderr, "Load program image '%s'\n", optarg);
+                break;
+            case 'P':
+                profile_path = optarg;
+                fprintf(stderr, "Profile will be written to '%s'\n", optarg);
+                vm_profiling = 1;
+                break;
             case 'L':
                 load_library = optarg;
                 fprintf(stderr, "Look in '%s' for object modules\n", optarg);
@@ -43,7 +55,12 @@ int main(int argc, char *argv[]) {
         }
     }
     log_debug("Finished options, load library is %s\n", load_library);
-    if (ok && optind < argc) {
+    if (ok && image_path) {
+        // A linked image holds every class; nothing else is loaded
+        vm_loader_init(load_library);
+        main_class = vm_load_image(image_path);
+        ok = main_class != NULL;
+    } else if (ok && optind < argc) {
         log_debug("There is at least one non-option argument\n");
         vm_loader_init(load_library);
         for (; ok && optind < argc; ++optind) {
@@ -57,6 +74,9 @@ int main(int argc, char *argv[]) {
         log_info("Executing %s\n", main_class);
         vm_run();
         log_info("Ran");
+        if (profile_path) {
+            vm_profile_write(profile_path);
+        }
     } else {
         fprintf(stderr, "Errors, will not run\n");
     }
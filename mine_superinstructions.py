@@ -0,0 +1,116 @@
+"""Find candidate superinstructions for opdefs.txt.
+
+Counts the sequences of operations that occur in a corpus of
+object files (.json or .qbc).  A superinstruction does such a
+sequence with one dispatch instead of one for each operation.
+A sequence counts only if it runs straight through: no jump
+lands inside it, and each operation but the last goes on to
+the next (see Operation.fusable in verify.py).  Operations
+already done by a superinstruction count as themselves, so the
+corpus may have been assembled with or without them.
+
+Candidates are listed by the dispatches they would save, as
+lines to add to opdefs.txt, e.g.
+
+    python3 mine_superinstructions.py OBJ/*.json examples/OBJ/*.json
+"""
+
+import sys
+import argparse
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import qbc
+import verify
+
+
+def method_operations(method: dict,
+                      ops: List[verify.Operation]) -> List[List[str]]:
+    """The runs of operations of a method that no jump enters
+    in the middle and that end where control may go elsewhere
+    """
+    code = method["code"]
+    instrs: List[Tuple[int, verify.Operation]] = []
+    targets = set()
+    pc = 0
+    while pc < len(code):
+        op = ops[code[pc]]
+        steps = op.steps(pc, code)
+        following = pc + op.size()
+        last = steps[-1][1]
+        if last.flow in ("jump", "branch"):
+            targets.add(following + steps[-1][2])
+        instrs.append((pc, op))
+        pc = following
+    runs: List[List[str]] = [[]]
+    for pc, op in instrs:
+        if pc in targets:
+            runs.append([])
+        for part in op.parts or [op]:
+            runs[-1].append(part.name)
+            if not part.fusable():
+                runs.append([])
+    return [run for run in runs if len(run) > 1]
+
+
+def count_sequences(runs: List[List[str]], longest: int,
+                    counts: Counter):
+    """Count every sequence of two to longest operations
+    within each run
+    """
+    for run in runs:
+        for start in range(len(run) - 1):
+            for end in range(start + 2,
+                             min(start + longest, len(run)) + 1):
+                counts[tuple(run[start:end])] += 1
+
+
+def candidates(counts: Counter, n: int) -> List[Tuple[int, tuple]]:
+    """The n sequences that would save the most dispatches,
+    as (dispatches saved, sequence)
+    """
+    saved = [(count * (len(sequence) - 1), sequence)
+             for sequence, count in counts.items()]
+    saved.sort(key=lambda entry: (-entry[0], entry[1]))
+    return saved[:n]
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Count operation sequences in object files, "
+                    "as candidate superinstructions")
+    parser.add_argument("objects", nargs="+", help="Class.json or Class.qbc")
+    parser.add_argument("--opdefs", default="opdefs.txt")
+    parser.add_argument("-l", "--longest", type=int, default=4,
+                        help="longest sequence to count (default 4)")
+    parser.add_argument("-n", "--top", type=int, default=20,
+                        help="how many candidates to list (default 20)")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    ops = verify.operations(args.opdefs)
+    counts: Counter = Counter()
+    for path in args.objects:
+        try:
+            module = verify.read_object(Path(path))
+        except (OSError, ValueError, qbc.FormatError) as e:
+            print(f"{path}: {e}", file=sys.stderr)
+            continue
+        # A built-in class (OBJ/Int.json) has native methods only
+        for method in module.get("code", []):
+            count_sequences(method_operations(method, ops),
+                            args.longest, counts)
+    defined: Dict[tuple, str] = {tuple(part.name for part in op.parts): op.name
+                                 for op in ops if op.parts}
+    for saved, sequence in candidates(counts, args.top):
+        name = defined.get(sequence, "_".join(sequence))
+        note = "  (defined)" if sequence in defined else ""
+        line = f"{name} = {' '.join(sequence)}"
+        print(f"{line:48}# {counts[sequence]} times, saves {saved}{note}")
+
+
+if __name__ == "__main__":
+    main()
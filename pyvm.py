@@ -0,0 +1,1410 @@
+"""The tiny virtual machine, in Python.
+
+Runs assembled object files (.json or .qbc) without bin/tiny_vm,
+for places that cannot build it, and in-process for tests:
+
+    python3 pyvm.py -L OBJ Main
+
+Classes are loaded as the VM loader loads them: the built-in
+classes first, from their object files in the library (OBJ/Int.json
+and the others), with Python functions for their native methods,
+then each class named, and the classes each needs.  Values are
+Python values: an Int is an int (boxed or not, which makes box and
+unbox nothing), a String a str, a Bool a bool and nothing is None.
+An instance of any other class is an Instance.  The frame stack is
+one list, laid out as the VM lays it out (see Calling conventions
+in docs/notes.md), so that roll and tail calls work on it as the
+VM's operations do.
+
+There are two interpreters.  ClosureInterpreter compiles each
+method, the first time it is called, into a list with a Python
+closure for each of its instructions, its operand already decoded
+into what it stands for (a constant, a class, a table entry, the
+index of the instruction a jump goes to); running a method is
+calling closures, each returning the index of the next.  A superinstruction is one
+closure doing its operations in turn.  SwitchInterpreter decodes
+code words as the VM does, one operation at a time, and is the
+baseline bench_pyvm.py compares it with.
+"""
+
+import sys
+import argparse
+from bisect import bisect_right
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import qbc
+import verify
+
+# Must match vm_loader_init, as in link.py
+BUILTINS = ["Obj", "String", "Bool", "Int", "Nothing"]
+# Operands of const that stand for the named literals
+NAMED_LITERALS = {-1: None, -2: False, -3: True}
+# Words of frame stack, as in vm_state.h
+FRAME_CAPACITY = 1024
+# What a call pushes after the receiver: saved pc and fp,
+# which a Python call keeps for us
+FRAME = (None, None)
+
+# An Int is 32 bits, and wraps around as in C
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+
+def wrap(n: int) -> int:
+    return (n - INT_MIN) % 2 ** 32 + INT_MIN
+
+
+def c_div(a: int, b: int) -> int:
+    # C division truncates toward zero
+    if a >= 0 and b > 0:
+        return a // b
+    if b == 0:
+        raise VMError("Division by zero")
+    q = abs(a) // abs(b)
+    return wrap(q if (a < 0) == (b < 0) else -q)
+
+
+def c_mod(a: int, b: int) -> int:
+    # and the remainder has the sign of the dividend
+    if a >= 0 and b > 0:
+        return a % b
+    return wrap(a - b * c_div(a, b))
+
+
+class VMError(Exception):
+    """A runtime error of the program being run, with the line
+    of source it happened on, if known
+    """
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.line: Optional[int] = None
+        self.method: Optional["Method"] = None
+
+
+class Halt(Exception):
+    """The program ran halt"""
+    pass
+
+
+# ----------------
+#  Classes, methods and objects
+#
+
+class Instance:
+    """An object of a class other than the built-in ones;
+    each class has its own subclass of this
+    """
+    __slots__ = ("fields",)
+
+    def __init__(self, n_fields: int):
+        self.fields = [None] * n_fields
+
+
+class QClass:
+    """A loaded class"""
+    def __init__(self, name: str, super_class: Optional["QClass"],
+                 n_fields: int, n_methods: int, pytype: type):
+        self.name = name
+        self.super = super_class
+        self.n_fields = n_fields
+        # Method of each slot, inherited or its own
+        self.vtable: List[Optional[Method]] = [None] * n_methods
+        # Python type of the class's values
+        self.pytype = pytype
+        # Classes of which this one is a subclass (itself included)
+        self.ancestors = {self} | (super_class.ancestors if super_class
+                                   else set())
+
+    def __repr__(self):
+        return self.name
+
+
+class Module:
+    """The tables of a class's object file, with their
+    entries decoded into what they refer to
+    """
+    def __init__(self):
+        self.constants: list = []
+        self.classes: List[QClass] = []
+        # (class, slot) of each direct call
+        self.direct_calls: List[tuple] = []
+        # (slot, args, locals, (class, slot) or None) of each
+        # tail call; args and locals are of the calling method
+        self.tail_calls: List[tuple] = []
+        self.typeswitches: List[List[QClass]] = []
+        self.jump_tables: List[List[int]] = []
+        # (counter, end, const, step) of each for loop
+        self.for_loops: List[tuple] = []
+
+    def constant(self, operand: int):
+        if operand in NAMED_LITERALS:
+            return NAMED_LITERALS[operand]
+        return self.constants[operand]
+
+
+class Method:
+    """A method of a class, as object code or as a native
+    function taking the interpreter, the receiver and the
+    arguments
+    """
+    def __init__(self, qclass: QClass, name: str, n_args: int,
+                 module: Optional[Module] = None, words: List[int] = (),
+                 lines: List[List[int]] = (),
+                 native: Optional[Callable] = None):
+        self.qclass = qclass
+        self.name = name
+        self.n_args = n_args
+        self.module = module
+        self.words = list(words)
+        # (offset, line) where the line of source changes
+        self.offsets = [offset for offset, _ in lines]
+        self.lines = [line for _, line in lines]
+        self.native = native
+
+    def line_at(self, offset: int) -> Optional[int]:
+        """Line of source of the instruction at an offset"""
+        i = bisect_right(self.offsets, offset)
+        return self.lines[i - 1] or None if i else None
+
+    def __repr__(self):
+        return f"{self.qclass.name}:{self.name}"
+
+
+def check(value, qclass: QClass, classes: Dict[type, QClass]):
+    # As assert_is_type
+    value_class = classes.get(type(value))
+    if value_class is None:
+        raise VMError(f"Type check failure: {value!r} is Not on object!")
+    if qclass not in value_class.ancestors:
+        raise VMError(f"Type check failure:{value_class.name} "
+                      f"is not subclass of {qclass.name}")
+
+
+# ----------------
+#  Native methods of the built-in classes (see builtins.c),
+#  by class and method name.  A method of a built-in class
+#  with none here is inherited, as Int inherits print.
+#
+
+def obj_constructor(vm, this):
+    return this
+
+
+def obj_string(vm, this):
+    return f"<Object at 0x{id(this):x}>"
+
+
+def obj_print(vm, this):
+    # this.string().print(), which may be an override
+    return vm.send(vm.send(this, 1), 2)
+
+
+def obj_println(vm, this):
+    return vm.send(vm.send(this, 1), 3)
+
+
+def obj_equals(vm, this, other):
+    return this is other
+
+
+def string_constructor(vm, this):
+    return ""
+
+
+def string_string(vm, this):
+    return this
+
+
+def string_print(vm, this):
+    vm.write(this)
+
+
+def string_println(vm, this):
+    vm.write(this + "\n")
+
+
+def string_compare(compare: Callable) -> Callable:
+    def method(vm, this, other):
+        if type(other) is not str:
+            vm.check(other, "String")
+        return compare(this, other)
+    return method
+
+
+def bool_constructor(vm, this):
+    return False
+
+
+def bool_string(vm, this):
+    return "true" if this else "false"
+
+
+def bool_negate(vm, this):
+    return not this
+
+
+def int_constructor(vm, this):
+    return 0
+
+
+def int_string(vm, this):
+    return str(this)
+
+
+def int_operation(operation: Callable) -> Callable:
+    def method(vm, this, other):
+        if type(other) is not int:
+            vm.check(other, "Int")
+        return operation(this, other)
+    return method
+
+
+def nothing_constructor(vm, this):
+    return None
+
+
+def nothing_string(vm, this):
+    return "nothing"
+
+
+NATIVES: Dict[str, Dict[str, Callable]] = {
+    "Obj": {"$constructor": obj_constructor,
+            "string": obj_string,
+            "print": obj_print,
+            "println": obj_println,
+            "EQUALS": obj_equals},
+    "String": {"$constructor": string_constructor,
+               "string": string_string,
+               "print": string_print,
+               "println": string_println,
+               "EQUALS": string_compare(lambda a, b: a == b),
+               "LESS": string_compare(lambda a, b: a < b),
+               "ATMOST": string_compare(lambda a, b: a <= b),
+               "MORE": string_compare(lambda a, b: a > b),
+               "ATLEAST": string_compare(lambda a, b: a >= b),
+               "PLUS": string_compare(lambda a, b: a + b)},
+    "Bool": {"$constructor": bool_constructor,
+             "string": bool_string,
+             "NEGATE": bool_negate},
+    "Int": {"$constructor": int_constructor,
+            "string": int_string,
+            "EQUALS": int_operation(lambda a, b: a == b),
+            "LESS": int_operation(lambda a, b: a < b),
+            "ATMOST": int_operation(lambda a, b: a <= b),
+            "MORE": int_operation(lambda a, b: a > b),
+            "ATLEAST": int_operation(lambda a, b: a >= b),
+            "PLUS": int_operation(lambda a, b: wrap(a + b)),
+            "TIMES": int_operation(lambda a, b: wrap(a * b)),
+            "MINUS": int_operation(lambda a, b: wrap(a - b)),
+            "DIVIDE": int_operation(c_div),
+            "MOD": int_operation(c_mod),
+            "NEG": lambda vm, this: wrap(-this)},
+    "Nothing": {"$constructor": nothing_constructor,
+                "string": nothing_string}
+}
+
+# Python type of the values of each built-in class, and the
+# value new makes (before its constructor runs)
+BUILTIN_TYPES = {"String": (str, ""), "Bool": (bool, False),
+                 "Int": (int, 0), "Nothing": (type(None), None)}
+
+
+# ----------------
+#  Loading, as the VM loader does it
+#
+
+class Program:
+    """The classes of a program, loaded from the object files
+    of a library directory
+    """
+    def __init__(self, library: str, ops: List[verify.Operation]):
+        self.library = Path(library)
+        self.ops = ops
+        self.classes: Dict[str, QClass] = {}
+        # Class of each Python type of value
+        self.class_of: Dict[type, QClass] = {}
+        self.methods: List[Method] = []
+        for name in BUILTINS:
+            self.load_builtin(name)
+
+    def object_file(self, class_name: str) -> Path:
+        # The binary form, unless the JSON one was written after
+        # it, as vm_load_class chooses
+        json_path = self.library / f"{class_name}.json"
+        qbc_path = self.library / f"{class_name}.qbc"
+        if qbc_path.exists() and (not json_path.exists()
+                                  or json_path.stat().st_mtime
+                                  <= qbc_path.stat().st_mtime):
+            return qbc_path
+        return json_path
+
+    def read(self, class_name: str) -> dict:
+        path = self.object_file(class_name)
+        try:
+            return verify.read_object(path)
+        except (OSError, ValueError, qbc.FormatError) as e:
+            raise VMError(f"Cannot load class {class_name} from {path}: {e}")
+
+    def add_class(self, qclass: QClass):
+        self.classes[qclass.name] = qclass
+        self.class_of[qclass.pytype] = qclass
+
+    def load_builtin(self, name: str):
+        module = self.read(name)
+        methods = module["methods"]
+        arities = module.get("arities") or [0] * len(methods)
+        super_class = self.classes.get(module["super"]) if name != "Obj" \
+            else None
+        pytype = BUILTIN_TYPES[name][0] if name in BUILTIN_TYPES \
+            else type(name, (Instance,), {"__slots__": ()})
+        qclass = QClass(name, super_class, 0, len(methods), pytype)
+        for slot, (m_name, arity) in enumerate(zip(methods, arities)):
+            native = NATIVES[name].get(m_name)
+            if native:
+                method = Method(qclass, m_name, arity or 0, native=native)
+                self.methods.append(method)
+                qclass.vtable[slot] = method
+            elif super_class and slot < len(super_class.vtable):
+                qclass.vtable[slot] = super_class.vtable[slot]
+        self.add_class(qclass)
+
+    def ensure_loaded(self, class_name: str) -> QClass:
+        if class_name not in self.classes:
+            self.link(self.read(class_name))
+        return self.classes[class_name]
+
+    def link(self, m: dict):
+        """As link_module: make the class and its methods,
+        loading the classes they refer to
+        """
+        super_class = self.ensure_loaded(m["super"])
+        name = m["class_name"]
+        pytype = type(name, (Instance,), {"__slots__": ()})
+        qclass = QClass(name, super_class, m["n_fields"], m["n_methods"],
+                        pytype)
+        qclass.vtable[:m["n_inherited"]] = \
+            super_class.vtable[:m["n_inherited"]]
+        # Registered first, as its methods may refer to it
+        self.add_class(qclass)
+
+        module = Module()
+        for constant in m["constants"]:
+            value = constant["value"]
+            module.constants.append(wrap(int(value))
+                                    if constant["kind"] == "i" else value)
+        module.classes = [self.ensure_loaded(import_name)
+                          for import_name in m["imports"]]
+        module.direct_calls = [(module.classes[call["class"]], call["slot"])
+                               for call in m.get("direct_calls", [])]
+        for call in m.get("tail_calls", []):
+            target = None
+            if call.get("class", -1) >= 0:
+                target = (module.classes[call["class"]], call["slot"])
+            module.tail_calls.append((call["slot"], call["args"],
+                                      call["locals"], target))
+        module.typeswitches = [[module.classes[i] for i in table]
+                               for table in m.get("typeswitches", [])]
+        module.jump_tables = m.get("jump_tables", [])
+        module.for_loops = [(loop["counter"], loop["end"],
+                             bool(loop["const"]), loop["step"])
+                            for loop in m.get("for_loops", [])]
+        arities = m.get("arities", [])
+        for method in m["code"]:
+            slot = method["slot"]
+            n_args = method.get("args")
+            if n_args is None:
+                n_args = arities[slot] if slot < len(arities) else 0
+            qmethod = Method(qclass, method["name"], n_args or 0, module,
+                             method["code"], method.get("lines", []))
+            self.methods.append(qmethod)
+            qclass.vtable[slot] = qmethod
+
+    def direct_target(self, module: Module, index: int) -> Method:
+        # Every class is loaded by the time code runs, so every
+        # vtable is complete, as for resolve_direct_calls
+        qclass, slot = module.direct_calls[index]
+        return qclass.vtable[slot]
+
+
+# ----------------
+#  Running a program
+#
+
+class Interpreter:
+    """What both interpreters share: the frame stack, the
+    native methods and calls made from them, and the run
+    of the main class
+    """
+    def __init__(self, program: Program, out=sys.stdout):
+        self.program = program
+        self.stack: list = []
+        self.write = out.write
+        self.classes = program.class_of
+        # Python type -> function running the method of each
+        # slot of its class, given the frame pointer
+        self.vtables: Dict[type, List[Callable]] = {}
+        # Function running each method
+        self.runs = runs = {method: (self.native_runner(method)
+                                     if method.native else self.runner(method))
+                            for method in program.methods}
+        for pytype, qclass in self.classes.items():
+            self.vtables[pytype] = [runs[method] if method
+                                    else self.missing(qclass, slot)
+                                    for slot, method in
+                                    enumerate(qclass.vtable)]
+
+    def runner(self, method: Method) -> Callable:
+        """A function that runs a method of object code
+        in the frame it is given
+        """
+        raise NotImplementedError
+
+    def native_runner(self, method: Method) -> Callable:
+        # Reads the receiver and arguments from the frame and
+        # returns like vm_op_return
+        stack = self.stack
+        native = method.native
+        n_args = method.n_args
+
+        def run(fp):
+            result = native(self, stack[fp], *stack[fp - n_args:fp])
+            del stack[fp - n_args:]
+            stack.append(result)
+        return run
+
+    @staticmethod
+    def missing(qclass: QClass, slot: int) -> Callable:
+        def run(fp):
+            raise VMError(f"No method in slot {slot} of {qclass.name}")
+        return run
+
+    def send(self, receiver, slot: int, *args):
+        """Call a method from a native method"""
+        stack = self.stack
+        stack.extend(args)
+        stack.append(receiver)
+        fp = len(stack) - 1
+        stack.extend(FRAME)
+        self.vtables[type(receiver)][slot](fp)
+        return stack.pop()
+
+    def check(self, value, class_name: str):
+        check(value, self.program.classes[class_name], self.classes)
+
+    def new(self, qclass: QClass):
+        if qclass.name in BUILTIN_TYPES:
+            return BUILTIN_TYPES[qclass.name][1]
+        return qclass.pytype(qclass.n_fields)
+
+    def run(self, main_class: str):
+        """As the code vm_loader_set_main puts at the start
+        of the code block: new, call the constructor, pop, halt
+        """
+        main = self.program.classes[main_class]
+        recursion_limit = sys.getrecursionlimit()
+        # Python frames for the VM's frame stack at its deepest
+        sys.setrecursionlimit(max(recursion_limit, 4 * FRAME_CAPACITY))
+        try:
+            self.send(self.new(main), 0)
+        except Halt:
+            pass
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+    @staticmethod
+    def located(error: Exception, method: Method, offset: int) -> VMError:
+        """A runtime error, with where it happened if it is
+        the first to say
+        """
+        if not isinstance(error, VMError):
+            error = VMError(f"{type(error).__name__}: {error}")
+        if error.method is None:
+            error.method = method
+            error.line = method.line_at(offset)
+        return error
+
+    def overflow(self) -> VMError:
+        return VMError(f"Frame stack overflow (capacity {FRAME_CAPACITY} "
+                       f"words)")
+
+
+def tail_frame(stack: list, fp: int, n_args: int, n_locals: int) -> int:
+    """As tail_frame in vm_ops.c: the call's arguments and
+    receiver replace the current frame, and its own frame
+    pointer is returned
+    """
+    moved = stack[fp + 3 + n_locals:]
+    del stack[fp - n_args:]
+    stack.extend(moved)
+    new_fp = len(stack) - 1
+    stack.extend(FRAME)
+    return new_fp
+
+
+# ----------------
+#  Closure compilation.  Each closure takes the frame pointer
+#  and returns the index of the instruction to run next, or
+#  RETURN when its method has returned, or TAIL when it has set
+#  up a tail call for the run loop to go on with.
+#
+
+RETURN = -1
+TAIL = -2
+
+
+class Routine:
+    """A method as the closure interpreter runs it"""
+    __slots__ = ("method", "code", "starts", "run")
+
+    def __init__(self, method: Method):
+        self.method = method
+        # A closure for each instruction
+        self.code: List[Callable] = []
+        # Offset of each instruction in the method's code
+        self.starts: List[int] = []
+        self.run: Optional[Callable] = None
+
+
+class Site:
+    """Where an operation is, in the method being compiled,
+    and the operand it has.  An operation of a superinstruction
+    is at the word before its operand (see verify.Operation.steps),
+    so its jumps are relative to the word after at + 1 either way.
+    """
+    def __init__(self, routine: Routine, index: Dict[int, int],
+                 at: int, operand: int, following: int):
+        self.routine = routine
+        self.module = routine.method.module
+        self.words = routine.method.words
+        self.index = index
+        self.at = at
+        self.operand = operand
+        # Index of the instruction after this one
+        self.following = following
+
+    def jump(self) -> int:
+        return self.index[self.at + 2 + self.operand]
+
+    def after(self, alternative: int) -> int:
+        # Where the jump for an alternative goes: a typeswitch,
+        # jump_table or for_next is followed by a jump for each
+        jump_at = self.at + 2 + 2 * alternative
+        return self.index[jump_at + 2 + self.words[jump_at + 1]]
+
+    def past(self, n_jumps: int) -> int:
+        # The instruction after the jumps that follow this one
+        return self.index[self.at + 2 + 2 * n_jumps]
+
+
+class ClosureInterpreter(Interpreter):
+    """Runs each method as a list of closures, compiled the
+    first time it is called
+    """
+    def __init__(self, program: Program, out=sys.stdout):
+        self.routines: Dict[Method, Routine] = {
+            method: Routine(method) for method in program.methods}
+        # Tail call in progress: the routine called, its frame
+        self.tail = [None, 0]
+        super().__init__(program, out)
+        # Python type -> routine of each slot of its class
+        self.vroutines: Dict[type, List[Optional[Routine]]] = {
+            pytype: [self.routines.get(method) for method in qclass.vtable]
+            for pytype, qclass in self.classes.items()}
+        # Methods of object code are compiled when first run
+        for routine in self.routines.values():
+            if routine.method.native:
+                routine.code = None
+                routine.run = self.runs[routine.method]
+
+    def runner(self, method: Method) -> Callable:
+        routine = self.routines[method]
+        tail = self.tail
+        located = self.located
+        compile = self.compile
+
+        def run(fp):
+            current = routine
+            code = routine.code or compile(routine)
+            pc = 0
+            try:
+                while True:
+                    while pc >= 0:
+                        pc = code[pc](fp)
+                    if pc == RETURN:
+                        return
+                    called, fp = tail
+                    if called.code is None:
+                        # A native method returns as this one would
+                        called.run(fp)
+                        return
+                    code = called.code or compile(called)
+                    current = called
+                    pc = 0
+            except Halt:
+                raise
+            except Exception as e:
+                raise located(e, current.method,
+                              current.starts[pc] if pc >= 0 else 0)
+        routine.run = run
+        return run
+
+    def compile(self, routine: Routine) -> List[Callable]:
+        method = routine.method
+        ops = self.program.ops
+        words = method.words
+        pc = 0
+        while pc < len(words):
+            routine.starts.append(pc)
+            pc += ops[words[pc]].size()
+        index = {at: i for i, at in enumerate(routine.starts)}
+        # Code may jump to the end of the method, from where it
+        # can never be reached (the compiler's jump past the
+        # alternatives of a switch that all return)
+        index[len(words)] = len(routine.starts)
+        for i, at in enumerate(routine.starts):
+            op = ops[words[at]]
+            sites = [(part, Site(routine, index, step_at, operand, i + 1))
+                     for step_at, part, operand in op.steps(at, words)]
+            closures = [self.operation(part, site) for part, site in sites]
+            routine.code.append(closures[0] if len(closures) == 1
+                                else self.superinstruction(sites, closures))
+        routine.starts.append(len(words))
+        routine.code.append(self.past_end(method))
+        return routine.code
+
+    @staticmethod
+    def past_end(method: Method) -> Callable:
+        def past_end(fp):
+            raise VMError(f"Ran past the end of {method}")
+        return past_end
+
+    def superinstruction(self, sites: List[tuple],
+                         closures: List[Callable]) -> Callable:
+        # Only the last operation decides where to go next
+        stack = self.stack
+        push = stack.append
+        first, site = sites[0]
+        if len(closures) == 2 and first.name in ("load", "load_int"):
+            # The push is done here, saving a call
+            slot = site.operand
+            last = closures[1]
+
+            def load_then(fp):
+                push(stack[fp + slot])
+                return last(fp)
+            return load_then
+        if len(closures) == 2 and first.name in ("const", "push_int"):
+            value = site.module.constant(site.operand) \
+                if first.name == "const" else site.operand
+            last = closures[1]
+
+            def push_then(fp):
+                push(value)
+                return last(fp)
+            return push_then
+        if len(closures) == 2:
+            first, last = closures
+
+            def run(fp):
+                first(fp)
+                return last(fp)
+            return run
+        if len(closures) == 3:
+            first, second, last = closures
+
+            def run(fp):
+                first(fp)
+                second(fp)
+                return last(fp)
+            return run
+        leading, last = closures[:-1], closures[-1]
+
+        def run(fp):
+            for closure in leading:
+                closure(fp)
+            return last(fp)
+        return run
+
+    def operation(self, op: verify.Operation, site: Site) -> Callable:
+        build = getattr(self, "op_" + op.name, None)
+        if build is None:
+            raise VMError(f"{op.name} is not in object code")
+        return build(site)
+
+    # Operations, each making the closure for one of its uses
+
+    def op_halt(self, site: Site) -> Callable:
+        def halt(fp):
+            raise Halt()
+        return halt
+
+    def op_const(self, site: Site) -> Callable:
+        push = self.stack.append
+        value = site.module.constant(site.operand)
+        following = site.following
+
+        def const(fp):
+            push(value)
+            return following
+        return const
+
+    def op_call(self, site: Site) -> Callable:
+        stack = self.stack
+        vtables = self.vtables
+        slot = site.operand
+        following = site.following
+        overflow = self.overflow
+
+        def call(fp):
+            receiver = stack[-1]
+            new_fp = len(stack) - 1
+            if new_fp >= FRAME_CAPACITY:
+                raise overflow()
+            stack.extend(FRAME)
+            vtables[type(receiver)][slot](new_fp)
+            return following
+        return call
+
+    def op_call_direct(self, site: Site) -> Callable:
+        stack = self.stack
+        target = self.program.direct_target(site.module, site.operand)
+        run = self.runs[target]
+        following = site.following
+        overflow = self.overflow
+
+        def call_direct(fp):
+            new_fp = len(stack) - 1
+            if new_fp >= FRAME_CAPACITY:
+                raise overflow()
+            stack.extend(FRAME)
+            run(new_fp)
+            return following
+        return call_direct
+
+    def op_tailcall(self, site: Site) -> Callable:
+        stack = self.stack
+        tail = self.tail
+        slot, n_args, n_locals, _ = site.module.tail_calls[site.operand]
+        vroutines = self.vroutines
+        vtables = self.vtables
+        overflow = self.overflow
+
+        def tailcall(fp):
+            new_fp = tail_frame(stack, fp, n_args, n_locals)
+            if new_fp >= FRAME_CAPACITY:
+                raise overflow()
+            routine = vroutines[type(stack[new_fp])][slot]
+            if routine is None:
+                # No method: as the vtable says
+                vtables[type(stack[new_fp])][slot](new_fp)
+            tail[0] = routine
+            tail[1] = new_fp
+            return TAIL
+        return tailcall
+
+    def op_tailcall_direct(self, site: Site) -> Callable:
+        stack = self.stack
+        tail = self.tail
+        slot, n_args, n_locals, (qclass, _) = \
+            site.module.tail_calls[site.operand]
+        routine = self.routines[qclass.vtable[slot]]
+        overflow = self.overflow
+
+        def tailcall_direct(fp):
+            new_fp = tail_frame(stack, fp, n_args, n_locals)
+            if new_fp >= FRAME_CAPACITY:
+                raise overflow()
+            tail[0] = routine
+            tail[1] = new_fp
+            return TAIL
+        return tailcall_direct
+
+    def op_enter(self, site: Site) -> Callable:
+        following = site.following
+
+        def enter(fp):
+            return following
+        return enter
+
+    def op_return(self, site: Site) -> Callable:
+        stack = self.stack
+        n_args = site.operand
+
+        def return_(fp):
+            value = stack[-1]
+            del stack[fp - n_args:]
+            stack.append(value)
+            return RETURN
+        return return_
+
+    def op_new(self, site: Site) -> Callable:
+        push = self.stack.append
+        qclass = site.module.classes[site.operand]
+        following = site.following
+        if qclass.name in BUILTIN_TYPES:
+            value = BUILTIN_TYPES[qclass.name][1]
+
+            def new_builtin(fp):
+                push(value)
+                return following
+            return new_builtin
+        pytype = qclass.pytype
+        n_fields = qclass.n_fields
+
+        def new(fp):
+            push(pytype(n_fields))
+            return following
+        return new
+
+    def op_pop(self, site: Site) -> Callable:
+        pop = self.stack.pop
+        following = site.following
+
+        def pop_(fp):
+            pop()
+            return following
+        return pop_
+
+    def op_alloc(self, site: Site) -> Callable:
+        extend = self.stack.extend
+        nothings = (None,) * site.operand
+        following = site.following
+
+        def alloc(fp):
+            extend(nothings)
+            return following
+        return alloc
+
+    def op_load(self, site: Site) -> Callable:
+        stack = self.stack
+        push = stack.append
+        slot = site.operand
+        following = site.following
+
+        def load(fp):
+            push(stack[fp + slot])
+            return following
+        return load
+
+    def op_store(self, site: Site) -> Callable:
+        stack = self.stack
+        pop = stack.pop
+        slot = site.operand
+        following = site.following
+
+        def store(fp):
+            stack[fp + slot] = pop()
+            return following
+        return store
+
+    def op_load_field(self, site: Site) -> Callable:
+        stack = self.stack
+        field = site.operand
+        following = site.following
+
+        def load_field(fp):
+            stack[-1] = stack[-1].fields[field]
+            return following
+        return load_field
+
+    def op_store_field(self, site: Site) -> Callable:
+        pop = self.stack.pop
+        field = site.operand
+        following = site.following
+
+        def store_field(fp):
+            obj = pop()
+            obj.fields[field] = pop()
+            return following
+        return store_field
+
+    def op_roll(self, site: Site) -> Callable:
+        stack = self.stack
+        push = stack.append
+        depth = -1 - site.operand
+        following = site.following
+
+        def roll(fp):
+            push(stack.pop(depth))
+            return following
+        return roll
+
+    def op_jump(self, site: Site) -> Callable:
+        target = site.jump()
+
+        def jump(fp):
+            return target
+        return jump
+
+    def branch(self, site: Site, when: bool) -> Callable:
+        pop = self.stack.pop
+        target = site.jump()
+        following = site.following
+        check = self.check
+
+        def jump_when(fp):
+            condition = pop()
+            if condition is when:
+                return target
+            if condition is not (not when):
+                check(condition, "Bool")
+            return following
+        return jump_when
+
+    def op_jump_if(self, site: Site) -> Callable:
+        return self.branch(site, True)
+
+    def op_jump_ifnot(self, site: Site) -> Callable:
+        return self.branch(site, False)
+
+    def op_is_instance(self, site: Site) -> Callable:
+        stack = self.stack
+        classes = self.classes
+        qclass = site.module.classes[site.operand]
+        following = site.following
+
+        def is_instance(fp):
+            stack[-1] = qclass in classes[type(stack[-1])].ancestors
+            return following
+        return is_instance
+
+    def op_typeswitch(self, site: Site) -> Callable:
+        pop = self.stack.pop
+        classes = self.classes
+        alternatives = site.module.typeswitches[site.operand]
+        targets = [site.after(alt) for alt in range(len(alternatives) + 1)]
+        # Target for each class met so far
+        chosen: Dict[QClass, int] = {}
+
+        def typeswitch(fp):
+            qclass = classes[type(pop())]
+            target = chosen.get(qclass)
+            if target is None:
+                alt = next((alt for alt, alternative in enumerate(alternatives)
+                            if alternative in qclass.ancestors),
+                           len(alternatives))
+                target = chosen[qclass] = targets[alt]
+            return target
+        return typeswitch
+
+    def op_jump_table(self, site: Site) -> Callable:
+        pop = self.stack.pop
+        values = site.module.jump_tables[site.operand]
+        targets = {value: site.after(alt) for alt, value in enumerate(values)}
+        other = site.after(len(values))
+
+        def jump_table(fp):
+            return targets.get(pop(), other)
+        return jump_table
+
+    def op_for_next(self, site: Site) -> Callable:
+        stack = self.stack
+        counter, end, const, step = site.module.for_loops[site.operand]
+        loop = site.after(0)
+        done = site.past(1)
+        if const and step > 0:
+            def for_next(fp):
+                value = stack[fp + counter] + step
+                stack[fp + counter] = value
+                return loop if value < end else done
+        elif const:
+            def for_next(fp):
+                value = stack[fp + counter] + step
+                stack[fp + counter] = value
+                return loop if value > end else done
+        elif step > 0:
+            def for_next(fp):
+                value = stack[fp + counter] + step
+                stack[fp + counter] = value
+                return loop if value < stack[fp + end] else done
+        else:
+            def for_next(fp):
+                value = stack[fp + counter] + step
+                stack[fp + counter] = value
+                return loop if value > stack[fp + end] else done
+        return for_next
+
+    # Int operations; an unboxed Int is an int like any other,
+    # so the r operations are the i ones and box and unbox do
+    # nothing
+
+    def arithmetic(self, site: Site, operation: Callable) -> Callable:
+        stack = self.stack
+        pop = stack.pop
+        following = site.following
+
+        def arithmetic(fp):
+            right = pop()
+            result = operation(stack[-1], right)
+            if not INT_MIN <= result <= INT_MAX:
+                result = wrap(result)
+            stack[-1] = result
+            return following
+        return arithmetic
+
+    def op_iadd(self, site: Site) -> Callable:
+        stack = self.stack
+        pop = stack.pop
+        following = site.following
+
+        def iadd(fp):
+            right = pop()
+            result = stack[-1] + right
+            stack[-1] = result if INT_MIN <= result <= INT_MAX \
+                else wrap(result)
+            return following
+        return iadd
+
+    def op_isub(self, site: Site) -> Callable:
+        stack = self.stack
+        pop = stack.pop
+        following = site.following
+
+        def isub(fp):
+            right = pop()
+            result = stack[-1] - right
+            stack[-1] = result if INT_MIN <= result <= INT_MAX \
+                else wrap(result)
+            return following
+        return isub
+
+    def op_imul(self, site: Site) -> Callable:
+        return self.arithmetic(site, lambda a, b: a * b)
+
+    def op_idiv(self, site: Site) -> Callable:
+        return self.arithmetic(site, c_div)
+
+    def op_imod(self, site: Site) -> Callable:
+        return self.arithmetic(site, c_mod)
+
+    def op_ineg(self, site: Site) -> Callable:
+        stack = self.stack
+        following = site.following
+
+        def ineg(fp):
+            stack[-1] = wrap(-stack[-1])
+            return following
+        return ineg
+
+    def comparison(self, site: Site, compare: Callable) -> Callable:
+        stack = self.stack
+        pop = stack.pop
+        following = site.following
+
+        def comparison(fp):
+            right = pop()
+            stack[-1] = compare(stack[-1], right)
+            return following
+        return comparison
+
+    def op_ilt(self, site: Site) -> Callable:
+        return self.comparison(site, int.__lt__)
+
+    def op_ile(self, site: Site) -> Callable:
+        return self.comparison(site, int.__le__)
+
+    def op_igt(self, site: Site) -> Callable:
+        return self.comparison(site, int.__gt__)
+
+    def op_ige(self, site: Site) -> Callable:
+        return self.comparison(site, int.__ge__)
+
+    def op_ieq(self, site: Site) -> Callable:
+        return self.comparison(site, int.__eq__)
+
+    def compare_branch(self, site: Site, compare: Callable) -> Callable:
+        pop = self.stack.pop
+        target = site.jump()
+        following = site.following
+
+        def compare_branch(fp):
+            right = pop()
+            return target if compare(pop(), right) else following
+        return compare_branch
+
+    def op_jump_ilt(self, site: Site) -> Callable:
+        return self.compare_branch(site, int.__lt__)
+
+    def op_jump_ile(self, site: Site) -> Callable:
+        return self.compare_branch(site, int.__le__)
+
+    def op_jump_igt(self, site: Site) -> Callable:
+        return self.compare_branch(site, int.__gt__)
+
+    def op_jump_ige(self, site: Site) -> Callable:
+        return self.compare_branch(site, int.__ge__)
+
+    def op_jump_ieq(self, site: Site) -> Callable:
+        return self.compare_branch(site, int.__eq__)
+
+    def op_jump_ine(self, site: Site) -> Callable:
+        return self.compare_branch(site, int.__ne__)
+
+    op_load_int = op_load
+    op_store_int = op_store
+
+    def op_push_int(self, site: Site) -> Callable:
+        push = self.stack.append
+        value = site.operand
+        following = site.following
+
+        def push_int(fp):
+            push(value)
+            return following
+        return push_int
+
+    def op_box(self, site: Site) -> Callable:
+        return self.op_enter(site)
+
+    op_unbox = op_box
+    op_radd = op_iadd
+    op_rsub = op_isub
+    op_rmul = op_imul
+    op_rdiv = op_idiv
+    op_rmod = op_imod
+    op_rneg = op_ineg
+
+
+# ----------------
+#  The baseline: decode each word as it is run
+#
+
+class SwitchInterpreter(Interpreter):
+    """Runs object code one operation at a time, fetching
+    and decoding its opcode and operand words as it goes,
+    as vm_run does
+    """
+    def __init__(self, program: Program, out=sys.stdout):
+        # The operations each opcode does
+        self.parts = [[part.name for part in op.parts] or [op.name]
+                      for op in program.ops]
+        super().__init__(program, out)
+
+    def runner(self, method: Method) -> Callable:
+        def run(fp):
+            self.execute(method, fp)
+        return run
+
+    def execute(self, method: Method, fp: int):
+        stack = self.stack
+        push, pop = stack.append, stack.pop
+        classes = self.classes
+        vtables = self.vtables
+        parts = self.parts
+        words = method.words
+        module = method.module
+        pc = 0
+        start = 0
+        try:
+            while True:
+                start = pc
+                operations = parts[words[pc]]
+                pc += 1
+                for name in operations:
+                    if name == "load" or name == "load_int":
+                        push(stack[fp + words[pc]])
+                        pc += 1
+                    elif name == "store" or name == "store_int":
+                        stack[fp + words[pc]] = pop()
+                        pc += 1
+                    elif name == "const":
+                        push(module.constant(words[pc]))
+                        pc += 1
+                    elif name == "push_int":
+                        push(words[pc])
+                        pc += 1
+                    elif name == "enter" or name == "box" or name == "unbox":
+                        pass
+                    elif name == "alloc":
+                        stack.extend([None] * words[pc])
+                        pc += 1
+                    elif name == "pop":
+                        pop()
+                    elif name == "roll":
+                        push(stack.pop(-1 - words[pc]))
+                        pc += 1
+                    elif name == "load_field":
+                        stack[-1] = stack[-1].fields[words[pc]]
+                        pc += 1
+                    elif name == "store_field":
+                        obj = pop()
+                        obj.fields[words[pc]] = pop()
+                        pc += 1
+                    elif name == "new":
+                        push(self.new(module.classes[words[pc]]))
+                        pc += 1
+                    elif name in ("call", "call_direct"):
+                        operand = words[pc]
+                        pc += 1
+                        new_fp = len(stack) - 1
+                        if new_fp >= FRAME_CAPACITY:
+                            raise self.overflow()
+                        if name == "call":
+                            run = vtables[type(stack[-1])][operand]
+                        else:
+                            target = self.program.direct_target(module,
+                                                                operand)
+                            run = self.runs[target]
+                        stack.extend(FRAME)
+                        run(new_fp)
+                    elif name == "return":
+                        value = pop()
+                        del stack[fp - words[pc]:]
+                        push(value)
+                        return
+                    elif name in ("tailcall", "tailcall_direct"):
+                        slot, n_args, n_locals, target = \
+                            module.tail_calls[words[pc]]
+                        fp = tail_frame(stack, fp, n_args, n_locals)
+                        if fp >= FRAME_CAPACITY:
+                            raise self.overflow()
+                        qclass = target[0] if target \
+                            else classes[type(stack[fp])]
+                        method = qclass.vtable[slot]
+                        if method.native:
+                            vtables[qclass.pytype][slot](fp)
+                            return
+                        words = method.words
+                        module = method.module
+                        pc = 0
+                    elif name == "jump":
+                        pc += 1 + words[pc]
+                    elif name in ("jump_if", "jump_ifnot"):
+                        span = words[pc]
+                        pc += 1
+                        condition = pop()
+                        self.check(condition, "Bool")
+                        if condition == (name == "jump_if"):
+                            pc += span
+                    elif name == "is_instance":
+                        qclass = module.classes[words[pc]]
+                        pc += 1
+                        stack[-1] = qclass in classes[type(stack[-1])].ancestors
+                    elif name == "typeswitch":
+                        alternatives = module.typeswitches[words[pc]]
+                        pc += 1
+                        qclass = classes[type(pop())]
+                        alt = 0
+                        while alt < len(alternatives) \
+                                and alternatives[alt] not in qclass.ancestors:
+                            alt += 1
+                        jump = pc + 2 * alt
+                        pc = jump + 2 + words[jump + 1]
+                    elif name == "jump_table":
+                        values = module.jump_tables[words[pc]]
+                        pc += 1
+                        value = pop()
+                        alt = values.index(value) if value in values \
+                            else len(values)
+                        jump = pc + 2 * alt
+                        pc = jump + 2 + words[jump + 1]
+                    elif name == "for_next":
+                        counter, end, const, step = \
+                            module.for_loops[words[pc]]
+                        pc += 1
+                        value = stack[fp + counter] + step
+                        stack[fp + counter] = value
+                        if not const:
+                            end = stack[fp + end]
+                        if value < end if step > 0 else value > end:
+                            pc += 2 + words[pc + 1]
+                        else:
+                            pc += 2
+                    elif name in ("iadd", "radd"):
+                        right = pop()
+                        push(wrap(pop() + right))
+                    elif name in ("isub", "rsub"):
+                        right = pop()
+                        push(wrap(pop() - right))
+                    elif name in ("imul", "rmul"):
+                        right = pop()
+                        push(wrap(pop() * right))
+                    elif name in ("idiv", "rdiv"):
+                        right = pop()
+                        push(c_div(pop(), right))
+                    elif name in ("imod", "rmod"):
+                        right = pop()
+                        push(c_mod(pop(), right))
+                    elif name in ("ineg", "rneg"):
+                        push(wrap(-pop()))
+                    elif name in ("ilt", "ile", "igt", "ige", "ieq"):
+                        right = pop()
+                        push(compare(name[1:], pop(), right))
+                    elif name in ("jump_ilt", "jump_ile", "jump_igt",
+                                  "jump_ige", "jump_ieq", "jump_ine"):
+                        span = words[pc]
+                        pc += 1
+                        right = pop()
+                        if compare(name[6:], pop(), right):
+                            pc += span
+                    elif name == "halt":
+                        raise Halt()
+                    else:
+                        raise VMError(f"{name} is not in object code")
+        except Halt:
+            raise
+        except Exception as e:
+            raise self.located(e, method, start)
+
+
+def compare(relation: str, left: int, right: int) -> bool:
+    if relation == "lt":
+        return left < right
+    elif relation == "le":
+        return left <= right
+    elif relation == "gt":
+        return left > right
+    elif relation == "ge":
+        return left >= right
+    elif relation == "eq":
+        return left == right
+    else:
+        return left != right
+
+
+INTERPRETERS = {"closure": ClosureInterpreter, "switch": SwitchInterpreter}
+
+
+def load(classes: List[str], library: str,
+         ops: List[verify.Operation]) -> Program:
+    """A program whose classes are loaded in the given order,
+    as tiny_vm loads the classes named on its command line;
+    the last is the main class
+    """
+    program = Program(library, ops)
+    for class_name in classes:
+        program.ensure_loaded(class_name)
+    return program
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Run object code with the tiny VM in Python")
+    parser.add_argument("classes", nargs="+",
+                        help="classes to load, in order; the last is main")
+    parser.add_argument("-L", "--library", default="OBJ",
+                        help="directory of object files (default OBJ)")
+    parser.add_argument("--opdefs", default="opdefs.txt")
+    parser.add_argument("--engine", choices=sorted(INTERPRETERS),
+                        default="closure",
+                        help="how to interpret (default closure)")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    try:
+        program = load(args.classes, args.library,
+                       verify.operations(args.opdefs))
+        INTERPRETERS[args.engine](program).run(args.classes[-1])
+    except VMError as e:
+        sys.stdout.flush()
+        print(e, file=sys.stderr)
+        if e.line:
+            print(f"  at line {e.line}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
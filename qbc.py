@@ -0,0 +1,311 @@
+"""Binary object code (.qbc) for the tiny virtual machine.
+
+The same module the assembler writes as JSON, in a compact
+form the VM loader can map into memory and read in place,
+without parsing.  Every number is a 32-bit little-endian word.
+
+    header       8 words: magic, version, file size in bytes,
+                 offset and size in bytes of the string table,
+                 offset of the body and its size in words, 0
+    strings      NUL-terminated UTF-8 strings, padded to a
+                 whole number of words; a string is referred
+                 to by its byte offset in the table
+    body         words, in this order:
+                   class name, superclass name (strings)
+                   n_fields, n_methods, n_inherited
+                   verified (1 if verify.py passed the module)
+                   methods: count, names
+                   arities: count, arguments of each method
+                       (-1 if not known)
+                   fields: count, names
+                   imports: count, class names
+                   constants: count, (kind, value) pairs,
+                       kind is the character 'i' or 's'
+                   direct_calls: count, (class, slot) pairs
+                   tail_calls: count, (slot, args, locals,
+                       class or -1 if not direct)
+                   typeswitches: count, each a count and classes
+                   jump_tables: count, each a count and values
+                   for_loops: count, (counter, end, const, step)
+                   code: count, then for each method its
+                       name, slot, args, locals, max_stack (-1
+                       if not verified), count of code words,
+                       the code words, count of sites,
+                       (offset, site) pairs, count of calls,
+                       (offset, arguments) pairs, count of lines,
+                       and (offset, line) pairs
+
+Reading a .qbc file gives the structure json.load gives
+for the JSON object file of the same module.  Run as a
+program, this module prints a .qbc file for debugging.
+"""
+
+import sys
+import json
+import struct
+import argparse
+from typing import Dict, List, Tuple
+
+# "QBC\0" read as a little-endian word
+MAGIC = 0x00434251
+VERSION = 3
+HEADER_WORDS = 8
+
+
+class FormatError(Exception):
+    """The file is not (this version of) a .qbc file"""
+    pass
+
+
+# ----------------
+#  Writing
+#
+
+class StringTable:
+    """Strings of a module, each stored once"""
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets: Dict[str, int] = {}
+
+    def add(self, text: str) -> int:
+        if text not in self.offsets:
+            self.offsets[text] = len(self.data)
+            self.data += text.encode("utf-8") + b"\0"
+        return self.offsets[text]
+
+    def padded(self) -> bytes:
+        return bytes(self.data) + b"\0" * (-len(self.data) % 4)
+
+
+def encode(module: dict) -> bytes:
+    """The .qbc form of a module, given as the structure
+    ObjectCode.struct builds (or json.load reads)
+    """
+    strings = StringTable()
+    body: List[int] = []
+
+    def names(items: List[str]):
+        body.append(len(items))
+        body.extend(strings.add(item) for item in items)
+
+    body.append(strings.add(module["class_name"]))
+    body.append(strings.add(module["super"]))
+    body += [module["n_fields"], module["n_methods"], module["n_inherited"],
+             int(module.get("verified", False))]
+    names(module["methods"])
+    arities = module.get("arities", [])
+    body.append(len(arities))
+    body.extend(-1 if arity is None else arity for arity in arities)
+    names(module["fields"])
+    names(module["imports"])
+    body.append(len(module["constants"]))
+    for constant in module["constants"]:
+        body += [ord(constant["kind"][0]), strings.add(constant["value"])]
+    body.append(len(module["direct_calls"]))
+    for call in module["direct_calls"]:
+        body += [call["class"], call["slot"]]
+    body.append(len(module["tail_calls"]))
+    for call in module["tail_calls"]:
+        body += [call["slot"], call["args"], call["locals"],
+                 call.get("class", -1)]
+    for tables in (module["typeswitches"], module["jump_tables"]):
+        body.append(len(tables))
+        for table in tables:
+            body.append(len(table))
+            body.extend(table)
+    body.append(len(module["for_loops"]))
+    for loop in module["for_loops"]:
+        body += [loop["counter"], loop["end"], int(loop["const"]),
+                 loop["step"]]
+    body.append(len(module["code"]))
+    for method in module["code"]:
+        body += [strings.add(method["name"]), method["slot"],
+                 method.get("args", 0), method.get("locals", 0),
+                 method.get("max_stack", -1), len(method["code"])]
+        body.extend(method["code"])
+        sites = method.get("sites", {})
+        body.append(len(sites))
+        for offset, site in sites.items():
+            body += [int(offset), strings.add(site)]
+        calls = method.get("calls", {})
+        body.append(len(calls))
+        for offset, n_args in calls.items():
+            body += [int(offset), -1 if n_args is None else n_args]
+        lines = method.get("lines", [])
+        body.append(len(lines))
+        for offset, line in lines:
+            body += [offset, line]
+
+    return pack(MAGIC, VERSION, strings, body)
+
+
+def pack(magic: int, version: int, strings: StringTable,
+         body: List[int]) -> bytes:
+    """A file of the layout above: header, strings, body.
+    (Program images from link.py have the same layout.)
+    """
+    string_data = strings.padded()
+    string_offset = HEADER_WORDS * 4
+    body_offset = string_offset + len(string_data)
+    size = body_offset + len(body) * 4
+    header = [magic, version, size, string_offset, len(strings.data),
+              body_offset, len(body), 0]
+    return (struct.pack(f"<{HEADER_WORDS}i", *header) + string_data
+            + struct.pack(f"<{len(body)}i", *body))
+
+
+# ----------------
+#  Reading
+#
+
+def unpack(data: bytes, expected_magic: int = MAGIC,
+           expected_version: int = VERSION) -> Tuple[bytes, tuple]:
+    """The string table and the body words of a file"""
+    if len(data) < HEADER_WORDS * 4:
+        raise FormatError("File too short for a header")
+    header = struct.unpack_from(f"<{HEADER_WORDS}i", data)
+    magic, version, size, string_offset, string_size, \
+        body_offset, body_words, _ = header
+    if magic != expected_magic:
+        raise FormatError("Wrong magic number for this kind of file")
+    if version != expected_version:
+        raise FormatError(f"Version {version}, expected {expected_version}")
+    if size != len(data) or body_offset + 4 * body_words != size:
+        raise FormatError("File size does not match its header")
+    string_data = data[string_offset:string_offset + string_size]
+    words = struct.unpack_from(f"<{body_words}i", data, body_offset)
+    return string_data, words
+
+
+def decode(data: bytes) -> dict:
+    """The module a .qbc file holds, as json.load would give
+    it from the module's JSON object file
+    """
+    string_data, words = unpack(data)
+    position = 0
+
+    def word() -> int:
+        nonlocal position
+        position += 1
+        return words[position - 1]
+
+    def string() -> str:
+        offset = word()
+        end = string_data.index(b"\0", offset)
+        return string_data[offset:end].decode("utf-8")
+
+    def count_of(read) -> list:
+        return [read() for _ in range(word())]
+
+    def known() -> int:
+        # -1 stands for None
+        value = word()
+        return None if value < 0 else value
+
+    module = {"class_name": string(), "super": string(),
+              "n_fields": word(), "n_methods": word(),
+              "n_inherited": word(), "verified": bool(word())}
+    module["methods"] = count_of(string)
+    module["arities"] = count_of(known)
+    module["fields"] = count_of(string)
+    module["imports"] = count_of(string)
+    module["constants"] = count_of(lambda: {"kind": chr(word()),
+                                            "value": string()})
+    module["direct_calls"] = count_of(lambda: {"class": word(),
+                                               "slot": word()})
+
+    def tail_call() -> dict:
+        call = {"slot": word(), "args": word(), "locals": word()}
+        class_index = word()
+        if class_index >= 0:
+            call["class"] = class_index
+        return call
+
+    module["tail_calls"] = count_of(tail_call)
+    module["typeswitches"] = count_of(lambda: count_of(word))
+    module["jump_tables"] = count_of(lambda: count_of(word))
+    module["for_loops"] = count_of(lambda: {"counter": word(), "end": word(),
+                                            "const": bool(word()),
+                                            "step": word()})
+
+    def method() -> dict:
+        entry = {"name": string(), "slot": word(), "args": word(),
+                 "locals": word()}
+        max_stack = known()
+        entry["code"] = count_of(word)
+        entry["sites"] = dict((str(word()), string())
+                              for _ in range(word()))
+        entry["calls"] = dict((str(word()), known())
+                              for _ in range(word()))
+        entry["lines"] = count_of(lambda: [word(), word()])
+        if max_stack is not None:
+            entry["max_stack"] = max_stack
+        return entry
+
+    module["code"] = count_of(method)
+    return module
+
+
+def read(path: str) -> dict:
+    with open(path, "rb") as source:
+        return decode(source.read())
+
+
+# ----------------
+#  Dumping, for debugging
+#
+
+def opcodes(path: str) -> List[tuple]:
+    """(name, VM function, number of operands) of each
+    opcode, from opdefs.txt
+    """
+    import verify   # Which reads opdefs.txt, and imports this
+    return [(op.name, op.function, op.n_operands)
+            for op in verify.operations(path)]
+
+
+def dump(module: dict, ops: List[tuple], out=sys.stdout):
+    for key in ["class_name", "super", "n_fields", "n_methods",
+                "n_inherited", "verified", "methods", "arities", "fields",
+                "imports"]:
+        print(f"{key}: {module[key]}", file=out)
+    for key in ["constants", "direct_calls", "tail_calls",
+                "typeswitches", "jump_tables", "for_loops"]:
+        print(f"{key}:", file=out)
+        for i, entry in enumerate(module[key]):
+            print(f"    {i}: {json.dumps(entry)}", file=out)
+    for method in module["code"]:
+        print(f"method {method['name']} (slot {method['slot']}, "
+              f"{method['args']} args, {method['locals']} locals, "
+              f"max_stack {method.get('max_stack', '?')}):", file=out)
+        code = method["code"]
+        lines = dict(method.get("lines", []))
+        pc = 0
+        while pc < len(code):
+            if pc in lines:
+                print(f"         .line {lines[pc]}", file=out)
+            site = method["sites"].get(str(pc))
+            if site:
+                print(f"         .site {site}", file=out)
+            name, _, n_ops = ops[code[pc]]
+            operands = " ".join(str(op) for op in code[pc + 1:pc + 1 + n_ops])
+            print(f"    {pc:4}  {name} {operands}".rstrip(), file=out)
+            pc += 1 + n_ops
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a .qbc object file")
+    parser.add_argument("path")
+    parser.add_argument("--opdefs", default="opdefs.txt")
+    parser.add_argument("--json", action="store_true",
+                        help="print the module as its JSON object file")
+    args = parser.parse_args()
+    module = read(args.path)
+    if args.json:
+        print(json.dumps(module, indent=4))
+    else:
+        dump(module, opcodes(args.opdefs))
+
+
+if __name__ == "__main__":
+    main()
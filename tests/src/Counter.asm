@@ -17,7 +17,7 @@
     const 1
     load $
     load_field $:i
-    call Int:plus
+    call Int:PLUS
     load $
     store_field $:i
     const nothing
@@ -29,7 +29,7 @@
     load value
     load $
     load_field $:i
-    call Int:equals
+    call Int:EQUALS
     return 1
 
 .method print
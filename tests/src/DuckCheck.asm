@@ -18,6 +18,7 @@
     const "It should have been a duck!\n"
     call String:print
     pop
+    load $
     return 0
 it_is:
     const "It is a proper duck, as expected!\n"
@@ -29,6 +30,7 @@ it_is:
     const "A box that holds a String is not a String!\n"
     call String:print
     pop
+    load $
     return 0
 not_a_string:
     const "You can tell ducks from strings by their beaks.\n"
@@ -52,4 +54,6 @@ bad_duck:
 done:
     const "Ducks have been checked.\n"
     call String:print
+    pop
+    load $
     return 0
@@ -0,0 +1,27 @@
+# Passes verification.  The constructor keeps at most four
+# words on the stack above its frame header (its local and
+# three constants), and add at most three (its local and
+# the two Ints it adds)
+.class MaxStack:Obj
+.method add
+.args n
+.local sum
+    enter
+    load n
+    load n
+    call Int:PLUS
+    store sum
+    load sum
+    return 1
+
+.method $constructor
+.local x
+    enter
+    const 1
+    const 2
+    const 3
+    pop
+    pop
+    store x
+    const nothing
+    return 0
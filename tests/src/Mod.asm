@@ -33,12 +33,12 @@ whileend_1:
 whileloop_2:
     load y
     load x
-    call Int:plus
+    call Int:PLUS
     store x
 whilecond_2:
     const 0
     load x
-    call Int:less
+    call Int:LESS
     jump_if whileloop_2
 whileend_2:
     load x
@@ -36,12 +36,12 @@ whileloop_3:
     pop
     const 1
     load i
-    call Int:plus
+    call Int:PLUS
     store i
 whilecond_3:
     const 14
     load i
-    call Int:less
+    call Int:LESS
     jump_if whileloop_3
 whileend_3:
     load $
@@ -26,7 +26,7 @@
     const 1
     load $
     load_field $:x
-    call Int:plus
+    call Int:PLUS
     new $
     call $:$constructor
     return 0
@@ -50,7 +50,7 @@
     load increment
     load $
     load_field    $:y
-    call Int:plus
+    call Int:PLUS
     load $
     store_field  $:y
     const nothing
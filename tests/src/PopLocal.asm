@@ -0,0 +1,9 @@
+# Must fail verification: the pop takes the local variable,
+# which is not the method's to pop
+.class PopLocal:Obj
+.method $constructor
+.local x
+    enter
+    pop
+    const nothing
+    return 0
@@ -0,0 +1,7 @@
+# Must fail verification: the return reclaims one argument,
+# in a method that has none
+.class ReturnArity:Obj
+.method $constructor
+    enter
+    const nothing
+    return 1
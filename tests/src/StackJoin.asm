@@ -0,0 +1,11 @@
+# Must fail verification: the two paths to "join" reach it
+# with different stack depths
+.class StackJoin:Obj
+.method $constructor
+    enter
+    const true
+    jump_if join
+    const 1
+join:
+    const nothing
+    return 0
@@ -1,5 +1,11 @@
-"""Simple test script for Ori (tiny vm) asm files.
-(Extend later to work with Quack compilation)
+"""Simple test script for Ori (tiny vm) asm files, for
+the bytecode verifier (action verify), and for Quack
+programs (src/C.qk, action quack), which are compiled
+with each set of COMPILE_OPTIONS, and again with a profile
+(--profile-use) of one of its runs.  Each test case that
+runs is run by tiny_vm from the .qbc files, from the .json
+files alone and as a linked image, and by each engine of
+pyvm.py, and all must give the expected output.
 
 FIXME: There must be better ways to handle file dependencies
 """
@@ -8,6 +14,7 @@ import pathlib
 import shutil
 import filecmp
 import csv
+import json
 
 import logging
 import sys
@@ -21,9 +28,22 @@ log.setLevel(logging.INFO)
 PY = "python3"
 ROOT = ".."
 ASM = f"{ROOT}/assemble.py"
+QUACK = "compile.py"    # Run in ROOT, where its grammar and tables are
+LINK = f"{ROOT}/link.py"
+PYVM = f"{ROOT}/pyvm.py"
+PYVM_ENGINES = ["closure", "switch"]
 VM = f"{ROOT}/bin/tiny_vm"
+VERIFY = f"{ROOT}/verify.py"
 BUILTINS = ["Bool.json", "Int.json", "Nothing.json", "Obj.json", "String.json"]
 ASMREQS = ["asm.conf", "opdefs.txt"]
+# A Quack test case (src/C.qk) is compiled with each of these
+# sets of options, and each must give the expected output
+COMPILE_OPTIONS = [
+    [],
+    ["--ssa"],
+    ["--inline-budget", "0"],
+    ["--unbox-ints", "--roll-calls", "--inline-budget", "60"]
+]
 
 def install_prereqs():
     """Copy pre-requisite files.
@@ -57,28 +77,52 @@ def assemble(class_name: str) -> bool:
     return True
 
 
-def test_class(class_name: str) -> bool:
-    """Assemble, run, and check a single test case
-    for a class C, in src/C.asm, with expected output
-    in expect/C_stdout.txt.  Returns True iff test case
-    has expected outcome.
+def compile_quack(class_name: str, options: list) -> list:
+    """Translate src/C.qk, with main class C, to .asm files
+    (kept in out/) and assemble each to OBJ.  Returns the
+    classes compiled, or [] on failure.
+    """
+    src = pathlib.Path("./src/" + class_name + ".qk").resolve()
+    proc = subprocess.run([PY, QUACK, str(src), "--name", class_name,
+                           "--list"] + options,
+                          cwd=ROOT, text=True, capture_output=True)
+    if proc.returncode != 0 or not proc.stdout.split():
+        log.warning(f"Compiler failed on {src} {' '.join(options)}"
+                    f"\n{proc.stderr}")
+        return []
+    classes = proc.stdout.split()
+    for compiled in classes:
+        asm = pathlib.Path("./out/" + compiled + ".asm")
+        shutil.move(f"{ROOT}/{compiled}.asm", asm)
+        obj = pathlib.Path("./OBJ/" + compiled + ".json")
+        proc = subprocess.run([PY, ASM, asm, obj], text=True)
+        if proc.returncode != 0:
+            log.warning(f"Assembler crashed on {asm}")
+            return []
+    return classes
+
+
+def check_run(class_name: str, command: list, label: str = "") -> bool:
+    """Run a test case with a command, and check that it gives
+    the expected output in expect/C_stdout.txt
     """
     ok = True
     observed_stdout = pathlib.Path("out/" + class_name + "_stdout.txt")
     observed_stderr = pathlib.Path("out/" + class_name + "_stderr.txt")
     expect_stdout = pathlib.Path("expect/" + class_name + "_stdout.txt")
-    if not assemble(class_name):
+    if not expect_stdout.exists():
+        log.warning(f"No expected output {expect_stdout}")
         return False
     try:
         std_out = open(observed_stdout, "w")
         std_err = open(observed_stderr, "w")
-        proc = subprocess.run([VM, class_name], text=True,
+        proc = subprocess.run(command, text=True,
                               stdout=std_out, stderr=std_err)
         proc.check_returncode() # May throw CalledProcessError
-        if filecmp.cmp(observed_stdout, expect_stdout):
-            log.info(f"OK: {class_name} produced expected output")
+        if filecmp.cmp(observed_stdout, expect_stdout, shallow=False):
+            log.info(f"OK: {class_name} produced expected output {label}")
         else:
-            log.info(f"{class_name} output did not match expectation")
+            log.info(f"{class_name} output did not match expectation {label}")
             ok = False
     except subprocess.CalledProcessError:
         log.warning(f"Crashed: {proc.args}")
@@ -86,6 +130,161 @@ def test_class(class_name: str) -> bool:
     return ok
 
 
+def check_runs(class_name: str, label: str = "") -> bool:
+    """Run a test case in OBJ each way it can be run,
+    and check that each gives the expected output
+    """
+    # tiny_vm loads a .qbc in preference to its .json,
+    # so the .json files alone are run from a copy
+    json_dir = pathlib.Path("out/json")
+    shutil.rmtree(json_dir, ignore_errors=True)
+    json_dir.mkdir()
+    for obj in pathlib.Path("OBJ").glob("*.json"):
+        shutil.copyfile(obj, json_dir / obj.name)
+    image = pathlib.Path("out/" + class_name + ".img")
+    runs = [("qbc", [VM, class_name]),
+            ("json", [VM, "-L", json_dir, class_name])]
+    proc = subprocess.run([PY, LINK, class_name, "-L", "OBJ",
+                           "-o", image, "--opdefs", "opdefs.txt"],
+                          text=True)
+    ok = proc.returncode == 0
+    if ok:
+        runs.append(("image", [VM, "-I", image]))
+    else:
+        log.warning(f"Linker failed on {class_name}")
+    for engine in PYVM_ENGINES:
+        runs.append((f"pyvm {engine}",
+                     [PY, PYVM, "-L", "OBJ", "--opdefs", "opdefs.txt",
+                      "--engine", engine, class_name]))
+    for how, command in runs:
+        if not check_run(class_name, command, f"{label} ({how})".lstrip()):
+            ok = False
+    return ok
+
+
+def test_class(class_name: str) -> bool:
+    """Assemble, run, and check a single test case
+    for a class C, in src/C.asm, with expected output
+    in expect/C_stdout.txt.  Returns True iff test case
+    has expected outcome.
+    """
+    if not assemble(class_name):
+        return False
+    return check_runs(class_name)
+
+
+def test_verify(class_name: str) -> bool:
+    """Check what the verifier (verify.py) makes of a test case
+    against expect/C_verify.txt: each error it finds, and the
+    max_stack of each method that passes.  The case is src/C.asm,
+    or src/C.json for object code the assembler would not write
+    (a jump into the middle of an instruction, say).
+    """
+    obj = pathlib.Path("./OBJ/" + class_name + ".json")
+    handmade = pathlib.Path("./src/" + class_name + ".json")
+    if handmade.exists():
+        shutil.copyfile(handmade, obj)
+    else:
+        # Quietly, since the assembler warns of the same errors
+        src = pathlib.Path("./src/" + class_name + ".asm")
+        proc = subprocess.run([PY, ASM, src, obj],
+                              text=True, capture_output=True)
+        if proc.returncode != 0:
+            log.warning(f"Assembler crashed on {src}\n{proc.stderr}")
+            return False
+    proc = subprocess.run([PY, VERIFY, "--opdefs", "opdefs.txt", obj],
+                          text=True, capture_output=True)
+    found = proc.stderr.splitlines()
+    with open(obj) as verified:
+        module = json.load(verified)
+    for method in module["code"]:
+        if "max_stack" in method:
+            found.append(f"{class_name}:{method['name']} "
+                         f"max_stack {method['max_stack']}")
+    observed = pathlib.Path("out/" + class_name + "_verify.txt")
+    expect = pathlib.Path("expect/" + class_name + "_verify.txt")
+    observed.write_text("".join(line + "\n" for line in found))
+    if not expect.exists():
+        log.warning(f"No expected output {expect}")
+        return False
+    if not filecmp.cmp(observed, expect, shallow=False):
+        log.info(f"{class_name} verification did not match expectation")
+        return False
+    log.info(f"OK: {class_name} verified as expected")
+    return True
+
+
+def test_profile(class_name: str) -> bool:
+    """Profile a run of src/C.qk (tiny_vm -P), compile it
+    again with that profile (--profile-use), and check that
+    the result still gives the expected output
+    """
+    profile = pathlib.Path("out/" + class_name + ".prof").resolve()
+    if not (compile_quack(class_name, [])
+            and check_run(class_name, [VM, "-P", profile, class_name],
+                          "(profiling)")):
+        return False
+    options = ["--profile-use", str(profile)]
+    return (compile_quack(class_name, options)
+            and check_runs(class_name, "--profile-use"))
+
+
+def test_methods(class_name: str) -> bool:
+    """Check the classes compiled from src/C.qk without
+    inlining, and their methods, against expect/C_methods.txt.
+    A method the program can never run is left as a stub
+    (enter; halt), and a class it never uses is not compiled.
+    """
+    classes = compile_quack(class_name, ["--inline-budget", "0"])
+    if not classes:
+        return False
+    found = []
+    for compiled in classes:
+        # Method name -> its instructions
+        methods = {}
+        with open("out/" + compiled + ".asm") as asm:
+            for line in asm:
+                line = line.partition("#")[0].strip()
+                if line.startswith(".method") \
+                        and not line.endswith("forward"):
+                    body = methods.setdefault(line.split()[1], [])
+                elif line and not line.startswith("."):
+                    body.append(line)
+        for method, body in methods.items():
+            stub = " stub" if body == ["enter", "halt"] else ""
+            found.append(f"{compiled}:{method}{stub}")
+    observed = pathlib.Path("out/" + class_name + "_methods.txt")
+    expect = pathlib.Path("expect/" + class_name + "_methods.txt")
+    observed.write_text("".join(line + "\n" for line in found))
+    if not filecmp.cmp(observed, expect, shallow=False):
+        log.info(f"{class_name} methods did not match expectation")
+        return False
+    log.info(f"OK: {class_name} compiled the expected methods")
+    return True
+
+
+def test_quack(class_name: str) -> bool:
+    """Compile a test case written in Quack, src/C.qk, with
+    each set of COMPILE_OPTIONS, and run and check each,
+    then once more with a profile of its own run.  If there
+    is an expect/C_methods.txt, check the methods compiled too.
+    """
+    ok = True
+    for options in COMPILE_OPTIONS:
+        label = " ".join(options)
+        if not (compile_quack(class_name, options)
+                and check_runs(class_name, label)):
+            log.warning(f"Failed with options '{label}'")
+            ok = False
+    if not test_profile(class_name):
+        log.warning("Failed with options '--profile-use'")
+        ok = False
+    methods = pathlib.Path("expect/" + class_name + "_methods.txt")
+    if methods.exists() and not test_methods(class_name):
+        ok = False
+    return ok
+
+
 def main():
     """Stub"""
     install_prereqs()
@@ -101,8 +300,15 @@ def main():
             elif action == "run":
                 log.info(f"Class '{class_name} -- assemble and run")
                 ok = test_class(class_name)
+            elif action == "verify":
+                log.info(f"Class '{class_name} -- verify only")
+                ok = test_verify(class_name)
+            elif action == "quack":
+                log.info(f"Class '{class_name} -- compile and run")
+                ok = test_quack(class_name)
             else:
                 log.error(f"Unrecognized action '{action}' for class {class_name}")
+                ok = False
             if not ok:
                 print(f"*** Failed test case: {action} {class_name}", file=sys.stderr)
     # FIXME: Add a check for omitted source files
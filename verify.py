@@ -0,0 +1,358 @@
+"""Bytecode verifier for the tiny virtual machine.
+
+Checks the code of an object module before it is run, using
+the stack effect and flow of each operation from opdefs.txt:
+
+    - every opcode is known and has its operand
+    - every jump lands on an instruction of the same method,
+      and no path runs off the end of a method
+    - the stack depth is the same on every path to an
+      instruction, and no instruction pops more than the
+      method has pushed (its locals are not for popping)
+    - local variable and argument operands are in the frame
+    - return reclaims as many arguments as the method has,
+      and a tail call leaves nothing but its call on the stack
+    - table operands (tail calls, typeswitches, jump tables,
+      for loops) are entries of their tables
+
+A superinstruction is checked as the operations it does.
+
+A module that passes is marked "verified", and each of its
+methods gets "max_stack", the most words it keeps on the
+stack above its frame header (locals included).  The VM skips
+checks that verified code makes redundant, and makes sure
+before each call that the frame stack has room for any
+method's frame.
+
+The assembler verifies each module it assembles.  Run as a
+program, this verifies object files (.json or .qbc) again and
+records the result in them.
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import qbc
+
+# Operations whose operand is a frame slot
+LOCAL_OPERANDS = ["load", "store", "load_int", "store_int"]
+# Words of the frame header: receiver, saved pc, saved fp;
+# locals follow it
+FRAME_HEADER = 3
+
+
+class VerifyError(Exception):
+    pass
+
+
+class Operation:
+    """An operation, as opdefs.txt defines it"""
+    def __init__(self, name: str, function: str, n_operands: int,
+                 stack: str, flow: str):
+        self.name = name
+        self.function = function
+        self.n_operands = n_operands
+        self.pops, self.pushes = stack.split(":")
+        self.flow = flow
+        # The operations a superinstruction does, in order
+        self.parts: List[Operation] = []
+
+    @classmethod
+    def superinstruction(cls, name: str,
+                         parts: List["Operation"]) -> "Operation":
+        """One opcode for a sequence of operations, with their
+        operands in order; it goes where the last one goes
+        """
+        for part in parts[:-1]:
+            if not part.fusable():
+                raise ValueError(f"{name}: {part.name} must come last")
+        op = cls(name, f"vm_super_{name}",
+                 sum(part.n_operands for part in parts),
+                 "0:0", parts[-1].flow)
+        op.parts = parts
+        return op
+
+    def fusable(self) -> bool:
+        """May another operation follow this one in a
+        superinstruction?  Not if it may go anywhere but to
+        the next instruction (a call goes to the method called)
+        """
+        return (not self.parts and self.flow == "next"
+                and "args" not in self.pops + self.pushes)
+
+    def size(self) -> int:
+        return 1 + self.n_operands
+
+    def steps(self, pc: int, code: List[int]) -> List[tuple]:
+        """(pc, operation, operand) of each operation this does,
+        if it starts at pc.  An operation of a superinstruction
+        is at the word before its operand, as far as the VM is
+        concerned (see VM_PROFILE_EVENT), and so for recording
+        sites and calls.
+        """
+        if not self.parts:
+            return [(pc, self, code[pc + 1] if self.n_operands else 0)]
+        steps = []
+        for part in self.parts:
+            operand = code[pc + 1] if part.n_operands else 0
+            steps.append((pc, part, operand))
+            pc += part.n_operands
+        return steps
+
+
+def operations(path: str) -> List[Operation]:
+    """Operations in opcode order, from opdefs.txt"""
+    ops = []
+    by_name: Dict[str, Operation] = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            if "=" in line:
+                # A superinstruction, name = operation operation ...
+                name, _, sequence = line.partition("=")
+                op = Operation.superinstruction(
+                    name.strip(), [by_name[part] for part in sequence.split()])
+            else:
+                name, function, n_ops, stack, flow = line.split(",")
+                op = Operation(name, function, int(n_ops), stack, flow)
+            ops.append(op)
+            by_name[op.name] = op
+    return ops
+
+
+def stack_words(effect: str, operand: int, n_args: Optional[int]) -> int:
+    """Words popped or pushed, given as a number or as "op"
+    or "args" plus a number
+    """
+    base, _, extra = effect.partition("+")
+    extra = int(extra or 0)
+    if base == "op":
+        return operand + extra
+    if base == "args":
+        return n_args + extra
+    return int(base) + extra
+
+
+def offsets(table: dict) -> Dict[int, object]:
+    # Offsets are strings in JSON, numbers when just assembled
+    return {int(offset): value for offset, value in table.items()}
+
+
+class MethodVerifier:
+    """Verifies the code of one method of a module"""
+    def __init__(self, module: dict, method: dict, ops: List[Operation]):
+        self.module = module
+        self.method = method
+        self.ops = ops
+        self.code: List[int] = method["code"]
+        self.n_args: int = method.get("args", 0)
+        self.n_locals: int = method.get("locals", 0)
+        self.calls = offsets(method.get("calls", {}))
+        # offset -> operation, for each instruction
+        self.instrs: Dict[int, Operation] = {}
+        # offset -> stack depth before the instruction
+        self.depth: Dict[int, int] = {}
+        self.max_stack = 0
+
+    def fail(self, pc: int, msg: str):
+        raise VerifyError(f"at {pc}: {msg}")
+
+    def decode(self):
+        """Find where each instruction starts"""
+        pc = 0
+        while pc < len(self.code):
+            opcode = self.code[pc]
+            if not 0 <= opcode < len(self.ops):
+                self.fail(pc, f"unknown opcode {opcode}")
+            op = self.ops[opcode]
+            if pc + op.size() > len(self.code):
+                self.fail(pc, f"{op.name} is missing its operand")
+            self.instrs[pc] = op
+            pc += op.size()
+
+    def check_slot(self, pc: int, slot: int):
+        if slot == 0 or -self.n_args <= slot < 0 \
+                or FRAME_HEADER <= slot < FRAME_HEADER + self.n_locals:
+            return
+        self.fail(pc, f"frame slot {slot} is not an argument or local")
+
+    def table_entry(self, pc: int, table: str, index: int):
+        entries = self.module.get(table, [])
+        if not 0 <= index < len(entries):
+            self.fail(pc, f"no entry {index} in {table}")
+        return entries[index]
+
+    def check_operand(self, pc: int, op: Operation, operand: int,
+                      depth: int):
+        """Checks that depend on what the operand means"""
+        if op.name in LOCAL_OPERANDS:
+            self.check_slot(pc, operand)
+        elif op.name == "return":
+            if operand != self.n_args:
+                self.fail(pc, f"return {operand} in a method "
+                              f"of {self.n_args} arguments")
+        elif op.name == "alloc":
+            if depth != 0 or operand != self.n_locals:
+                self.fail(pc, f"alloc {operand} is not the allocation "
+                              f"of the method's {self.n_locals} locals")
+        elif op.name in ("tailcall", "tailcall_direct"):
+            call = self.table_entry(pc, "tail_calls", operand)
+            if (call["args"], call["locals"]) != (self.n_args, self.n_locals):
+                self.fail(pc, "tail call does not match the method's frame")
+            if depth != self.n_locals + self.calls[pc] + 1:
+                self.fail(pc, "tail call with more than its call on the stack")
+        elif op.name == "for_next":
+            loop = self.table_entry(pc, "for_loops", operand)
+            self.check_slot(pc, loop["counter"])
+            if not loop["const"]:
+                self.check_slot(pc, loop["end"])
+
+    def successors(self, pc: int, following: int, op: Operation,
+                   operand: int) -> List[int]:
+        """Where execution may go after op (at pc), which ends
+        an instruction; the next one starts at following
+        """
+        if op.flow == "next":
+            return [following]
+        if op.flow == "jump":
+            return [following + operand]
+        if op.flow == "branch":
+            return [following, following + operand]
+        if op.flow == "stop":
+            return []
+        if op.flow == "switch":
+            # One jump for each entry of the table, and one more
+            table = {"typeswitch": "typeswitches",
+                     "jump_table": "jump_tables"}[op.name]
+            n_jumps = len(self.table_entry(pc, table, operand)) + 1
+        elif op.flow == "loop":
+            n_jumps = 1
+        else:
+            raise VerifyError(f"unknown flow '{op.flow}' of {op.name}")
+        jumps = [following + 2 * i for i in range(n_jumps)]
+        for jump in jumps:
+            if jump not in self.instrs or self.instrs[jump].name != "jump":
+                self.fail(pc, f"{op.name} is not followed by its jumps")
+        if op.flow == "loop":
+            # Leaving the loop steps over its jump
+            return jumps + [jumps[-1] + 2]
+        return jumps
+
+    def run(self) -> int:
+        """The method's max_stack, if it verifies"""
+        self.decode()
+        if not self.instrs:
+            self.fail(0, "the method has no code")
+        self.depth[0] = 0
+        work = [0]
+        while work:
+            start = work.pop()
+            depth = self.depth[start]
+            # Each operation of a superinstruction in turn
+            for pc, op, operand in self.instrs[start].steps(start, self.code):
+                depth = self.step(pc, op, operand, depth)
+            following = start + self.instrs[start].size()
+            for succ in self.successors(pc, following, op, operand):
+                if succ == len(self.code):
+                    self.fail(pc, "runs off the end of the method")
+                if succ not in self.instrs:
+                    self.fail(pc, f"jumps to {succ}, "
+                                  f"which is not an instruction")
+                if succ not in self.depth:
+                    self.depth[succ] = depth
+                    work.append(succ)
+                elif self.depth[succ] != depth:
+                    self.fail(pc, f"stack depth {depth} at {succ}, which "
+                                  f"is reached with {self.depth[succ]}")
+        return self.max_stack
+
+    def step(self, pc: int, op: Operation, operand: int, depth: int) -> int:
+        """Check one operation; the stack depth after it"""
+        n_args = self.calls.get(pc)
+        if n_args is None and "args" in op.pops + op.pushes:
+            self.fail(pc, "number of arguments of the call is unknown")
+        pops = stack_words(op.pops, operand, n_args)
+        pushes = stack_words(op.pushes, operand, n_args)
+        self.check_operand(pc, op, operand, depth)
+        floor = 0 if op.name == "alloc" else self.n_locals
+        if depth - pops < floor:
+            self.fail(pc, f"{op.name} pops {pops} of {depth - floor} "
+                          f"words on the stack")
+        after = depth - pops + pushes
+        self.max_stack = max(self.max_stack, depth, after)
+        return after
+
+
+def verify(module: dict, ops: List[Operation]) -> List[str]:
+    """Verify each method of a module, recording its max_stack,
+    and whether the whole module passed.  Returns the errors.
+    """
+    errors = []
+    for method in module.get("code", []):
+        try:
+            method["max_stack"] = MethodVerifier(module, method, ops).run()
+        except VerifyError as e:
+            method.pop("max_stack", None)
+            errors.append(f"{module['class_name']}:{method['name']} {e}")
+    module["verified"] = not errors
+    return errors
+
+
+# ----------------
+#  Verifying object files
+#
+
+def read_object(path: Path) -> dict:
+    if path.suffix == ".qbc":
+        return qbc.read(str(path))
+    with open(path, "r") as source:
+        return json.load(source)
+
+
+def write_object(module: dict, path: Path):
+    """Record the result in the object file and the
+    other form of it beside it
+    """
+    with open(path.with_suffix(".json"), "w") as target:
+        print(json.dumps(module, indent=4), file=target)
+    with open(path.with_suffix(".qbc"), "wb") as target:
+        target.write(qbc.encode(module))
+
+
+def cli():
+    parser = argparse.ArgumentParser(
+        description="Verify object files and record the result in them")
+    parser.add_argument("objects", nargs="+", help="Class.json or Class.qbc")
+    parser.add_argument("--opdefs", default="opdefs.txt")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="report errors, but leave the files alone")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    ops = operations(args.opdefs)
+    failed = False
+    for name in args.objects:
+        path = Path(name)
+        module = read_object(path)
+        if "code" not in module:
+            # A built-in class (OBJ/Int.json), whose methods are native
+            print(f"{path}: no code to verify, skipped", file=sys.stderr)
+            continue
+        errors = verify(module, ops)
+        for error in errors:
+            print(f"{path}: {error}", file=sys.stderr)
+        failed = failed or bool(errors)
+        if not args.dry_run:
+            write_object(module, path)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+
+/**
+ * GENERATED CODE, DO NOT EDIT
+ * Generated 2026-10-19 13:06:45.047872 by build_bytecode_table.py
+ * 
+ * Integer encoding of VM operations ---
+ * Map those integer encodings to function pointers (for executing)
+ * and to strings (for debugging and assembling).
+ */
+ 
+#include "vm_code_table.h"
+
+/* load_load = load load */
+static int vm_super_load_load_parts[] = { 9, 9, -1 };
+static void vm_super_load_load(void) {
+    vm_op_load();
+    vm_op_load();
+}
+
+/* load_load_field = load load_field */
+static int vm_super_load_load_field_parts[] = { 9, 11, -1 };
+static void vm_super_load_load_field(void) {
+    vm_op_load();
+    vm_op_load_field();
+}
+
+/* load_store_field = load store_field */
+static int vm_super_load_store_field_parts[] = { 9, 12, -1 };
+static void vm_super_load_store_field(void) {
+    vm_op_load();
+    vm_op_store_field();
+}
+
+/* load_const = load const */
+static int vm_super_load_const_parts[] = { 9, 1, -1 };
+static void vm_super_load_const(void) {
+    vm_op_load();
+    vm_op_const();
+}
+
+/* store_load = store load */
+static int vm_super_store_load_parts[] = { 10, 9, -1 };
+static void vm_super_store_load(void) {
+    vm_op_store();
+    vm_op_load();
+}
+
+/* const_store = const store */
+static int vm_super_const_store_parts[] = { 1, 10, -1 };
+static void vm_super_const_store(void) {
+    vm_op_const();
+    vm_op_store();
+}
+
+/* load_call_direct = load call_direct */
+static int vm_super_load_call_direct_parts[] = { 9, 18, -1 };
+static void vm_super_load_call_direct(void) {
+    vm_op_load();
+    vm_op_call_direct();
+}
+
+/* load_load_roll_call = load load roll call */
+static int vm_super_load_load_roll_call_parts[] = { 9, 9, 13, 2, -1 };
+static void vm_super_load_load_roll_call(void) {
+    vm_op_load();
+    vm_op_load();
+    vm_op_roll();
+    vm_op_methodcall();
+}
+
+/* load_is_instance_jump_ifnot = load is_instance jump_ifnot */
+static int vm_super_load_is_instance_jump_ifnot_parts[] = { 9, 17, 16, -1 };
+static void vm_super_load_is_instance_jump_ifnot(void) {
+    vm_op_load();
+    vm_op_is_instance();
+    vm_op_jump_ifnot();
+}
+
+
+op_tbl_entry vm_op_bytecodes[] = {
+	 { "halt", vm_op_halt, 0, 0 }, //0  Stops the processor.
+	 { "const", vm_op_const, 1, 0 }, //1  Push constant; constant value follows
+	 { "call", vm_op_methodcall, 1, 0 }, //2  Call an interpreted method
+	 { "call_native", vm_op_call_native, 1, 0 }, //3  Trampoline to native method
+	 { "enter", vm_op_enter, 0, 0 }, //4  Prologue of called method
+	 { "return", vm_op_return, 1, 0 }, //5  Return from method, reclaiming locals
+	 { "new", vm_op_new, 1, 0 }, //6  Allocate a new object instance
+	 { "pop", vm_op_pop, 0, 0 }, //7  Discard top of stack
+	 { "alloc", vm_op_alloc, 1, 0 }, //8  Allocate stack space for locals
+	 { "load", vm_op_load, 1, 0 }, //9  Load (push) a local variable onto stack
+	 { "store", vm_op_store, 1, 0 }, //10  Store (pop) top of stack to local variable
+	 { "load_field", vm_op_load_field, 1, 0 }, //11  Load from object field
+	 { "store_field", vm_op_store_field, 1, 0 }, //12  Store to object field
+	 { "roll", vm_op_roll, 1, 0 }, //13  [obj arg1 ... argn] -> [arg1 ... argn obj]
+	 { "jump", vm_op_jump, 1, 0 }, //14  Unconditional relative jump
+	 { "jump_if", vm_op_jump_if, 1, 0 }, //15  Conditional relative jump, if true
+	 { "jump_ifnot", vm_op_jump_ifnot, 1, 0 }, //16  Conditional relative jump, if false
+	 { "is_instance", vm_op_is_instance, 1, 0 }, //17  Test membership in class (for typecase)
+	 { "call_direct", vm_op_call_direct, 1, 0 }, //18  Call a method at a known address, bypassing the vtable
+	 { "tailcall", vm_op_tailcall, 1, 0 }, //19  Call a method in place of the current one, reusing its frame
+	 { "tailcall_direct", vm_op_tailcall_direct, 1, 0 }, //20  Tail call to a method at a known address
+	 { "typeswitch", vm_op_typeswitch, 1, 0 }, //21  Take the jump after this one chosen by the first class that matches
+	 { "iadd", vm_op_iadd, 0, 0 }, //22  [a b] -> [a + b], both Int
+	 { "isub", vm_op_isub, 0, 0 }, //23  [a b] -> [a - b], both Int
+	 { "imul", vm_op_imul, 0, 0 }, //24  [a b] -> [a * b], both Int
+	 { "idiv", vm_op_idiv, 0, 0 }, //25  [a b] -> [a / b], both Int
+	 { "imod", vm_op_imod, 0, 0 }, //26  [a b] -> [a % b], both Int
+	 { "ineg", vm_op_ineg, 0, 0 }, //27  [a] -> [-a], Int
+	 { "ilt", vm_op_ilt, 0, 0 }, //28  [a b] -> [a < b], both Int
+	 { "ile", vm_op_ile, 0, 0 }, //29  [a b] -> [a <= b], both Int
+	 { "igt", vm_op_igt, 0, 0 }, //30  [a b] -> [a > b], both Int
+	 { "ige", vm_op_ige, 0, 0 }, //31  [a b] -> [a >= b], both Int
+	 { "ieq", vm_op_ieq, 0, 0 }, //32  [a b] -> [a == b], both Int
+	 { "jump_ilt", vm_op_jump_ilt, 1, 0 }, //33  [a b] -> [], relative jump if a < b, both Int
+	 { "jump_ile", vm_op_jump_ile, 1, 0 }, //34  [a b] -> [], relative jump if a <= b, both Int
+	 { "jump_igt", vm_op_jump_igt, 1, 0 }, //35  [a b] -> [], relative jump if a > b, both Int
+	 { "jump_ige", vm_op_jump_ige, 1, 0 }, //36  [a b] -> [], relative jump if a >= b, both Int
+	 { "jump_ieq", vm_op_jump_ieq, 1, 0 }, //37  [a b] -> [], relative jump if a == b, both Int
+	 { "jump_ine", vm_op_jump_ine, 1, 0 }, //38  [a b] -> [], relative jump if a != b, both Int
+	 { "jump_table", vm_op_jump_table, 1, 0 }, //39  Take the jump after this one chosen by an Int's position in a table of values
+	 { "load_int", vm_op_load_int, 1, 0 }, //40  Push an unboxed Int local variable
+	 { "store_int", vm_op_store_int, 1, 0 }, //41  Pop an unboxed Int into a local variable
+	 { "push_int", vm_op_push_int, 1, 0 }, //42  Push the operand as an unboxed Int
+	 { "box", vm_op_box, 0, 0 }, //43  [n] -> [Int n], unboxed n
+	 { "unbox", vm_op_unbox, 0, 0 }, //44  [Int n] -> [n], unboxed n
+	 { "radd", vm_op_radd, 0, 0 }, //45  [a b] -> [a + b], unboxed result
+	 { "rsub", vm_op_rsub, 0, 0 }, //46  [a b] -> [a - b], unboxed result
+	 { "rmul", vm_op_rmul, 0, 0 }, //47  [a b] -> [a * b], unboxed result
+	 { "rdiv", vm_op_rdiv, 0, 0 }, //48  [a b] -> [a / b], unboxed result
+	 { "rmod", vm_op_rmod, 0, 0 }, //49  [a b] -> [a % b], unboxed result
+	 { "rneg", vm_op_rneg, 0, 0 }, //50  [a] -> [-a], unboxed result
+	 { "for_next", vm_op_for_next, 1, 0 }, //51  Count a for loop and take the jump after this one unless its range is done
+	 { "load_load", vm_super_load_load, 2, vm_super_load_load_parts }, //52  Push two variables
+	 { "load_load_field", vm_super_load_load_field, 2, vm_super_load_load_field_parts }, //53  Push a field of a variable ($)
+	 { "load_store_field", vm_super_load_store_field, 2, vm_super_load_store_field_parts }, //54  Store a variable to a field
+	 { "load_const", vm_super_load_const, 2, vm_super_load_const_parts }, //55  Push a variable and a constant
+	 { "store_load", vm_super_store_load, 2, vm_super_store_load_parts }, //56  Store a variable, push a variable
+	 { "const_store", vm_super_const_store, 2, vm_super_const_store_parts }, //57  Store a constant to a variable
+	 { "load_call_direct", vm_super_load_call_direct, 2, vm_super_load_call_direct_parts }, //58  Call a known method of a variable
+	 { "load_load_roll_call", vm_super_load_load_roll_call, 4, vm_super_load_load_roll_call_parts }, //59  Call a method with one argument, receiver first
+	 { "load_is_instance_jump_ifnot", vm_super_load_is_instance_jump_ifnot, 3, vm_super_load_is_instance_jump_ifnot_parts }, //60  Test the class of a variable
+
+    { 0, 0, 0, 0}  // SENTRY
+};
+
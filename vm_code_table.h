@@ -15,6 +15,7 @@ typedef struct {
     char *name;
     vm_Instr instr;
     int n_operands;
+    int *parts;     // A superinstruction's operations (opcodes), then -1
 } op_tbl_entry;
 
 extern op_tbl_entry vm_op_bytecodes[];
@@ -15,3 +15,8 @@ void check_health_object(obj_ref v) {
     assert(v->header.tag == GOOD_OBJ_TAG);
     assert(v->header.clazz->header.healthy_class_tag == HEALTHY);
 }
+
+int is_subclass_of(class_ref sub, class_ref super) {
+    return sub->header.preorder >= super->header.preorder
+        && sub->header.postorder <= super->header.postorder;
+}
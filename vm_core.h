@@ -6,6 +6,8 @@
 #ifndef TINY_VM_VM_CORE_H
 #define TINY_VM_VM_CORE_H
 
+#include <stdint.h>
+
 /**
  * VM core structures.  See docs/notes.md.
  *   The order of declarations below is constrained
@@ -45,8 +47,18 @@ struct class_header_struct {
     class_ref super;  // Needed for typecase
     int n_fields;     // Redundant but convenient for debugging
     int object_size;  // Malloc this much before calling constructor
+    int preorder;     // Position in a preorder walk of the class tree
+    int postorder;    // Position in a postorder walk of the class tree
 };
 
+/* A class is a subclass of another (or the same class) exactly
+ * when its preorder number is no less, and its postorder number
+ * no greater, than the other's.  The loader renumbers the class
+ * tree whenever it loads a class, so this takes constant time
+ * however deep the hierarchy is.
+ */
+extern int is_subclass_of(class_ref sub, class_ref super);
+
 
 /* Virtual machine instructions */
 typedef int vm_Intval;          // Native integers only for method slot indexes
@@ -68,8 +80,18 @@ typedef union u_Word {
     class_ref clazz;        // A class to be instantiated
     vm_addr code_addr;      // Saved program counter
     vm_addr frame_addr;    // Saved stack or frame pointer;
+    intptr_t raw_int;       // An unboxed Int, tagged (see VM_RAW_INT)
 } vm_Word;
 
+/* An Int variable the compiler proves never holds anything else
+ * may be kept in its frame slot unboxed.  The number is shifted
+ * left and its low bit set, which no (aligned) object reference
+ * has, so a stack dump can still tell it from a reference.
+ */
+#define VM_RAW_INT(n) ((vm_Word) {.raw_int = ((intptr_t) (n) << 1) | 1})
+#define VM_RAW_VALUE(w) ((int) ((w).raw_int >> 1))
+#define VM_IS_RAW_INT(w) ((w).raw_int & 1)
+
 
 /* In the class hierarchy, if C.vtable[7] is method "foo",
  * and D is a subclass of C, then D.vtable[7] is
@@ -2,6 +2,7 @@
 
 #include "vm_loader.h"
 #include "vm_state.h"
+#include "vm_profile.h"
 #include "builtins.h" // For constants
 #include "vm_code_table.h" // opcode -> instruction
 #include "logger.h"
@@ -10,6 +11,11 @@
 #include <stdlib.h>
 #include <string.h>
 #include <assert.h>
+#include <stdint.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 
 // Set load library path before loading each class by name.
@@ -32,11 +38,53 @@ vm_addr vm_current_address() {
  * list of classes references will do; we can look them up by checking
  * the ref->header.name
  */
-#define MAX_CLASSES 100   // And we will behave very badly if you have more
+#define MAX_CLASSES 1000  // And we will behave very badly if you have more
 class_ref loaded_classes[MAX_CLASSES];
 static int n_classes_loaded;
 
+/* Number the subtree of the class hierarchy rooted at
+ * loaded_classes[i], in preorder and postorder, for
+ * constant-time subclass tests.  The subclasses of each
+ * class are listed from first_child through next_sibling.
+ */
+static void number_subtree(int i, int first_child[], int next_sibling[],
+                           int *preorder, int *postorder) {
+    loaded_classes[i]->header.preorder = (*preorder)++;
+    for (int sub = first_child[i]; sub >= 0; sub = next_sibling[sub]) {
+        number_subtree(sub, first_child, next_sibling, preorder, postorder);
+    }
+    loaded_classes[i]->header.postorder = (*postorder)++;
+}
+
+/* Number the whole class tree, once every class is loaded.
+ * The subclasses of each class are listed first, so that
+ * the walk need not search the table at each class.
+ */
+static void number_classes(void) {
+    static int first_child[MAX_CLASSES];
+    static int next_sibling[MAX_CLASSES];
+    // Until it is numbered, each class holds its index in the table
+    for (int i=0; i < n_classes_loaded; ++i) {
+        loaded_classes[i]->header.preorder = i;
+        first_child[i] = -1;
+    }
+    // Listed from the end, so subclasses are numbered in load order
+    for (int i=n_classes_loaded - 1; i >= 0; --i) {
+        class_ref super = loaded_classes[i]->header.super;
+        if (super) {
+            int parent = super->header.preorder;
+            next_sibling[i] = first_child[parent];
+            first_child[parent] = i;
+        }
+    }
+    int preorder = 0, postorder = 0;
+    number_subtree(the_class_Obj->header.preorder, first_child, next_sibling,
+                   &preorder, &postorder);
+}
+
 /* Add a class reference to the table of loaded classes.
+ * Classes are numbered for subclass tests only when all
+ * are loaded (see number_classes).
  */
 static void set_loaded(class_ref c) {
     int slot = n_classes_loaded++;
@@ -45,6 +93,48 @@ static void set_loaded(class_ref c) {
     return;
 }
 
+/* Direct calls name a class and a vtable slot.  The method
+ * address in that slot may not be known yet when the call is
+ * loaded (the class may still be loading, or may be the
+ * class currently being loaded), so each call site is
+ * recorded here and patched when loading is finished.
+ */
+struct direct_call_patch {
+    vm_addr site;       // Operand word of call_direct, or tail call target
+    class_ref clazz;    // Class whose vtable holds the method
+    int slot;           // Index of the method in that vtable
+};
+static struct direct_call_patch *direct_call_patches = NULL;
+static int n_direct_call_patches = 0;
+static int direct_call_capacity = 0;
+
+/* Room for one more call site, however many the program has;
+ * the table doubles when it is full
+ */
+static struct direct_call_patch *new_direct_call_patch(void) {
+    if (n_direct_call_patches == direct_call_capacity) {
+        direct_call_capacity = direct_call_capacity ?
+                2 * direct_call_capacity : 256;
+        direct_call_patches = realloc(direct_call_patches,
+                direct_call_capacity * sizeof(struct direct_call_patch));
+        assert(direct_call_patches);
+    }
+    return &direct_call_patches[n_direct_call_patches++];
+}
+
+/* Fill in the code address of every loaded direct call */
+static void resolve_direct_calls(void) {
+    for (int i=0; i < n_direct_call_patches; ++i) {
+        struct direct_call_patch patch = direct_call_patches[i];
+        check_health_class(patch.clazz);
+        vm_addr method_addr = patch.clazz->vtable[patch.slot];
+        log_debug("Direct call to %s slot %d",
+                  patch.clazz->header.class_name, patch.slot);
+        *patch.site = (vm_Word) {.code_addr = method_addr};
+    }
+    n_direct_call_patches = 0;
+}
+
 /* Initialize loader
  * (loads built-in classes, dummy main program,
  * special named constants)
@@ -83,6 +173,10 @@ void vm_loader_init(char *load_path_prefix) {
 void vm_loader_set_main(char *main_class_name) {
     class_ref main_class = find_loaded(main_class_name);
     assert(main_class);
+    // Every class is loaded, so the class tree is complete
+    number_classes();
+    // and so is every vtable
+    resolve_direct_calls();
     vm_code_block[0] = (vm_Word) {.instr = vm_op_new};
     vm_code_block[1] = (vm_Word) {.clazz = main_class};
     vm_code_block[2] = (vm_Word) {.instr = vm_op_methodcall};
@@ -118,38 +212,417 @@ class_ref ensure_loaded(char *class_name) {
 
 
 
-// Capacity limit:  For simplicity we read into a
-// buffer of 20k bytes.
-//
-#define FILE_BUFFER_CAPACITY (1024 * 100 * sizeof(char))
+/* A module as read from an object file, in either format:
+ * JSON, or the binary .qbc form (see qbc.py).  From a .qbc file,
+ * code words and fixed-size table entries point into the mapped
+ * file and strings into its string table; from JSON they are
+ * allocated, and strings point into the parsed tree.
+ */
+struct module_constant {
+    char kind;          // 'i' or 's'
+    char *value;
+};
+
+struct module_tail_call {
+    int32_t slot;
+    int32_t n_args;
+    int32_t n_locals;
+    int32_t class_index;  // In "imports", or -1 if not direct
+};
+
+/* Classes (by index in "imports") of a typeswitch,
+ * or Int values of a jump table
+ */
+struct module_table {
+    int n;
+    int32_t *values;
+};
+
+struct module_for_loop {
+    int32_t counter;
+    int32_t end;
+    int32_t const_end;
+    int32_t step;
+};
+
+struct module_site {
+    int offset;
+    char *site;
+};
+
+struct module_method {
+    char *name;
+    int slot;
+    int max_stack;      // From verify.py, or -1
+    int n_words;
+    int32_t *words;
+    int n_sites;
+    struct module_site *sites;
+    int n_lines;
+    int32_t *lines;     // (offset, line) pairs where the line changes
+};
+
+struct module {
+    char *class_name;
+    char *super_name;
+    int n_fields;
+    int n_methods;
+    int n_inherited;
+    int verified;       // verify.py passed every method
+    int n_imports;
+    char **imports;
+    int n_constants;
+    struct module_constant *constants;
+    int n_direct_calls;
+    int32_t *direct_calls;      // (class index, slot) pairs
+    int n_tail_calls;
+    struct module_tail_call *tail_calls;
+    int n_typeswitches;
+    struct module_table *typeswitches;
+    int n_jump_tables;
+    struct module_table *jump_tables;
+    int n_for_loops;
+    struct module_for_loop *for_loops;
+    int n_code;
+    struct module_method *code;
+    int allocated;  // Code words and tables were allocated, not mapped
+};
+
+static void free_module(struct module *m) {
+    if (m->allocated) {
+        free(m->direct_calls);
+        free(m->tail_calls);
+        free(m->for_loops);
+        for (int i=0; i < m->n_typeswitches; ++i) {
+            free(m->typeswitches[i].values);
+        }
+        for (int i=0; i < m->n_jump_tables; ++i) {
+            free(m->jump_tables[i].values);
+        }
+        for (int i=0; i < m->n_code; ++i) {
+            free(m->code[i].words);
+            free(m->code[i].lines);
+        }
+    }
+    for (int i=0; i < m->n_code; ++i) {
+        free(m->code[i].sites);
+    }
+    free(m->imports);
+    free(m->constants);
+    free(m->typeswitches);
+    free(m->jump_tables);
+    free(m->code);
+}
+
+/* ------------- Reading JSON object files ------------- */
+
+static int32_t json_int(cJSON *obj, char *key) {
+    return (int32_t) cJSON_GetNumberValue(
+            cJSON_GetObjectItemCaseSensitive(obj, key));
+}
+
+static cJSON *json_list(cJSON *obj, char *key, int *n) {
+    cJSON *list = cJSON_GetObjectItemCaseSensitive(obj, key);
+    *n = cJSON_GetArraySize(list);   // 0 if missing
+    return list;
+}
+
+/* Object files from before direct calls (and the other
+ * tables) have no such lists, and read as empty ones.
+ */
+static void json_table(cJSON *list, struct module_table *table) {
+    table->n = cJSON_GetArraySize(list);
+    table->values = malloc((table->n + 1) * sizeof(int32_t));
+    int i = 0;
+    cJSON *el;
+    cJSON_ArrayForEach(el, list) {
+        table->values[i++] = el->valueint;
+    }
+}
+
+static void module_from_json(cJSON *tree, struct module *m) {
+    cJSON *list, *el;
+    int i;
+    m->allocated = 1;
+    m->class_name = cJSON_GetStringValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "class_name"));
+    m->super_name = cJSON_GetStringValue(
+            cJSON_GetObjectItemCaseSensitive(tree, "super"));
+    // Counts of methods and fields; I'm letting the assembler do the work here.
+    m->n_fields = json_int(tree, "n_fields");
+    m->n_methods = json_int(tree, "n_methods");
+    m->n_inherited = json_int(tree, "n_inherited");
+    m->verified = cJSON_IsTrue(
+            cJSON_GetObjectItemCaseSensitive(tree, "verified"));
+
+    list = json_list(tree, "imports", &m->n_imports);
+    if (list == NULL) {
+        perror("Missing 'imports' element in json");
+    }
+    m->imports = malloc((m->n_imports + 1) * sizeof(char *));
+    i = 0;
+    cJSON_ArrayForEach(el, list) {
+        m->imports[i++] = el->valuestring;
+    }
+
+    list = json_list(tree, "constants", &m->n_constants);
+    if (list == NULL) {
+        perror("Missing 'constants' element in json");
+    }
+    m->constants = malloc((m->n_constants + 1)
+                          * sizeof(struct module_constant));
+    i = 0;
+    cJSON_ArrayForEach(el, list) {
+        m->constants[i].kind = cJSON_GetStringValue(
+                cJSON_GetObjectItemCaseSensitive(el, "kind"))[0];
+        m->constants[i].value = cJSON_GetStringValue(
+                cJSON_GetObjectItemCaseSensitive(el, "value"));
+        ++i;
+    }
+
+    list = json_list(tree, "direct_calls", &m->n_direct_calls);
+    m->direct_calls = malloc((2 * m->n_direct_calls + 1) * sizeof(int32_t));
+    i = 0;
+    cJSON_ArrayForEach(el, list) {
+        m->direct_calls[i++] = json_int(el, "class");
+        m->direct_calls[i++] = json_int(el, "slot");
+    }
+
+    list = json_list(tree, "tail_calls", &m->n_tail_calls);
+    m->tail_calls = malloc((m->n_tail_calls + 1)
+                           * sizeof(struct module_tail_call));
+    i = 0;
+    cJSON_ArrayForEach(el, list) {
+        cJSON *class_el = cJSON_GetObjectItemCaseSensitive(el, "class");
+        m->tail_calls[i++] = (struct module_tail_call) {
+            .slot = json_int(el, "slot"),
+            .n_args = json_int(el, "args"),
+            .n_locals = json_int(el, "locals"),
+            .class_index = class_el ? (int32_t) cJSON_GetNumberValue(class_el)
+                                    : -1
+        };
+    }
+
+    list = json_list(tree, "typeswitches", &m->n_typeswitches);
+    m->typeswitches = malloc((m->n_typeswitches + 1)
+                             * sizeof(struct module_table));
+    i = 0;
+    cJSON_ArrayForEach(el, list) {
+        json_table(el, &m->typeswitches[i++]);
+    }
+
+    list = json_list(tree, "jump_tables", &m->n_jump_tables);
+    m->jump_tables = malloc((m->n_jump_tables + 1)
+                            * sizeof(struct module_table));
+    i = 0;
+    cJSON_ArrayForEach(el, list) {
+        json_table(el, &m->jump_tables[i++]);
+    }
+
+    list = json_list(tree, "for_loops", &m->n_for_loops);
+    m->for_loops = malloc((m->n_for_loops + 1)
+                          * sizeof(struct module_for_loop));
+    i = 0;
+    cJSON_ArrayForEach(el, list) {
+        m->for_loops[i++] = (struct module_for_loop) {
+            .counter = json_int(el, "counter"),
+            .end = json_int(el, "end"),
+            .const_end = cJSON_IsTrue(
+                    cJSON_GetObjectItemCaseSensitive(el, "const")),
+            .step = json_int(el, "step")
+        };
+    }
+
+    list = json_list(tree, "code", &m->n_code);
+    assert(list);  // Abort if it wasn't present
+    assert(cJSON_IsArray(list));  // Should be an array of methods
+    m->code = malloc((m->n_code + 1) * sizeof(struct module_method));
+    i = 0;
+    cJSON_ArrayForEach(el, list) {
+        struct module_method *method = &m->code[i++];
+        method->name = cJSON_GetStringValue(
+                cJSON_GetObjectItemCaseSensitive(el, "name"));
+        method->slot = json_int(el, "slot");
+        cJSON *max_stack = cJSON_GetObjectItemCaseSensitive(el, "max_stack");
+        method->max_stack = max_stack ? json_int(el, "max_stack") : -1;
+        struct module_table words;
+        cJSON *ops = cJSON_GetObjectItemCaseSensitive(el, "code");
+        assert(cJSON_IsArray(ops));
+        json_table(ops, &words);
+        method->n_words = words.n;
+        method->words = words.values;
+        // "sites" maps offset in the method to source position
+        cJSON *sites = json_list(el, "sites", &method->n_sites);
+        method->sites = malloc((method->n_sites + 1)
+                               * sizeof(struct module_site));
+        int j = 0;
+        cJSON *site;
+        cJSON_ArrayForEach(site, sites) {
+            method->sites[j++] = (struct module_site) {
+                .offset = atoi(site->string),
+                .site = cJSON_GetStringValue(site)
+            };
+        }
+        // "lines" is a list of [offset, line] pairs
+        cJSON *lines = json_list(el, "lines", &method->n_lines);
+        method->lines = malloc((2 * method->n_lines + 1) * sizeof(int32_t));
+        j = 0;
+        cJSON *line;
+        cJSON_ArrayForEach(line, lines) {
+            method->lines[j++] = cJSON_GetArrayItem(line, 0)->valueint;
+            method->lines[j++] = cJSON_GetArrayItem(line, 1)->valueint;
+        }
+    }
+}
+
+/* ------------- Reading binary (.qbc) object files ------------- */
+
+/* Header words; must match qbc.py */
+#define QBC_MAGIC 0x00434251  // "QBC\0" read as a little-endian word
+#define QBC_VERSION 3
+#define QBC_HEADER_WORDS 8
+
+/* Position in the body of a .qbc file */
+struct qbc_reader {
+    int32_t *word;
+    char *strings;
+};
+
+static int32_t qbc_word(struct qbc_reader *r) {
+    return *r->word++;
+}
 
+static char *qbc_string(struct qbc_reader *r) {
+    return r->strings + *r->word++;
+}
 
-/* read_file_fd
- * returns 0 (failure) or 1 (success)
+/* The next n (a word) table entries of the given size in
+ * words, which are used where they are in the file
  */
-int read_file_fd(FILE *fd, char *file_buffer) {
-    int pos = 0;
-    char ch;
-    /* Simple, not efficient. */
-    while (1) {
-        ch = fgetc(fd);
-        if (feof(fd)) {
-            break;
-        } else if (ferror(fd)) {
-            perror("Error reading file");
-            break;
+static int32_t *qbc_entries(struct qbc_reader *r, int *n, int size) {
+    *n = qbc_word(r);
+    int32_t *entries = r->word;
+    r->word += *n * size;
+    return entries;
+}
+
+static struct module_table *qbc_tables(struct qbc_reader *r, int *n) {
+    *n = qbc_word(r);
+    struct module_table *tables = malloc((*n + 1)
+                                         * sizeof(struct module_table));
+    for (int i=0; i < *n; ++i) {
+        tables[i].values = qbc_entries(r, &tables[i].n, 1);
+    }
+    return tables;
+}
+
+/* Check the header of a file in the .qbc layout (object
+ * files and program images share it), and set up a reader
+ * for its body.  Returns 0 (failure) if it is not a file of
+ * the given kind this loader can read.
+ */
+static int qbc_open(char *base, size_t size, int32_t magic, int32_t version,
+                    char *kind, struct qbc_reader *r) {
+    int32_t *header = (int32_t *) base;
+    if (size < QBC_HEADER_WORDS * sizeof(int32_t)
+        || header[0] != magic) {
+        fprintf(stderr, "Not a %s (or not in this byte order)\n", kind);
+        return 0;
+    }
+    if (header[1] != version) {
+        fprintf(stderr, "%s version %d, expected %d\n",
+                kind, header[1], version);
+        return 0;
+    }
+    if ((size_t) header[2] != size
+        || (size_t) header[5] + header[6] * sizeof(int32_t) != size) {
+        fprintf(stderr, "%s size does not match its header\n", kind);
+        return 0;
+    }
+    r->word = (int32_t *) (base + header[5]);
+    r->strings = base + header[3];
+    return 1;
+}
+
+/* Returns 0 (failure) if the file is not a .qbc file
+ * this loader can read
+ */
+static int module_from_qbc(char *base, size_t size, struct module *m) {
+    struct qbc_reader r;
+    if (! qbc_open(base, size, QBC_MAGIC, QBC_VERSION, ".qbc file", &r)) {
+        return 0;
+    }
+    int i;
+    m->allocated = 0;
+    m->class_name = qbc_string(&r);
+    m->super_name = qbc_string(&r);
+    m->n_fields = qbc_word(&r);
+    m->n_methods = qbc_word(&r);
+    m->n_inherited = qbc_word(&r);
+    m->verified = qbc_word(&r);
+    int n_names;
+    qbc_entries(&r, &n_names, 1);  // Method names (for the assembler)
+    qbc_entries(&r, &n_names, 1);  // Their arities (for the verifier)
+    qbc_entries(&r, &n_names, 1);  // Field names (likewise)
+    m->n_imports = qbc_word(&r);
+    m->imports = malloc((m->n_imports + 1) * sizeof(char *));
+    for (i=0; i < m->n_imports; ++i) {
+        m->imports[i] = qbc_string(&r);
+    }
+    m->n_constants = qbc_word(&r);
+    m->constants = malloc((m->n_constants + 1)
+                          * sizeof(struct module_constant));
+    for (i=0; i < m->n_constants; ++i) {
+        m->constants[i].kind = (char) qbc_word(&r);
+        m->constants[i].value = qbc_string(&r);
+    }
+    m->direct_calls = qbc_entries(&r, &m->n_direct_calls, 2);
+    m->tail_calls = (struct module_tail_call *)
+            qbc_entries(&r, &m->n_tail_calls, 4);
+    m->typeswitches = qbc_tables(&r, &m->n_typeswitches);
+    m->jump_tables = qbc_tables(&r, &m->n_jump_tables);
+    m->for_loops = (struct module_for_loop *)
+            qbc_entries(&r, &m->n_for_loops, 4);
+    m->n_code = qbc_word(&r);
+    m->code = malloc((m->n_code + 1) * sizeof(struct module_method));
+    for (i=0; i < m->n_code; ++i) {
+        struct module_method *method = &m->code[i];
+        method->name = qbc_string(&r);
+        method->slot = qbc_word(&r);
+        qbc_word(&r);  // Arguments and locals (for the verifier)
+        qbc_word(&r);
+        method->max_stack = qbc_word(&r);
+        method->words = qbc_entries(&r, &method->n_words, 1);
+        method->n_sites = qbc_word(&r);
+        method->sites = malloc((method->n_sites + 1)
+                               * sizeof(struct module_site));
+        for (int j=0; j < method->n_sites; ++j) {
+            method->sites[j].offset = qbc_word(&r);
+            method->sites[j].site = qbc_string(&r);
         }
-        file_buffer[pos++] = ch;
+        int n_calls;
+        qbc_entries(&r, &n_calls, 2);  // Arities of calls (likewise)
+        method->lines = qbc_entries(&r, &method->n_lines, 2);
     }
-    // Do we need to add the null byte?  Maybe.
-    file_buffer[pos] = 0;
     return 1;
 }
 
-vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[]);
+/* ------------- Linking a module into the VM ------------- */
+
+/* A direct call target: which class's vtable, and which slot */
+struct direct_call_target {
+    class_ref clazz;
+    int slot;
+};
+
+vm_Word *translate_method_code(struct module_method *method,
+                               int const_map[], class_ref class_map[],
+                               struct direct_call_target direct_map[],
+                               int tail_call_base, int typeswitch_base,
+                               int jump_table_base, int for_loop_base);
 
 /*
- * Constants in a class file (.json) are referenced as small
+ * Constants in a class file are referenced as small
  * (non-negative) integer indexes
  * in a per-class "constant pool", or a fixed set of
  * negative integers (-1 .. -3 currently) for named literals.
@@ -158,24 +631,15 @@ vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[
  * (Java, in contrast, maintains a separate constant pool for each
  * class at run-time.)
  */
-static int remap_constants(int map[], cJSON *tree, int capacity) {
-    cJSON *constants = cJSON_GetObjectItemCaseSensitive(tree,
-                                           "constants");
-    if (constants == NULL) {
-        perror("Missing 'constants' element in json");
-        return 0;
-    }
+static int remap_constants(int map[], struct module *m) {
     int literal_count = 0;
-    cJSON *el;
-    cJSON_ArrayForEach(el, constants) {
-        cJSON *kind_el = cJSON_GetObjectItemCaseSensitive(el, "kind");
-        cJSON *value_el = cJSON_GetObjectItemCaseSensitive(el, "value");
-        char *kind = kind_el->valuestring;
-        char *literal = value_el->valuestring;
+    for (; literal_count < m->n_constants; ++literal_count) {
+        char kind = m->constants[literal_count].kind;
+        char *literal = m->constants[literal_count].value;
         int internal;
-        if (kind[0] == 'i') {
+        if (kind == 'i') {
             internal = int_literal_const(literal);
-        } else if (kind[0] == 's') {
+        } else if (kind == 's') {
             internal = str_literal_const(strdup(literal));
         } else {
             perror("Constant of unknown type");
@@ -183,68 +647,189 @@ static int remap_constants(int map[], cJSON *tree, int capacity) {
         map[literal_count] = internal;
         log_debug("Literal %s internal %d remapped to %d",
                   literal, literal_count, internal);
-        ++literal_count;
-        assert(literal_count < capacity);
     }
-    return literal_count; // Actually it's the count - 1
+    return literal_count;
 }
 
-/*  Object code in .json file refers to classes by index of its
+/*  Object code refers to classes by index of its
  * "imports" list.  We
  *  need to make sure each referenced class is loaded, and to
  *  map those indexes to actual references to loaded classes.
  */
-static int map_classes(class_ref class_map[], cJSON *tree, int capacity) {
+static int map_classes(class_ref class_map[], struct module *m) {
     int class_count = 0;
-    cJSON *imports = cJSON_GetObjectItemCaseSensitive(tree,
-                                                        "imports");
-    if (imports == NULL) {
-        perror("Missing 'imports' element in json");
-        return 0;
-    }
-    assert(cJSON_IsArray(imports));
-    cJSON *el = imports->child;
-    while (el) {
-        assert(class_count < capacity);
-        char *class_name = el->valuestring;
+    for (; class_count < m->n_imports; ++class_count) {
+        char *class_name = m->imports[class_count];
         class_ref clazz = ensure_loaded(class_name);
         class_map[class_count] = clazz;
-        ++class_count;
-        el = el->next;
     }
-    return class_count; // Actually it's the count - 1
+    return class_count;
 }
 
+/* Direct call operands are indexes into the "direct_calls" list,
+ * each naming a class (by index in "imports") and a method slot.
+ */
+static int map_direct_calls(struct direct_call_target direct_map[],
+                            class_ref class_map[], struct module *m) {
+    int direct_count = 0;
+    for (; direct_count < m->n_direct_calls; ++direct_count) {
+        int class_index = m->direct_calls[2 * direct_count];
+        int slot = m->direct_calls[2 * direct_count + 1];
+        direct_map[direct_count].clazz = class_map[class_index];
+        direct_map[direct_count].slot = slot;
+    }
+    return direct_count;
+}
 
-static int load_json(char buf[]) {
-    cJSON *tree = NULL; // Tree as a whole
-    cJSON *val = NULL;  // Named value in tree
-    cJSON *el = NULL;   // Element of value
-    tree = cJSON_Parse(buf);  // Must free at end
-    if (tree == NULL) {
-        perror("load_json in vm_loader.c: Failed to parse buffer. ");
-        assert(tree);  // Will definitely abort
+/* Tail call operands are indexes into the "tail_calls" list.
+ * Its entries are copied to the end of the VM's table of tail
+ * calls, so a module's operands are offset by the index of
+ * its first entry, which is returned.  A direct tail call's
+ * target address is patched in with the direct calls.
+ */
+static int map_tail_calls(class_ref class_map[], struct module *m) {
+    int tail_call_base = vm_n_tail_calls;
+    for (int i=0; i < m->n_tail_calls; ++i) {
+        struct module_tail_call *entry = &m->tail_calls[i];
+        assert(vm_n_tail_calls < VM_TAIL_CALL_CAPACITY);
+        struct vm_tail_call *call = &vm_tail_calls[vm_n_tail_calls++];
+        call->slot = entry->slot;
+        call->n_args = entry->n_args;
+        call->n_locals = entry->n_locals;
+        if (entry->class_index >= 0) {
+            *new_direct_call_patch() =
+                    (struct direct_call_patch) {
+                        .site = &call->target,
+                        .clazz = class_map[entry->class_index],
+                        .slot = call->slot
+                    };
+        }
+    }
+    return tail_call_base;
+}
+
+
+/* Typeswitch operands are indexes into the "typeswitches" list,
+ * each a list of classes (by index in "imports").  As with tail
+ * calls, they are copied to the end of the VM's table, and the
+ * index of the module's first entry is returned.
+ */
+static int map_typeswitches(class_ref class_map[], struct module *m) {
+    int typeswitch_base = vm_n_typeswitches;
+    for (int i=0; i < m->n_typeswitches; ++i) {
+        struct module_table *entry = &m->typeswitches[i];
+        assert(vm_n_typeswitches < VM_TYPESWITCH_CAPACITY);
+        struct vm_typeswitch *ts = &vm_typeswitches[vm_n_typeswitches++];
+        ts->n_classes = entry->n;
+        ts->classes = malloc(ts->n_classes * sizeof(class_ref));
+        for (int j=0; j < entry->n; ++j) {
+            ts->classes[j] = class_map[entry->values[j]];
+        }
+    }
+    return typeswitch_base;
+}
+
+/* Jump table operands are indexes into the "jump_tables" list,
+ * each a list of Int values in increasing order.  They are
+ * copied to the end of the VM's table like typeswitches.
+ */
+static int map_jump_tables(struct module *m) {
+    int jump_table_base = vm_n_jump_tables;
+    for (int i=0; i < m->n_jump_tables; ++i) {
+        struct module_table *entry = &m->jump_tables[i];
+        assert(vm_n_jump_tables < VM_JUMP_TABLE_CAPACITY);
+        struct vm_jump_table *table = &vm_jump_tables[vm_n_jump_tables++];
+        table->n_values = entry->n;
+        assert(table->n_values > 0);
+        table->values = malloc(table->n_values * sizeof(int));
+        for (int j=0; j < entry->n; ++j) {
+            table->values[j] = entry->values[j];
+        }
+        table->dense = table->values[table->n_values - 1]
+                       - table->values[0] == table->n_values - 1;
+    }
+    return jump_table_base;
+}
+
+/* For loop operands are indexes into the "for_loops" list,
+ * copied to the end of the VM's table like jump tables.
+ */
+static int map_for_loops(struct module *m) {
+    int for_loop_base = vm_n_for_loops;
+    for (int i=0; i < m->n_for_loops; ++i) {
+        struct module_for_loop *entry = &m->for_loops[i];
+        assert(vm_n_for_loops < VM_FOR_LOOP_CAPACITY);
+        struct vm_for_loop *loop = &vm_for_loops[vm_n_for_loops++];
+        loop->counter = entry->counter;
+        loop->end = entry->end;
+        loop->const_end = entry->const_end;
+        loop->step = entry->step;
+    }
+    return for_loop_base;
+}
+
+/* Keep track of whether every loaded method is verified,
+ * and of the largest frame one may need
+ */
+static void note_verified(struct module *m) {
+    if (! m->verified) {
+        vm_verified = 0;
+        return;
+    }
+    for (int i=0; i < m->n_code; ++i) {
+        int frame = 2 + m->code[i].max_stack;
+        if (frame > vm_frame_bound) {
+            vm_frame_bound = frame;
+        }
     }
+}
 
-    /* module constant index -> global constant index */
-    int constant_renumber_map[30];
-    int n_consts = remap_constants(constant_renumber_map, tree, 30);
+/* Record a method and the source positions of the
+ * instructions it profiles, given in "sites" as a map
+ * from offset in the method to position.
+ */
+static void profile_method(char *class_name, struct module_method *method,
+                           vm_addr start) {
+    vm_profile_method(class_name, method->name, start, vm_current_address());
+    for (int i=0; i < method->n_sites; ++i) {
+        vm_profile_site(start + method->sites[i].offset,
+                        method->sites[i].site);
+    }
+}
+
+/* Record the lines of source of a method's code, which
+ * end where its code does
+ */
+static void method_lines(struct module_method *method, vm_addr start) {
+    if (method->n_lines == 0) {
+        return;
+    }
+    for (int i=0; i < method->n_lines; ++i) {
+        vm_profile_line(start + method->lines[2 * i],
+                        method->lines[2 * i + 1]);
+    }
+    vm_profile_line(vm_current_address(), 0);
+}
+
+
+static int link_module(struct module *m) {
+    /* module constant index -> global constant index
+     * (one entry per distinct literal, since the assembler
+     * shares an entry among the uses of a literal)
+     */
+    int *constant_renumber_map = malloc((m->n_constants + 1) * sizeof(int));
+    int n_consts = remap_constants(constant_renumber_map, m);
 
     // Mapping imported classes was here; moving AFTER we
     // create and index this class so that it can reference itself
 
     // Create and initialize a class object
     // push_log_level(DEBUG);
-    char *class_name = cJSON_GetStringValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "class_name"));
-    char *super_name = cJSON_GetStringValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "super"));
+    char *class_name = m->class_name;
+    char *super_name = m->super_name;
     log_info("Class %s extends %s", class_name, super_name);
-    // Counts of methods and fields; I'm letting the assembler do the work here.
-    int n_fields = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_fields"));
-    int n_methods = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_methods"));
+    int n_fields = m->n_fields;
+    int n_methods = m->n_methods;
     log_info("Class %s has %d methods and %d fields",
              class_name, n_methods, n_fields);
     size_t class_obj_size =
@@ -268,8 +853,7 @@ static int load_json(char buf[]) {
     log_debug("Size of object header alone is %d bytes\n",
              sizeof(struct obj_header_struct));
     // Copy inherited method pointers into vtable
-    int n_inherited = (int) cJSON_GetNumberValue(
-            cJSON_GetObjectItemCaseSensitive(tree, "n_inherited"));
+    int n_inherited = m->n_inherited;
     for (int i = 0; i < n_inherited; ++i) {
         the_class->vtable[i] = the_super->vtable[i];
     }
@@ -282,112 +866,494 @@ static int load_json(char buf[]) {
     /* module class index -> class reference,
     * with potential side effect of loading more class files.
     */
-    class_ref class_map[30];
-    int n_classes = map_classes(class_map, tree, 30);
+    class_ref *class_map = malloc((m->n_imports + 1) * sizeof(class_ref));
+    int n_classes = map_classes(class_map, m);
 
+    /* module direct call index -> class and slot */
+    struct direct_call_target *direct_map =
+            malloc((m->n_direct_calls + 1) * sizeof(struct direct_call_target));
+    map_direct_calls(direct_map, class_map, m);
 
-    cJSON *code_table = cJSON_GetObjectItemCaseSensitive(tree, "code");
-    assert(code_table);  // Abort if it wasn't present
-    assert(cJSON_IsArray(code_table));  // Should be an array of methods
-    cJSON_ArrayForEach(el, code_table) {
-        char *method_name = cJSON_GetStringValue(
-                cJSON_GetObjectItemCaseSensitive(el, "name"));
-        int method_slot = (int) cJSON_GetNumberValue(
-                cJSON_GetObjectItemCaseSensitive(el, "slot"));
-        cJSON *ops = cJSON_GetObjectItemCaseSensitive(el, "code");
+    /* module tail call index + tail_call_base -> global tail call index */
+    int tail_call_base = map_tail_calls(class_map, m);
+
+    /* module typeswitch index + typeswitch_base -> global typeswitch index */
+    int typeswitch_base = map_typeswitches(class_map, m);
+
+    /* module jump table index + jump_table_base -> global jump table index */
+    int jump_table_base = map_jump_tables(m);
+
+    /* module for loop index + for_loop_base -> global for loop index */
+    int for_loop_base = map_for_loops(m);
+
+
+    for (int i=0; i < m->n_code; ++i) {
+        struct module_method *method = &m->code[i];
         vm_Word *method_start_addr =
-                translate_method_code(ops, constant_renumber_map, class_map);
-        the_class->vtable[method_slot] = method_start_addr;
+                translate_method_code(method, constant_renumber_map,
+                                      class_map, direct_map, tail_call_base,
+                                      typeswitch_base, jump_table_base,
+                                      for_loop_base);
+        the_class->vtable[method->slot] = method_start_addr;
+        method_lines(method, method_start_addr);
+        if (vm_profiling) {
+            profile_method(class_name, method, method_start_addr);
+        }
     }
-    cJSON_Delete(tree);
+    note_verified(m);
+    free(direct_map);
+    free(class_map);
+    free(constant_renumber_map);
     return 1;
 }
 
-vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[]) {
-    // Translating code.  Constants must be renumbered since local
-    // constant number is not global constant number.
-    assert (cJSON_IsArray(ops));
-    cJSON *el = ops->child;
+/* Translate the operand of an operation (instr), appending it
+ * to the code block.  Constants must be renumbered since local
+ * constant number is not global constant number, and so on.
+ */
+static void translate_operand(vm_Instr instr, int operand,
+                              int const_map[], class_ref class_map[],
+                              struct direct_call_target direct_map[],
+                              int tail_call_base, int typeswitch_base,
+                              int jump_table_base, int for_loop_base) {
+    log_debug("[%d] Operand: %d",
+              vm_current_address() - vm_code_block,
+              operand);
+    if (instr == vm_op_const) {
+        int const_index;
+        if (operand == CODE_FALSE) {
+            const_index = lookup_const_index("$false");
+        } else if (operand == CODE_TRUE) {
+            const_index = lookup_const_index("$true");
+        } else if (operand == CODE_NOTHING) {
+            const_index = lookup_const_index("$nothing");
+        } else {
+            assert(operand >= 0);
+            const_index = const_map[operand];
+        }
+        assert(const_index);
+        check_health_object(get_const_value(const_index));
+        vm_code_block[vm_code_index++] = (vm_Word)
+                {.intval=  const_index};
+    } else if (instr == vm_op_new || instr == vm_op_is_instance) {
+        class_ref clazz = class_map[operand];
+        log_debug("Translating allocation of new '%s'",
+                  clazz->header.class_name);
+        vm_code_block[vm_code_index++] = (vm_Word)
+                {.clazz = clazz};
+    } else if (instr == vm_op_call_direct) {
+        // Address is patched in when loading is finished
+        *new_direct_call_patch() =
+                (struct direct_call_patch) {
+                    .site = vm_current_address(),
+                    .clazz = direct_map[operand].clazz,
+                    .slot = direct_map[operand].slot
+                };
+        vm_code_block[vm_code_index++] = (vm_Word)
+                {.intval = operand};
+    } else if (instr == vm_op_tailcall || instr == vm_op_tailcall_direct) {
+        vm_code_block[vm_code_index++] = (vm_Word)
+                {.intval = tail_call_base + operand};
+    } else if (instr == vm_op_typeswitch) {
+        vm_code_block[vm_code_index++] = (vm_Word)
+                {.intval = typeswitch_base + operand};
+    } else if (instr == vm_op_jump_table) {
+        vm_code_block[vm_code_index++] = (vm_Word)
+                {.intval = jump_table_base + operand};
+    } else if (instr == vm_op_for_next) {
+        vm_code_block[vm_code_index++] = (vm_Word)
+                {.intval = for_loop_base + operand};
+    } else if (instr == vm_op_push_int) {
+        // Stored already tagged, ready to be pushed as it is
+        vm_code_block[vm_code_index++] = VM_RAW_INT(operand);
+    } else {
+        vm_code_block[vm_code_index++] = (vm_Word)
+                {.intval = operand};
+    }
+}
+
+vm_Word *translate_method_code(struct module_method *method,
+                               int const_map[], class_ref class_map[],
+                               struct direct_call_target direct_map[],
+                               int tail_call_base, int typeswitch_base,
+                               int jump_table_base, int for_loop_base) {
+    int32_t *word = method->words;
+    int32_t *end = method->words + method->n_words;
     vm_Word *method_start_address = vm_current_address();
-    while (el) {
-        assert(cJSON_IsNumber(el));
-        int opcode = el->valueint;
+    assert(vm_code_index + method->n_words <= CODE_CAPACITY);
+    while (word < end) {
+        int opcode = *word++;
+        op_tbl_entry *op = &vm_op_bytecodes[opcode];
         log_debug("[%d] Op: %d (%s)",
                vm_current_address() - vm_code_block,
-               opcode, vm_op_bytecodes[opcode].name);
-        vm_code_block[vm_code_index++] = (vm_Word)
-                {.instr = vm_op_bytecodes[opcode].instr};
-
-        if (vm_op_bytecodes[opcode].n_operands) {
-            // Max is 1 operand!
-            el = el->next;
-            int operand = el->valueint;
-            log_debug("[%d] Operand: %d",
-                      vm_current_address() - vm_code_block,
-                      operand);
-            if (vm_op_bytecodes[opcode].instr == vm_op_const) {
-                int const_index;
-                if (operand == CODE_FALSE) {
-                    const_index = lookup_const_index("$false");
-                } else if (operand == CODE_TRUE) {
-                    const_index = lookup_const_index("$true");
-                } else if (operand == CODE_NOTHING) {
-                    const_index = lookup_const_index("$nothing");
-                } else {
-                    assert(operand >= 0);
-                    const_index = const_map[operand];
+               opcode, op->name);
+        vm_code_block[vm_code_index++] = (vm_Word) {.instr = op->instr};
+        assert(word + op->n_operands <= end);
+        if (op->parts) {
+            // A superinstruction's operands are those of its
+            // operations, in order, each translated as theirs
+            for (int *part = op->parts; *part >= 0; ++part) {
+                if (vm_op_bytecodes[*part].n_operands) {
+                    translate_operand(vm_op_bytecodes[*part].instr, *word++,
+                                      const_map, class_map, direct_map,
+                                      tail_call_base, typeswitch_base,
+                                      jump_table_base, for_loop_base);
                 }
-                assert(const_index);
-                check_health_object(get_const_value(const_index));
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.intval=  const_index};
-            } else if(vm_op_bytecodes[opcode].instr == vm_op_new
-                      || vm_op_bytecodes[opcode].instr == vm_op_is_instance) {
-                class_ref clazz = class_map[operand];
-                log_debug("Translating allocation of new '%s'",
-                          clazz->header.class_name);
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.clazz = clazz};
-            } else {
-                vm_code_block[vm_code_index++] = (vm_Word)
-                        {.intval = operand};
             }
+        } else if (op->n_operands) {
+            // Max is 1 operand!
+            translate_operand(op->instr, *word++,
+                              const_map, class_map, direct_map,
+                              tail_call_base, typeswitch_base,
+                              jump_table_base, for_loop_base);
         }
-        el = el->next;
     }
     return method_start_address;
 }
 
 
 
-/* Load an "object" file (json format) from
- * a class name.
+/* Load a JSON object file, which is read whole
+ * (whatever its size) and parsed once
+ */
+static int load_json_file(char *path) {
+    FILE *fd = fopen(path, "rb");
+    if (! fd) {
+        perror("Failed to open file");
+        return 0;
+    }
+    fseek(fd, 0, SEEK_END);
+    long size = ftell(fd);
+    rewind(fd);
+    char *buf = malloc(size + 1);
+    size_t n_read = fread(buf, 1, size, fd);
+    fclose(fd);
+    buf[n_read] = 0;
+    cJSON *tree = cJSON_Parse(buf);  // Must free at end
+    free(buf);
+    if (tree == NULL) {
+        perror("load_json_file in vm_loader.c: Failed to parse file. ");
+        assert(tree);  // Will definitely abort
+    }
+    struct module m;
+    module_from_json(tree, &m);
+    int ok = link_module(&m);
+    free_module(&m);
+    cJSON_Delete(tree);
+    return ok;
+}
+
+/* Load a binary (.qbc) object file, which is mapped
+ * into memory and read where it is
+ */
+static int load_qbc_file(char *path) {
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) {
+        perror("Failed to open file");
+        return 0;
+    }
+    struct stat info;
+    if (fstat(fd, &info) < 0) {
+        perror("Failed to read file size");
+        close(fd);
+        return 0;
+    }
+    size_t size = info.st_size;
+    char *base = mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (base == MAP_FAILED) {
+        perror("Failed to map file");
+        return 0;
+    }
+    struct module m;
+    int ok = module_from_qbc(base, size, &m);
+    if (ok) {
+        ok = link_module(&m);
+        free_module(&m);
+    }
+    munmap(base, size);
+    return ok;
+}
+
+/* Check whether a path names a binary object file */
+static int is_qbc_path(char *path) {
+    size_t len = strlen(path);
+    return len >= 4 && strcmp(path + len - 4, ".qbc") == 0;
+}
+
+/* Load an "object" file from a class name.  The binary
+ * form is used if there is one, unless the JSON file
+ * was written after it.
  */
 #define PATHBUFSIZE 4096
 extern int vm_load_class(char *classname) {
     char load_path[PATHBUFSIZE];
+    char qbc_path[PATHBUFSIZE];
     // Use printf for multi-concat
     snprintf(load_path, PATHBUFSIZE, "%s/%s.json", PATH_PREFIX, classname);
+    snprintf(qbc_path, PATHBUFSIZE, "%s/%s.qbc", PATH_PREFIX, classname);
+    struct stat json_info, qbc_info;
+    if (stat(qbc_path, &qbc_info) == 0
+        && (stat(load_path, &json_info) != 0
+            || json_info.st_mtime <= qbc_info.st_mtime)) {
+        log_info("Loading %s", qbc_path);
+        return vm_load_from_path(qbc_path);
+    }
     log_info("Loading %s", load_path);
     return vm_load_from_path(load_path);
 }
 
 
 int vm_load_from_path(char *path) {
-    char file_buffer[FILE_BUFFER_CAPACITY];
-    FILE *fd = fopen(path, "r");
-    if (! fd) {
-        perror("Failed to open file");
-        return 0;
+    if (is_qbc_path(path)) {
+        return load_qbc_file(path);
     }
-    int ok;
-    ok = read_file_fd(fd, file_buffer);
-    if (ok) {
-        cJSON *jobj = cJSON_Parse(file_buffer);
-        ok = (jobj != NULL);
+    return load_json_file(path);
+}
+
+
+/* ------------- Linked program images (see link.py) ------------- */
+
+/* Header words; must match link.py */
+#define IMAGE_MAGIC 0x474d4951  // "QIMG" read as a little-endian word
+#define IMAGE_VERSION 3
+#define IMAGE_INHERITED (-1)    // Vtable entry copied from the superclass
+#define IMAGE_MISSING (-2)      // Vtable entry with no method
+
+/* The constants of an image, in the order the loader would
+ * have created them, so they get the same indexes
+ */
+static void image_constants(struct qbc_reader *r) {
+    int first = qbc_word(r);
+    int n = qbc_word(r);
+    for (int i=0; i < n; ++i) {
+        char kind = (char) qbc_word(r);
+        char *literal = qbc_string(r);
+        obj_ref value;
+        if (kind == 'i') {
+            value = new_int(atoi(literal));
+        } else {
+            assert(kind == 's');
+            value = new_string(strdup(literal));
+        }
+        int index = create_const_value(literal, value);
+        assert(index == first + i);
+    }
+}
+
+/* The class table of an image: the builtin classes, which
+ * are already loaded, then the program's classes, each
+ * after its superclass.  Like classes loaded one by one,
+ * they are numbered in vm_loader_set_main.
+ */
+static class_ref *image_classes(struct qbc_reader *r) {
+    int n_builtins = qbc_word(r);
+    assert(n_builtins == n_classes_loaded);
+    class_ref *classes = malloc(MAX_CLASSES * sizeof(class_ref));
+    for (int i=0; i < n_builtins; ++i) {
+        classes[i] = find_loaded(qbc_string(r));
+        assert(classes[i]);
+    }
+    int n_classes = qbc_word(r);
+    assert(n_builtins + n_classes < MAX_CLASSES);
+    for (int i=n_builtins; i < n_builtins + n_classes; ++i) {
+        char *class_name = qbc_string(r);
+        class_ref the_super = classes[qbc_word(r)];
+        int n_fields = qbc_word(r);
+        int n_methods = qbc_word(r);
+        class_ref the_class = (class_ref) malloc(
+                sizeof(struct class_header_struct)
+                + n_methods * sizeof(vm_Word));
+        the_class->header = (struct class_header_struct) {
+                .class_name = strdup(class_name),
+                .healthy_class_tag = HEALTHY,
+                .n_fields = n_fields,
+                .object_size = sizeof(struct obj_header_struct)
+                               + n_fields * sizeof(vm_Word),
+                .super = the_super
+        };
+        for (int slot=0; slot < n_methods; ++slot) {
+            int entry = qbc_word(r);
+            if (entry == IMAGE_INHERITED) {
+                the_class->vtable[slot] = the_super->vtable[slot];
+            } else if (entry == IMAGE_MISSING) {
+                the_class->vtable[slot] = NULL;
+            } else {
+                the_class->vtable[slot] = &vm_code_block[entry];
+            }
+        }
+        classes[i] = the_class;
+        loaded_classes[n_classes_loaded++] = the_class;
+    }
+    return classes;
+}
+
+/* The code of an image.  Operands already hold global
+ * indexes, except that classes are indexes in the image's
+ * class table and direct call addresses are patched in later.
+ */
+static void image_operand(vm_Instr instr, int operand, class_ref classes[]) {
+    if (instr == vm_op_new || instr == vm_op_is_instance) {
+        vm_code_block[vm_code_index++] = (vm_Word) {.clazz = classes[operand]};
+    } else if (instr == vm_op_push_int) {
+        vm_code_block[vm_code_index++] = VM_RAW_INT(operand);
+    } else {
+        vm_code_block[vm_code_index++] = (vm_Word) {.intval = operand};
+    }
+}
+
+static void image_code(struct qbc_reader *r, class_ref classes[]) {
+    vm_code_index = qbc_word(r);
+    int n_words = qbc_word(r);
+    assert(vm_code_index + n_words <= CODE_CAPACITY);
+    int32_t *word = r->word;
+    int32_t *end = r->word + n_words;
+    while (word < end) {
+        op_tbl_entry *op = &vm_op_bytecodes[*word++];
+        vm_code_block[vm_code_index++] = (vm_Word) {.instr = op->instr};
+        if (op->parts) {
+            for (int *part = op->parts; *part >= 0; ++part) {
+                if (vm_op_bytecodes[*part].n_operands) {
+                    image_operand(vm_op_bytecodes[*part].instr, *word++,
+                                  classes);
+                }
+            }
+        } else if (op->n_operands) {
+            image_operand(op->instr, *word++, classes);
+        }
+    }
+    r->word = end;
+}
+
+/* The global tables of an image, added as they are */
+static void image_tables(struct qbc_reader *r, class_ref classes[]) {
+    int i, n;
+    n = qbc_word(r);
+    for (i=0; i < n; ++i) {
+        struct direct_call_patch *patch = new_direct_call_patch();
+        patch->site = &vm_code_block[qbc_word(r)];
+        patch->clazz = classes[qbc_word(r)];
+        patch->slot = qbc_word(r);
+    }
+    n = qbc_word(r);
+    assert(vm_n_tail_calls + n <= VM_TAIL_CALL_CAPACITY);
+    for (i=0; i < n; ++i) {
+        struct vm_tail_call *call = &vm_tail_calls[vm_n_tail_calls++];
+        call->slot = qbc_word(r);
+        call->n_args = qbc_word(r);
+        call->n_locals = qbc_word(r);
+        int class_index = qbc_word(r);
+        if (class_index >= 0) {
+            *new_direct_call_patch() =
+                    (struct direct_call_patch) {
+                        .site = &call->target,
+                        .clazz = classes[class_index],
+                        .slot = call->slot
+                    };
+        }
+    }
+    n = qbc_word(r);
+    assert(vm_n_typeswitches + n <= VM_TYPESWITCH_CAPACITY);
+    for (i=0; i < n; ++i) {
+        struct vm_typeswitch *ts = &vm_typeswitches[vm_n_typeswitches++];
+        ts->n_classes = qbc_word(r);
+        ts->classes = malloc(ts->n_classes * sizeof(class_ref));
+        for (int j=0; j < ts->n_classes; ++j) {
+            ts->classes[j] = classes[qbc_word(r)];
+        }
+    }
+    n = qbc_word(r);
+    assert(vm_n_jump_tables + n <= VM_JUMP_TABLE_CAPACITY);
+    for (i=0; i < n; ++i) {
+        struct vm_jump_table *table = &vm_jump_tables[vm_n_jump_tables++];
+        table->n_values = qbc_word(r);
+        assert(table->n_values > 0);
+        table->values = malloc(table->n_values * sizeof(int));
+        for (int j=0; j < table->n_values; ++j) {
+            table->values[j] = qbc_word(r);
+        }
+        table->dense = table->values[table->n_values - 1]
+                       - table->values[0] == table->n_values - 1;
+    }
+    n = qbc_word(r);
+    assert(vm_n_for_loops + n <= VM_FOR_LOOP_CAPACITY);
+    for (i=0; i < n; ++i) {
+        struct vm_for_loop *loop = &vm_for_loops[vm_n_for_loops++];
+        loop->counter = qbc_word(r);
+        loop->end = qbc_word(r);
+        loop->const_end = qbc_word(r);
+        loop->step = qbc_word(r);
     }
-    assert(ok);
-    ok = load_json(file_buffer);
+}
+
+/* Methods and sites to profile, if profiling, and lines of
+ * source (always)
+ */
+static void image_profile(struct qbc_reader *r) {
+    int i, n;
+    n = qbc_word(r);
+    for (i=0; i < n; ++i) {
+        char *class_name = qbc_string(r);
+        char *method_name = qbc_string(r);
+        vm_addr start = &vm_code_block[qbc_word(r)];
+        vm_addr end = &vm_code_block[qbc_word(r)];
+        if (vm_profiling) {
+            vm_profile_method(class_name, method_name, start, end);
+        }
+    }
+    n = qbc_word(r);
+    for (i=0; i < n; ++i) {
+        vm_addr site_addr = &vm_code_block[qbc_word(r)];
+        char *site = qbc_string(r);
+        if (vm_profiling) {
+            vm_profile_site(site_addr, site);
+        }
+    }
+    n = qbc_word(r);
+    for (i=0; i < n; ++i) {
+        vm_addr line_addr = &vm_code_block[qbc_word(r)];
+        vm_profile_line(line_addr, qbc_word(r));
+    }
+}
+
+/* Load a program image written by link.py, in place of
+ * loading its classes one by one.  The file is read with one
+ * read, and nothing in it needs looking up by name.
+ */
+char *vm_load_image(char *path) {
+    FILE *fd = fopen(path, "rb");
+    if (! fd) {
+        perror("Failed to open program image");
+        return NULL;
+    }
+    fseek(fd, 0, SEEK_END);
+    long size = ftell(fd);
+    rewind(fd);
+    char *buf = malloc(size);
+    size_t n_read = fread(buf, 1, size, fd);
     fclose(fd);
-    return ok;
+    struct qbc_reader r;
+    if (n_read != (size_t) size
+        || ! qbc_open(buf, n_read, IMAGE_MAGIC, IMAGE_VERSION,
+                      "program image", &r)) {
+        free(buf);
+        return NULL;
+    }
+    int main_index = qbc_word(&r);
+    vm_verified = qbc_word(&r);
+    if (vm_verified) {
+        vm_frame_bound = qbc_word(&r);
+    } else {
+        qbc_word(&r);
+    }
+    image_constants(&r);
+    class_ref *classes = image_classes(&r);
+    image_code(&r, classes);
+    image_tables(&r, classes);
+    image_profile(&r);
+    char *main_class = classes[main_index]->header.class_name;
+    vm_loader_set_main(main_class);
+    free(classes);
+    free(buf);
+    return main_class;
 }
@@ -24,16 +24,26 @@ void vm_loader_set_main(char *main_class_name);
  */
 extern class_ref find_loaded(char *name);
 
-/* Load an "object" file (json format) from
- * a class name.
+/* Load an "object" file from a class name: Class.qbc
+ * (binary format) or, if there is none or it is older,
+ * Class.json.
  */
 extern int vm_load_class(char *classname);
 
-/* Load an "object" file, which should be in JSON format.
+/* Load an "object" file, in binary format if the path
+ * ends in .qbc and otherwise in JSON format.
  * Return 1 = success, 0 = failure.
  */
 extern int vm_load_from_path(char *path);
 
+/* Load a program image written by link.py, which holds
+ * every class of a program already linked, and make its
+ * last class the main class.  Use instead of loading
+ * classes, after vm_loader_init.
+ * Returns the name of the main class, or NULL on failure.
+ */
+extern char *vm_load_image(char *path);
+
 /* Constants in method bytecode will be small non-negative
  * integers corresponding to the "constants" list in the
  * object code json, or chosen from this fixed set of
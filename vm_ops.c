@@ -4,9 +4,11 @@
  */
 #include "vm_ops.h"
 #include "vm_state.h"
+#include "vm_profile.h"
 #include "builtins.h"  // For literals lit_true, lit_false, nothing
 #include "logger.h"
 #include <stdlib.h>
+#include <string.h>
 #include <stdio.h>
 #include <assert.h>
 
@@ -41,14 +43,22 @@ extern void vm_op_jump() {
     vm_relative_jump(span);
 }
 
+/* Finish a conditional jump whose span was just fetched,
+ * counting whether it was taken if profiling.
+ */
+static void cond_jump(int span, int taken) {
+    VM_PROFILE_EVENT(taken ? 0 : 1);
+    if (taken) {
+        vm_relative_jump(span);
+    }
+}
+
 /* Jump if true */
 extern void vm_op_jump_if() {
     int span = vm_fetch_next().intval;
     obj_ref cond = vm_frame_pop_word().obj;
     assert_is_type(cond, the_class_Boolean);
-    if (cond == lit_true) {
-        vm_relative_jump(span);
-    }
+    cond_jump(span, cond == lit_true);
 };
 
 /* Jump if false */
@@ -56,9 +66,7 @@ extern void vm_op_jump_ifnot() {
     int span = vm_fetch_next().intval;
     obj_ref cond = vm_frame_pop_word().obj;
     assert_is_type(cond, the_class_Boolean);
-    if (cond == lit_false) {
-        vm_relative_jump(span);
-    }
+    cond_jump(span, cond == lit_false);
 }
 
 /* ========  Linkage instructions =========== */
@@ -70,6 +78,8 @@ extern void vm_op_jump_ifnot() {
  */
 extern void vm_op_methodcall(void) {
     int method_index = vm_fetch_next().intval;
+    VM_PROFILE_EVENT(0);
+    vm_frame_preflight();
     // New "this" will be receiver object
     vm_addr new_fp = vm_sp;
     // Save program counter for return
@@ -88,6 +98,77 @@ extern void vm_op_methodcall(void) {
     return;
 }
 
+/* Call a method whose address was resolved when the
+ * program was linked, because no subclass of the receiver's
+ * static class overrides it.  The frame is set up exactly
+ * as for vm_op_methodcall, but the receiver's class and
+ * vtable are never consulted.
+ *
+ * vm_op_call_direct(method_addr): [arg, arg, ..., receiver] -> [result]
+ */
+extern void vm_op_call_direct(void) {
+    vm_addr method_addr = vm_fetch_next().code_addr;
+    VM_PROFILE_EVENT(0);
+    vm_frame_preflight();
+    // New "this" will be receiver object
+    vm_addr new_fp = vm_sp;
+    // Save program counter for return
+    vm_frame_push_word((vm_Word) {.code_addr = vm_pc});
+    // Save caller's frame pointer
+    vm_frame_push_word((vm_Word) {.frame_addr = vm_fp});
+    vm_fp = new_fp;
+    vm_pc = method_addr;
+    return;
+}
+
+struct vm_tail_call vm_tail_calls[VM_TAIL_CALL_CAPACITY];
+int vm_n_tail_calls = 0;
+
+/* Replace the current frame with one for the call whose
+ * arguments and receiver are on top of the stack, and
+ * return the new frame pointer.
+ *
+ * Before: [old args] old_fp:[receiver pc fp locals] [new args receiver]
+ * After:  [new args] new_fp:[receiver pc fp]
+ */
+static vm_addr tail_frame(struct vm_tail_call *call) {
+    // With a statement's worth of stack, only the new call's
+    // arguments and receiver sit above the locals
+    vm_addr from = vm_fp + 3 + call->n_locals;
+    vm_addr to = vm_fp - call->n_args;
+    int n_words = vm_sp - from + 1;
+    vm_Word saved_pc = vm_fp[1];
+    vm_Word saved_fp = vm_fp[2];
+    memmove(to, from, n_words * sizeof(vm_Word));
+    vm_addr new_fp = to + n_words - 1;
+    new_fp[1] = saved_pc;
+    new_fp[2] = saved_fp;
+    vm_sp = new_fp + 2;
+    // The new frame may start above the old one
+    vm_frame_preflight();
+    return new_fp;
+}
+
+extern void vm_op_tailcall(void) {
+    struct vm_tail_call *call = &vm_tail_calls[vm_fetch_next().intval];
+    VM_PROFILE_EVENT(0);
+    vm_fp = tail_frame(call);
+    obj_ref receiver = (*vm_fp).obj;
+    check_health_object(receiver);
+    class_ref clazz = receiver->header.clazz;
+    check_health_class(clazz);
+    vm_pc = clazz->vtable[call->slot];
+    return;
+}
+
+extern void vm_op_tailcall_direct(void) {
+    struct vm_tail_call *call = &vm_tail_calls[vm_fetch_next().intval];
+    VM_PROFILE_EVENT(0);
+    vm_fp = tail_frame(call);
+    vm_pc = call->target.code_addr;
+    return;
+}
+
 /* Trampoline to a native method.
  * Wrap this inside an interpreted method
  * to handle the frame layout properly.
@@ -115,7 +196,10 @@ extern void vm_op_call_native(void) {
 
 
 extern void vm_op_enter() {
-    // Currently does nothing
+    // Counts calls of the method, if profiling
+    if (vm_profiling) {
+        vm_profile_count(vm_pc - 1, 0);
+    }
     log_debug("Function entered\n");
     stack_dump(10);
 }
@@ -172,28 +256,21 @@ extern void vm_op_new(void) {
     return;
 }
 
-/* is_instance is the other op that takes a class as operand
- * FIXME:  Refactor to reduce duplication with assert_is_type
- *
+/* is_instance is the other op that takes a class as operand.
+ * Like assert_is_type, it compares class numbers rather than
+ * walking up the superclass chain.
  */
 
 int is_instance(obj_ref thing, class_ref clazz) {
     if (thing->header.tag != GOOD_OBJ_TAG) {
         fprintf(stderr, "Type check failure: %p is Not on object!\n", thing);
+        vm_report_position();
         assert(0);
     }
     assert(clazz->header.healthy_class_tag == HEALTHY);
     class_ref thing_class = thing->header.clazz;
-    while (1) {
-        if (thing_class == clazz) {
-            return 1; // True, is an instance
-        }
-        if (thing_class == the_class_Obj) {
-            return 0;  // Not an instance
-        }
-        thing_class = thing_class->header.super;
-        assert(thing_class->header.healthy_class_tag == HEALTHY);
-    }
+    assert(thing_class->header.healthy_class_tag == HEALTHY);
+    return is_subclass_of(thing_class, clazz);
  }
 
 extern void vm_op_is_instance(void) {
@@ -206,6 +283,27 @@ extern void vm_op_is_instance(void) {
     }
 }
 
+struct vm_typeswitch vm_typeswitches[VM_TYPESWITCH_CAPACITY];
+int vm_n_typeswitches = 0;
+
+extern void vm_op_typeswitch(void) {
+    struct vm_typeswitch *ts = &vm_typeswitches[vm_fetch_next().intval];
+    obj_ref thing = vm_frame_pop_word().obj;
+    check_health_object(thing);
+    class_ref thing_class = thing->header.clazz;
+    int alt = 0;
+    while (alt < ts->n_classes
+           && !is_subclass_of(thing_class, ts->classes[alt])) {
+        ++alt;
+    }
+    VM_PROFILE_EVENT(alt);
+    // Each jump is an opcode and a span relative to the word after it
+    vm_addr jump = vm_pc + 2 * alt;
+    log_debug("Typeswitch on %s takes alternative %d",
+              thing_class->header.class_name, alt);
+    vm_pc = jump + 2 + jump[1].intval;
+}
+
 
 /*
  * Stack and local variable manipulation
@@ -307,3 +405,282 @@ extern void vm_op_store_field() {
     target_obj->fields[field_slot] = value;
     // pop_log_level();
 }
+
+/* Int operations on the operand stack.  Operands are
+ * checked in debug builds only; the compiler guarantees
+ * their type.  Each operand may be an Int object or an
+ * unboxed Int (see VM_RAW_INT); the result is boxed.
+ */
+static int word_int(vm_Word word) {
+    if (VM_IS_RAW_INT(word)) {
+        return VM_RAW_VALUE(word);
+    }
+    obj_ref thing = word.obj;
+    check_health_object(thing);
+    assert(thing->header.clazz == the_class_Int);
+    return ((obj_Int) thing)->value;
+}
+
+static int pop_int() {
+    return word_int(vm_frame_pop_word());
+}
+
+static void push_int(int n) {
+    vm_frame_push_word((vm_Word) {.obj = new_int(n)});
+}
+
+static void push_bool(int b) {
+    vm_frame_push_word((vm_Word) {.obj = b ? lit_true : lit_false});
+}
+
+extern void vm_op_iadd() {
+    int right = pop_int();
+    int left = pop_int();
+    push_int(left + right);
+}
+
+extern void vm_op_isub() {
+    int right = pop_int();
+    int left = pop_int();
+    push_int(left - right);
+}
+
+extern void vm_op_imul() {
+    int right = pop_int();
+    int left = pop_int();
+    push_int(left * right);
+}
+
+extern void vm_op_idiv() {
+    int right = pop_int();
+    int left = pop_int();
+    push_int(left / right);
+}
+
+extern void vm_op_imod() {
+    int right = pop_int();
+    int left = pop_int();
+    push_int(left % right);
+}
+
+extern void vm_op_ineg() {
+    push_int(-pop_int());
+}
+
+extern void vm_op_ilt() {
+    int right = pop_int();
+    int left = pop_int();
+    push_bool(left < right);
+}
+
+extern void vm_op_ile() {
+    int right = pop_int();
+    int left = pop_int();
+    push_bool(left <= right);
+}
+
+extern void vm_op_igt() {
+    int right = pop_int();
+    int left = pop_int();
+    push_bool(left > right);
+}
+
+extern void vm_op_ige() {
+    int right = pop_int();
+    int left = pop_int();
+    push_bool(left >= right);
+}
+
+extern void vm_op_ieq() {
+    int right = pop_int();
+    int left = pop_int();
+    push_bool(left == right);
+}
+
+struct vm_jump_table vm_jump_tables[VM_JUMP_TABLE_CAPACITY];
+int vm_n_jump_tables = 0;
+
+extern void vm_op_jump_table(void) {
+    struct vm_jump_table *table = &vm_jump_tables[vm_fetch_next().intval];
+    int value = pop_int();
+    // Any value not in the table takes the last jump
+    int alt = table->n_values;
+    if (table->dense) {
+        int offset = value - table->values[0];
+        if (0 <= offset && offset < table->n_values) {
+            alt = offset;
+        }
+    } else {
+        int low = 0, high = table->n_values - 1;
+        while (low <= high) {
+            int mid = (low + high) / 2;
+            if (table->values[mid] < value) {
+                low = mid + 1;
+            } else if (table->values[mid] > value) {
+                high = mid - 1;
+            } else {
+                alt = mid;
+                break;
+            }
+        }
+    }
+    VM_PROFILE_EVENT(alt);
+    // Each jump is an opcode and a span relative to the word after it
+    vm_addr jump = vm_pc + 2 * alt;
+    vm_pc = jump + 2 + jump[1].intval;
+}
+
+/* Fused Int compare and branch */
+
+extern void vm_op_jump_ilt() {
+    int span = vm_fetch_next().intval;
+    int right = pop_int();
+    int left = pop_int();
+    cond_jump(span, left < right);
+}
+
+extern void vm_op_jump_ile() {
+    int span = vm_fetch_next().intval;
+    int right = pop_int();
+    int left = pop_int();
+    cond_jump(span, left <= right);
+}
+
+extern void vm_op_jump_igt() {
+    int span = vm_fetch_next().intval;
+    int right = pop_int();
+    int left = pop_int();
+    cond_jump(span, left > right);
+}
+
+extern void vm_op_jump_ige() {
+    int span = vm_fetch_next().intval;
+    int right = pop_int();
+    int left = pop_int();
+    cond_jump(span, left >= right);
+}
+
+extern void vm_op_jump_ieq() {
+    int span = vm_fetch_next().intval;
+    int right = pop_int();
+    int left = pop_int();
+    cond_jump(span, left == right);
+}
+
+extern void vm_op_jump_ine() {
+    int span = vm_fetch_next().intval;
+    int right = pop_int();
+    int left = pop_int();
+    cond_jump(span, left != right);
+}
+
+/* Unboxed Ints.  Locals the compiler has typed Int may be
+ * kept unboxed in their frame slots, and arithmetic on them
+ * done without allocating an Int object for each result.
+ * These words are never health checked as objects.
+ */
+
+static void push_raw(int n) {
+    vm_frame_push_word(VM_RAW_INT(n));
+}
+
+/* Push an unboxed local variable
+ * [] -> [n]
+ */
+extern void vm_op_load_int() {
+    int variable_frame_index = vm_fetch_next().intval;
+    vm_Word value = *(vm_fp + variable_frame_index);
+    assert(VM_IS_RAW_INT(value));
+    vm_frame_push_word(value);
+}
+
+/* Pop an unboxed Int into a local variable
+ * [n] -> []
+ */
+extern void vm_op_store_int() {
+    int variable_frame_index = vm_fetch_next().intval;
+    vm_Word value = vm_frame_pop_word();
+    assert(VM_IS_RAW_INT(value));
+    *(vm_fp + variable_frame_index) = value;
+}
+
+/* Push the operand as an unboxed Int; the loader
+ * has already tagged it.
+ * [] -> [n]
+ */
+extern void vm_op_push_int() {
+    vm_frame_push_word(vm_fetch_next());
+}
+
+/* [n] -> [Int n] */
+extern void vm_op_box() {
+    push_int(pop_int());
+}
+
+/* [Int n] -> [n] */
+extern void vm_op_unbox() {
+    push_raw(pop_int());
+}
+
+extern void vm_op_radd() {
+    int right = pop_int();
+    int left = pop_int();
+    push_raw(left + right);
+}
+
+extern void vm_op_rsub() {
+    int right = pop_int();
+    int left = pop_int();
+    push_raw(left - right);
+}
+
+extern void vm_op_rmul() {
+    int right = pop_int();
+    int left = pop_int();
+    push_raw(left * right);
+}
+
+extern void vm_op_rdiv() {
+    int right = pop_int();
+    int left = pop_int();
+    push_raw(left / right);
+}
+
+extern void vm_op_rmod() {
+    int right = pop_int();
+    int left = pop_int();
+    push_raw(left % right);
+}
+
+extern void vm_op_rneg() {
+    push_raw(-pop_int());
+}
+
+/* Counted loops */
+
+struct vm_for_loop vm_for_loops[VM_FOR_LOOP_CAPACITY];
+int vm_n_for_loops = 0;
+
+extern void vm_op_for_next(void) {
+    struct vm_for_loop *loop = &vm_for_loops[vm_fetch_next().intval];
+    vm_Word *counter = vm_fp + loop->counter;
+    // Counted past INT_MAX (or INT_MIN), the range is done, although
+    // the counter wraps around as any Int sum does
+    long long next = (long long) word_int(*counter) + loop->step;
+    int value = (int) next;
+    // The counter keeps its representation, boxed or not
+    if (VM_IS_RAW_INT(*counter)) {
+        *counter = VM_RAW_INT(value);
+    } else {
+        *counter = (vm_Word) {.obj = new_int(value)};
+    }
+    int end = loop->const_end ? loop->end : word_int(*(vm_fp + loop->end));
+    int more = loop->step > 0 ? next < end : next > end;
+    // The jump after this one is an opcode and a span relative
+    // to the word after it; leaving the loop steps over it
+    if (more) {
+        vm_pc = vm_pc + 2 + vm_pc[1].intval;
+    } else {
+        vm_pc = vm_pc + 2;
+    }
+}
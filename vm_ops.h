@@ -25,6 +25,49 @@ extern void vm_op_halt(void);
  */
 extern void vm_op_methodcall(void);
 
+/* Call a method at an address resolved by the loader,
+ * without looking in the receiver's vtable.  Used when the
+ * compiler proves that only one method can be called.
+ * Next word is the method address.
+ *
+ * vm_op_call_direct(addr): [arg, arg, ...,  receiver] -> [result]
+ */
+extern void vm_op_call_direct(void);
+
+/* A tail call needs more than fits in one operand word:
+ * the method to call and the shape of the frame it replaces.
+ * The loader fills in a table of these, and the operand of
+ * a tail call is an index into the table.
+ */
+struct vm_tail_call {
+    vm_Word target;     // Method address, for direct tail calls
+    int slot;           // Vtable slot, for virtual tail calls
+    int n_args;         // Arguments of the calling method
+    int n_locals;       // Locals of the calling method
+};
+#define VM_TAIL_CALL_CAPACITY 1000
+extern struct vm_tail_call vm_tail_calls[VM_TAIL_CALL_CAPACITY];
+extern int vm_n_tail_calls;
+
+/* Call a method from the tail position of another method.
+ * The arguments and receiver of the new call are moved down
+ * over the arguments, receiver and locals of the current call,
+ * which keeps its return address and saved frame pointer, so
+ * the called method returns directly to our caller and deep
+ * tail recursion runs in constant stack space.
+ * Next word is an index into vm_tail_calls.
+ *
+ * vm_op_tailcall(index): [arg, arg, ...,  receiver] -> (no return)
+ */
+extern void vm_op_tailcall(void);
+
+/* As vm_op_tailcall, but to a method whose address was
+ * resolved by the loader rather than found in the vtable.
+ *
+ * vm_op_tailcall_direct(index): [arg, arg, ...,  receiver] -> (no return)
+ */
+extern void vm_op_tailcall_direct(void);
+
 /* Trampoline to a native method.
  * Wrap this inside an interpreted method
  * to handle the frame layout properly.
@@ -55,6 +98,78 @@ extern void vm_op_call_native(void);
  /* is_instance is the other op that takes a class as operand */
  extern void vm_op_is_instance(void);
 
+/* The classes a typeswitch tests, in order.  The loader
+ * fills in a table of these, and the operand of a typeswitch
+ * is an index into the table.
+ */
+struct vm_typeswitch {
+    int n_classes;
+    class_ref *classes;
+};
+#define VM_TYPESWITCH_CAPACITY 1000
+extern struct vm_typeswitch vm_typeswitches[VM_TYPESWITCH_CAPACITY];
+extern int vm_n_typeswitches;
+
+/* Dispatch on the class of an object, for typecase.
+ * The typeswitch is followed by one jump for each class it
+ * tests and one more for an object of none of them.  It finds
+ * the first class the object belongs to and goes directly to
+ * the target of the corresponding jump.
+ * Next word is an index into vm_typeswitches.
+ *
+ * vm_op_typeswitch(index): [obj] -> []
+ */
+extern void vm_op_typeswitch(void);
+
+/* The Int values a jump table tests, in increasing order.
+ * If they are consecutive the table is dense, and a value's
+ * position is found by subtraction; otherwise by binary search.
+ */
+struct vm_jump_table {
+    int n_values;
+    int *values;
+    int dense;
+};
+#define VM_JUMP_TABLE_CAPACITY 1000
+extern struct vm_jump_table vm_jump_tables[VM_JUMP_TABLE_CAPACITY];
+extern int vm_n_jump_tables;
+
+/* Dispatch on the value of an Int, for a chain of if/elif
+ * comparisons with Int literals.  Like a typeswitch, it is
+ * followed by one jump for each value in its table and one
+ * more for any other value, and goes directly to the target
+ * of the jump for the Int's position in the table.
+ * Next word is an index into vm_jump_tables.
+ *
+ * vm_op_jump_table(index): [n] -> []
+ */
+extern void vm_op_jump_table(void);
+
+/* A counted loop (for i in a..b step k): the frame slot
+ * of its counter, the frame slot of the end of its range
+ * or, if const is set, the end itself, and its step.
+ */
+struct vm_for_loop {
+    int counter;
+    int end;
+    int const_end;
+    int step;
+};
+#define VM_FOR_LOOP_CAPACITY 1000
+extern struct vm_for_loop vm_for_loops[VM_FOR_LOOP_CAPACITY];
+extern int vm_n_for_loops;
+
+/* Add the step to the counter of a loop and, if it has not
+ * reached the end of the range, go back to the top of the
+ * loop.  It is followed by a jump to the top of the loop,
+ * which (as with a jump table) is never executed; the loop
+ * is left by skipping it.  Either form of Int is counted.
+ * Next word is an index into vm_for_loops.
+ *
+ * vm_op_for_next(index): [] -> []
+ */
+extern void vm_op_for_next(void);
+
 
  /* The interpreter may also create an object from within a
   * built-in method, without executing a VM instruction.
@@ -75,6 +190,18 @@ extern void vm_op_call_native(void);
  extern void vm_op_jump_if();       // conditional jump
  extern void vm_op_jump_ifnot();    // conditional jump
 
+/* Compare two Ints and jump on the result, without creating
+ * a Bool.  The compiler emits these for branches on Int
+ * comparisons.  Next word is the relative jump.
+ *  [a b] -> []
+ */
+ extern void vm_op_jump_ilt();      // jump if a < b
+ extern void vm_op_jump_ile();      // jump if a <= b
+ extern void vm_op_jump_igt();      // jump if a > b
+ extern void vm_op_jump_ige();      // jump if a >= b
+ extern void vm_op_jump_ieq();      // jump if a == b
+ extern void vm_op_jump_ine();      // jump if a != b
+
 /*
  * The vm calling convention pushes and
  * pops whole activation records.
@@ -107,5 +234,48 @@ extern void vm_op_load_field();  // Load from field of object
 // store_field n: [value target] -> [], target.fields[n] = value
 extern void vm_op_store_field(); // Store into field of object
 
+/* Int arithmetic and comparison, without a method call.
+ * The compiler emits these only when both operands are
+ * statically Int, which is safe because Int methods cannot
+ * be overridden.  Unlike a call, the operands are in source
+ * order, with the right operand on top.
+ *
+ * vm_op_iadd: [a b] -> [a + b]
+ * vm_op_ineg: [a] -> [-a]
+ * vm_op_ilt:  [a b] -> [a < b]   (true or false)
+ */
+extern void vm_op_iadd();
+extern void vm_op_isub();
+extern void vm_op_imul();
+extern void vm_op_idiv();
+extern void vm_op_imod();
+extern void vm_op_ineg();
+extern void vm_op_ilt();
+extern void vm_op_ile();
+extern void vm_op_igt();
+extern void vm_op_ige();
+extern void vm_op_ieq();
+
+/* Unboxed Ints, kept in frame slots of Int variables
+ * as tagged words rather than Int objects.  The Int
+ * instructions above accept either representation.
+ *
+ * load_int n / store_int n: like load and store, unchecked
+ * push_int n: [] -> [n]
+ * box: [n] -> [Int n], unbox: [Int n] -> [n]
+ * vm_op_radd: [a b] -> [a + b], unboxed
+ */
+extern void vm_op_load_int();
+extern void vm_op_store_int();
+extern void vm_op_push_int();
+extern void vm_op_box();
+extern void vm_op_unbox();
+extern void vm_op_radd();
+extern void vm_op_rsub();
+extern void vm_op_rmul();
+extern void vm_op_rdiv();
+extern void vm_op_rmod();
+extern void vm_op_rneg();
+
 
 #endif //TINY_VM_VM_OPS_H
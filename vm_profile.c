@@ -0,0 +1,211 @@
+/* Execution profiles, for profile-guided compilation.
+ * See vm_profile.h.
+ */
+
+#include "vm_profile.h"
+#include "vm_ops.h"
+#include <cjson/cJSON.h>
+#include <assert.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+int vm_profiling = 0;
+
+/* One count per word of the code block, indexed by the
+ * address of an instruction plus the event number; every
+ * event number is within the words of its instruction
+ * (a typeswitch or jump_table is followed by a jump for
+ * each of its alternatives).
+ */
+static long profile_counts[CODE_CAPACITY];
+
+/* Source position of each profiled instruction, or 0 */
+static char *profile_sites[CODE_CAPACITY];
+
+#define MAX_PROFILED_METHODS 500
+static struct profiled_method {
+    char *class_name;
+    char *method_name;
+    int start;  // Index of first word in the code block
+    int end;    // Index of word after the method
+} profiled_methods[MAX_PROFILED_METHODS];
+static int n_profiled_methods = 0;
+
+void vm_profile_count(vm_addr instr, int which) {
+    // Methods of built-in classes are not in the code block
+    if (instr < vm_code_block || instr >= vm_code_block + CODE_CAPACITY) {
+        return;
+    }
+    profile_counts[instr - vm_code_block + which] += 1;
+}
+
+void vm_profile_method(char *class_name, char *method_name,
+                       vm_addr start, vm_addr end) {
+    assert(n_profiled_methods < MAX_PROFILED_METHODS);
+    profiled_methods[n_profiled_methods++] = (struct profiled_method) {
+        .class_name = strdup(class_name),
+        .method_name = strdup(method_name),
+        .start = start - vm_code_block,
+        .end = end - vm_code_block
+    };
+}
+
+void vm_profile_site(vm_addr instr, char *site) {
+    profile_sites[instr - vm_code_block] = strdup(site);
+}
+
+/* Line of source of each run of code: from index on, up to
+ * the index of the next entry.  One entry per index at most,
+ * and one more for the end of the code block.
+ */
+static struct source_line {
+    int index;
+    int line;
+} source_lines[CODE_CAPACITY + 1];
+static int n_source_lines = 0;
+
+void vm_profile_line(vm_addr instr, int line) {
+    int index = instr - vm_code_block;
+    assert(index >= 0 && index <= CODE_CAPACITY);
+    if (n_source_lines > 0) {
+        assert(source_lines[n_source_lines - 1].index <= index);
+        // A method whose code starts where the last one ended
+        if (source_lines[n_source_lines - 1].index == index) {
+            n_source_lines -= 1;
+        }
+    }
+    if (n_source_lines > 0 && source_lines[n_source_lines - 1].line == line) {
+        return;
+    }
+    source_lines[n_source_lines++] = (struct source_line) {
+        .index = index, .line = line
+    };
+}
+
+int vm_source_line(vm_addr instr) {
+    if (instr < vm_code_block || instr >= vm_code_block + CODE_CAPACITY) {
+        return 0;
+    }
+    int index = instr - vm_code_block;
+    // The last entry at or before index
+    int low = 0, high = n_source_lines;
+    while (low < high) {
+        int mid = (low + high) / 2;
+        if (source_lines[mid].index <= index) {
+            low = mid + 1;
+        } else {
+            high = mid;
+        }
+    }
+    return low > 0 ? source_lines[low - 1].line : 0;
+}
+
+void vm_report_position(void) {
+    vm_addr pc = vm_pc;
+    if (pc <= vm_code_block || pc > vm_code_block + CODE_CAPACITY) {
+        // A built-in method: its caller is where it returns to
+        pc = vm_fp[1].code_addr;
+    }
+    // The pc is past the word last fetched
+    int line = vm_source_line(pc - 1);
+    if (line) {
+        fprintf(stderr, "  at line %d\n", line);
+    }
+}
+
+/* The counts of a profiled instruction, and for a dispatch
+ * the class names or values of its alternatives.
+ */
+static cJSON *site_json(int index) {
+    vm_Instr instr = vm_code_block[index].instr;
+    int operand = vm_code_block[index + 1].intval;
+    cJSON *site = cJSON_CreateObject();
+    cJSON_AddStringToObject(site, "site", profile_sites[index]);
+    cJSON *counts = cJSON_AddArrayToObject(site, "counts");
+    int n_counts = 1;
+    if (instr == vm_op_typeswitch) {
+        struct vm_typeswitch *ts = &vm_typeswitches[operand];
+        cJSON *keys = cJSON_AddArrayToObject(site, "keys");
+        for (int i = 0; i < ts->n_classes; ++i) {
+            cJSON_AddItemToArray(keys, cJSON_CreateString(
+                    ts->classes[i]->header.class_name));
+        }
+        n_counts = ts->n_classes + 1;
+    } else if (instr == vm_op_jump_table) {
+        struct vm_jump_table *table = &vm_jump_tables[operand];
+        cJSON *keys = cJSON_AddArrayToObject(site, "keys");
+        for (int i = 0; i < table->n_values; ++i) {
+            cJSON_AddItemToArray(keys, cJSON_CreateNumber(table->values[i]));
+        }
+        n_counts = table->n_values + 1;
+    } else if (instr == vm_op_jump_if || instr == vm_op_jump_ifnot
+               || instr == vm_op_jump_ilt || instr == vm_op_jump_ile
+               || instr == vm_op_jump_igt || instr == vm_op_jump_ige
+               || instr == vm_op_jump_ieq || instr == vm_op_jump_ine) {
+        // Taken, not taken
+        n_counts = 2;
+    }
+    for (int i = 0; i < n_counts; ++i) {
+        cJSON_AddItemToArray(counts,
+                             cJSON_CreateNumber(profile_counts[index + i]));
+    }
+    return site;
+}
+
+int vm_profile_write(char *path) {
+    cJSON *profile = cJSON_CreateObject();
+    for (int m = 0; m < n_profiled_methods; ++m) {
+        struct profiled_method *method = &profiled_methods[m];
+        cJSON *clazz = cJSON_GetObjectItemCaseSensitive(profile,
+                                                        method->class_name);
+        if (!clazz) {
+            clazz = cJSON_AddObjectToObject(profile, method->class_name);
+        }
+        cJSON *record = cJSON_AddObjectToObject(clazz, method->method_name);
+        // Every method starts with "enter", which counts its calls,
+        // unless the "alloc" for its locals comes first
+        int entry = method->start;
+        if (vm_code_block[entry].instr != vm_op_enter) {
+            entry += 2;
+        }
+        cJSON_AddNumberToObject(record, "calls", profile_counts[entry]);
+        cJSON *sites = cJSON_AddObjectToObject(record, "sites");
+        for (int i = method->start; i < method->end; ++i) {
+            if (profile_sites[i]) {
+                char offset[20];
+                snprintf(offset, sizeof offset, "%d", i - method->start);
+                cJSON *site = site_json(i);
+                int line = vm_source_line(&vm_code_block[i]);
+                if (line) {
+                    cJSON_AddNumberToObject(site, "line", line);
+                }
+                cJSON_AddItemToObject(sites, offset, site);
+            }
+        }
+        // (offset, line) where the line changes, as the loader had it
+        cJSON *lines = cJSON_AddArrayToObject(record, "lines");
+        for (int i = 0; i < n_source_lines; ++i) {
+            struct source_line *entry = &source_lines[i];
+            if (entry->index >= method->start && entry->index < method->end
+                && entry->line) {
+                cJSON *pair = cJSON_CreateArray();
+                cJSON_AddItemToArray(pair, cJSON_CreateNumber(
+                        entry->index - method->start));
+                cJSON_AddItemToArray(pair, cJSON_CreateNumber(entry->line));
+                cJSON_AddItemToArray(lines, pair);
+            }
+        }
+    }
+    char *text = cJSON_Print(profile);
+    FILE *f = fopen(path, "w");
+    if (!f) {
+        perror("Failed to write profile");
+        return 0;
+    }
+    fprintf(f, "%s\n", text);
+    fclose(f);
+    free(text);
+    cJSON_Delete(profile);
+    return 1;
+}
@@ -0,0 +1,57 @@
+/* Execution profiles, for profile-guided compilation.
+ *
+ * When asked to (tiny_vm -P file), the VM counts how often
+ * each method is entered, how often each conditional branch
+ * is taken and not taken, which alternative each typeswitch
+ * and jump_table chooses, and how many calls each call site
+ * makes.  At exit the counts are written as JSON, keyed by
+ * class, method and instruction offset (see docs/notes.md).
+ */
+
+#ifndef TINY_VM_VM_PROFILE_H
+#define TINY_VM_VM_PROFILE_H
+
+#include "vm_state.h"
+
+/* Set to collect a profile */
+extern int vm_profiling;
+
+/* Count an event of an instruction in the code block:
+ * 0 for a call or a taken branch, 1 for a branch not
+ * taken, or the alternative a dispatch chose.
+ */
+extern void vm_profile_count(vm_addr instr, int which);
+
+/* Count an event of the instruction whose operand was
+ * just fetched.
+ */
+#define VM_PROFILE_EVENT(which) \
+    do { if (vm_profiling) vm_profile_count(vm_pc - 2, (which)); } while (0)
+
+/* The loader records where each method is, and the source
+ * position the compiler gave each instruction it profiles.
+ */
+extern void vm_profile_method(char *class_name, char *method_name,
+                              vm_addr start, vm_addr end);
+extern void vm_profile_site(vm_addr instr, char *site);
+
+/* Lines of source.  The loader gives the line the code from
+ * each address on comes from, where it changes (0 where it is
+ * not known), in order of address.  Kept whether or not the
+ * VM profiles, as only errors and profiles look them up.
+ */
+extern void vm_profile_line(vm_addr instr, int line);
+/* Line of the instruction at or before an address, or 0 */
+extern int vm_source_line(vm_addr instr);
+/* Before reporting a runtime error: print the line of the
+ * instruction being run (or, in a built-in method, of the
+ * call to it) to stderr, if known
+ */
+extern void vm_report_position(void);
+
+/* Write the counts to a JSON file.
+ * Return 1 = success, 0 = failure.
+ */
+extern int vm_profile_write(char *path);
+
+#endif //TINY_VM_VM_PROFILE_H
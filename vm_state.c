@@ -5,11 +5,13 @@
 
 #include "vm_state.h"
 #include "vm_code_table.h"
+#include "vm_profile.h"  // For vm_report_position
 #include "logger.h"
 #include "builtins.h"  // For debugging only
 #include <assert.h>
 #include <stdio.h>
 #include <string.h>
+#include <stdlib.h>
 
 /* The concrete data structures live here */
 
@@ -81,6 +83,22 @@ vm_Word vm_frame_top_word() {
     return value;
 }
 
+/* Built-in classes are trusted.  A native method's frame
+ * holds the saved pc and fp and its result.
+ */
+int vm_verified = 1;
+int vm_frame_bound = 3;
+
+void vm_frame_preflight(void) {
+    if (vm_verified
+        && vm_sp + vm_frame_bound >= vm_frame_stack + FRAME_CAPACITY) {
+        fprintf(stderr, "Frame stack overflow (capacity %d words)\n",
+                FRAME_CAPACITY);
+        vm_report_position();
+        exit(1);
+    }
+}
+
 /* While many higher level VMs (e.g., the Java virtual machine) keep
  * a separate stack for expression evaluation, we will integrate the
  * evaluation stack with the procedure call stack.  This is closer to
@@ -150,6 +168,7 @@ extern int lookup_const_index(char *literal) {
  * entry the new constant object will have in the constant pool.
  */
 extern int create_const_value(char *literal, obj_ref value) {
+    assert(vm_next_const < CONST_POOL_CAPACITY);
     int const_index = vm_next_const;
     vm_next_const += 1;
     vm_constant_pool[const_index].name = strdup(literal);
@@ -223,6 +242,11 @@ char *guess_description(vm_Word w) {
         sprintf(buff, "(int) %d", w.intval);
         return buff;
     }
+    /* An unboxed Int? */
+    if (VM_IS_RAW_INT(w)) {
+        sprintf(buff, "(raw int) %d", VM_RAW_VALUE(w));
+        return buff;
+    }
     /* The remaining checks all assume it is
      * a valid (readable) memory address.
      * I really need exception handling for the
@@ -286,7 +310,11 @@ void vm_step() {
     char *name = guess_description((vm_Word) instr);
     log_debug("Step:  %s",name );
     (*instr)();
-    health_check_builtins();
+    if (! vm_verified) {
+        // Verified code can't pop or store beyond its frame,
+        // so it can't damage the builtin classes either
+        health_check_builtins();
+    }
     stack_dump(8);
 }
 
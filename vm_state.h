@@ -13,9 +13,9 @@
 #ifndef TINY_VM_VM_STATE_H
 #define TINY_VM_VM_STATE_H
 
-#define CODE_CAPACITY    1024  // Max # instruction words
+#define CODE_CAPACITY    65536 // Max # instruction words
 #define FRAME_CAPACITY   1024    // Procedure call stack words
-#define CONST_POOL_CAPACITY 128  // Constant objects, created during loading
+#define CONST_POOL_CAPACITY 4096 // Constant objects, created during loading
 
 /* Core definitions shared with
  * builtins.h
@@ -84,6 +84,18 @@ extern vm_Word vm_frame_top_word();  // Without popping
 /*  roll 2: [ob x y] -> [x y ob] */
 extern void vm_roll(int n);
 
+/* Verified code (see verify.py).  While every loaded method
+ * has been verified, vm_verified is set, and vm_frame_bound
+ * is the most words of frame stack one call can use (saved pc
+ * and fp, locals and stack).  The loader keeps both up to date.
+ */
+extern int vm_verified;
+extern int vm_frame_bound;
+/* Before a call, check there is room on the frame stack
+ * for the frame of any method (if verified; else no check)
+ */
+extern void vm_frame_preflight(void);
+
 /* Debugging */
 void stack_dump(int n_words);
 extern void dump_constants(void);